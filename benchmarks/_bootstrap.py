@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+基准脚本的公共部分。
+
+插件目录本身不是可导入的顶层包，这里把它的上级目录放进 sys.path，再按目录名导入插件模块；
+src.* 由 MaiBot 提供，所以脚本要在 MaiBot 根目录下运行：
+
+    cd /path/to/MaiBot && python plugins/<插件目录>/benchmarks/bench_xxx.py
+"""
+
+from __future__ import annotations
+
+import base64
+import importlib
+import io
+import subprocess
+import sys
+import tarfile
+import tempfile
+from pathlib import Path
+from types import ModuleType
+
+PLUGIN_DIR = Path(__file__).resolve().parent.parent
+
+
+def load(module: str) -> ModuleType:
+    """导入插件内的模块，如 load("wd14_client")。"""
+    for path in (str(Path.cwd()), str(PLUGIN_DIR.parent)):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+    return importlib.import_module(f"{PLUGIN_DIR.name}.{module}")
+
+
+def load_at(module: str, rev: str) -> ModuleType:
+    """导入某个 git 版本的插件模块，用来和优化前对比，如 load_at("core.utils.prompt_postprocessor", "83e8991~1")。
+
+    该版本的文件用 git archive 解到临时目录，作为独立的包导入，不影响当前代码。
+    """
+    commit = subprocess.run(
+        ["git", "-C", str(PLUGIN_DIR), "rev-parse", "--short", rev], check=True, capture_output=True, text=True
+    ).stdout.strip()
+    package = f"llm2pic_{commit}"
+    root = Path(tempfile.gettempdir()) / "llm2pic_bench"
+    target = root / package
+    if not target.is_dir():
+        archive = subprocess.run(["git", "-C", str(PLUGIN_DIR), "archive", commit], check=True, capture_output=True)
+        with tarfile.open(fileobj=io.BytesIO(archive.stdout)) as tar:
+            # filter 参数在 3.11.4 才加入
+            tar.extractall(target, **({"filter": "data"} if hasattr(tarfile, "data_filter") else {}))
+    for path in (str(Path.cwd()), str(root)):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+    return importlib.import_module(f"{package}.{module}")
+
+
+def sample_jpeg_base64(size: tuple[int, int] = (4000, 3000), quality: int = 90, path: str = "") -> str:
+    """基准用图片：给了 path 就读文件，否则生成一张带噪声的渐变照片（JPEG 压不小，接近真实照片）。"""
+    if path:
+        return base64.b64encode(Path(path).read_bytes()).decode()
+    from PIL import Image
+
+    width, height = size
+    noise = Image.effect_noise(size, 48)
+    red = Image.linear_gradient("L").resize(size)
+    green = Image.linear_gradient("L").rotate(90).resize(size)
+    image = Image.merge("RGB", (Image.blend(red, noise, 0.35), Image.blend(green, noise, 0.35), noise))
+    buf = io.BytesIO()
+    image.save(buf, format="JPEG", quality=quality)
+    return base64.b64encode(buf.getvalue()).decode()
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+prompt 后处理基准共用的语料（user-031 / 032 / 034）。
+
+data/llm_replies.jsonl 每行是一条 LLM 原始回复（JSON 字符串），格式与生成器模板要求的一致：
+v3 JSON（single / multi + people / positions）、代码块包裹、前后夹带闲聊或 <think>、旧版 prompt 字段、纯文本 tag。
+回复先经 prompt_output_parser 解析成交给后处理链的 prompt 字符串；条数不足 size 时，
+以这些 prompt 为模板按固定种子变换（删减/打乱/加权重/混入常见 tag）补足。
+
+仓库里没有可公开的线上回复日志，内置回复是按模板输出格式整理的样例；
+要在真实数据上跑，用 --corpus 指向同格式的导出文件（每行一条回复的 JSON 字符串），并加 --size 0。
+"""
+
+from __future__ import annotations
+
+import json
+import random
+from pathlib import Path
+
+from _bootstrap import load
+
+DEFAULT_REPLIES = Path(__file__).resolve().parent / "data" / "llm_replies.jsonl"
+
+_EXTRA_TAGS = (
+    "looking at viewer", "blush", "open mouth", "long hair", "short hair", "white hair", "blue eyes",
+    "hair ribbon", "hair ornament", "ponytail", "bangs", "thighs", "bikini", "see-through", "outdoors",
+    "night", "rain", "sunset", "city street", "depth of field", "from above", "close-up", "year 2024",
+    "azuma_seren", "nsfw", "source#hug", "mutual#holding hands", "grabbing breast", "no bra", "pov",
+)
+
+
+def _vary(prompt: str, rng: random.Random) -> str:
+    lines = []
+    for line in prompt.split("\n"):
+        tags = [tag.strip() for tag in line.split(",") if tag.strip()]
+        if not tags:
+            continue
+        head = tags[0] if tags[0].lower().startswith("char") else ""
+        body = tags[1:] if head else tags
+        body = [tag for tag in body if rng.random() > 0.2]
+        body += rng.sample(_EXTRA_TAGS, rng.randint(0, 4))
+        rng.shuffle(body)
+        weighted = []
+        for tag in body:
+            roll = rng.random()
+            if roll < 0.08:
+                tag = "{" + tag + "}"
+            elif roll < 0.12:
+                tag = "[" + tag + "]"
+            elif roll < 0.15:
+                tag = f"1.2::{tag}::"
+            weighted.append(tag)
+        lines.append(", ".join(([head] if head else []) + weighted) + ("," if "\n" in prompt else ""))
+    return "\n".join(lines)
+
+
+def load_prompts(path: str = "", size: int = 2000, seed: int = 1) -> list[str]:
+    """返回交给后处理链的 prompt 列表：文件中的回复全部在前，不足 size 时用变换样本补足。"""
+    parser = load("core.utils.prompt_output_parser")
+    source = Path(path) if path else DEFAULT_REPLIES
+    replies = [json.loads(line) for line in source.read_text(encoding="utf-8").splitlines() if line.strip()]
+    prompts = [parser.parse_llm_output(reply).prompt or reply.strip() for reply in replies]
+    rng = random.Random(seed)
+    templates = list(prompts)
+    while len(prompts) < size:
+        prompts.append(_vary(rng.choice(templates), rng))
+    return prompts
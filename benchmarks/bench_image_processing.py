@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+图片处理执行器对事件循环的影响（user-041）。
+
+10 张 3840x2160 附图并发做 WD14 + NAI 缩图，用 10ms 一跳的探针协程测事件循环最长卡顿：
+- inline：直接在事件循环里调用（旧行为）
+- thread：ImageProcessor 线程池（默认）
+- process：ImageProcessor forkserver 进程池（插件包需可被子进程导入）
+
+    python plugins/<插件目录>/benchmarks/bench_image_processing.py [--jobs 10] [--workers 2] [--image photo.jpg]
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import time
+
+from _bootstrap import load, sample_jpeg_base64
+
+
+async def _lag_probe(stop: asyncio.Event) -> float:
+    worst = 0.0
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(0.01)
+        worst = max(worst, time.perf_counter() - started - 0.01)
+    return worst
+
+
+async def _scenario(mode: str, image: str, jobs: int, workers: int) -> None:
+    utils = load("utils")
+    image_processing = load("image_processing")
+
+    stop = asyncio.Event()
+    probe = asyncio.create_task(_lag_probe(stop))
+    await asyncio.sleep(0.05)
+    started = time.perf_counter()
+    if mode == "inline":
+        for _ in range(jobs):
+            utils._resize_image_for_wd14(image, 1024)
+            utils._resize_image_for_nai(image, (832, 1216))
+            await asyncio.sleep(0)
+        fallback = False
+    else:
+        processor = image_processing.ImageProcessor(workers, mode, 60.0)
+        calls = []
+        for _ in range(jobs):
+            calls.append(processor.run(utils._resize_image_for_wd14, image, 1024, op="wd14"))
+            calls.append(processor.run(utils._resize_image_for_nai, image, (832, 1216), op="nai"))
+        await asyncio.gather(*calls)
+        fallback = mode == "process" and not processor.uses_processes
+        processor.shutdown()
+    total = time.perf_counter() - started
+    stop.set()
+    worst = await probe
+    note = "  (进程池不可用，已退回线程池)" if fallback else ""
+    print(f"{mode:8s} total {total * 1000:7.0f} ms   worst loop stall {worst * 1000:7.1f} ms{note}")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", type=int, default=10)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--image", default="", help="用真实照片代替生成的 3840x2160 测试图")
+    args = parser.parse_args()
+    image = sample_jpeg_base64((3840, 2160), 92, args.image)
+    for mode in ("inline", "thread", "process"):
+        await _scenario(mode, image, args.jobs, args.workers)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+后处理函数的单次调用开销与内存分配（user-034）：规则表预编译到模块级之后，每次调用不再重建集合与正则。
+
+对 remove_selfie_appearance_tags / remove_self_character_tags / 整条链，在语料上报告每次调用的耗时，
+以及 tracemalloc 记录的单次调用峰值分配（语料平均值和一个 3 个 tag 的短 prompt）；
+给了 --baseline 时同时测该 git 版本。语料见 _prompt_corpus.py。
+
+    python plugins/<插件目录>/benchmarks/bench_postprocess_alloc.py [--baseline 7d880f6~1] [--size 2000] [--corpus replies.jsonl]
+"""
+
+from __future__ import annotations
+
+import argparse
+import gc
+import time
+import tracemalloc
+from typing import Callable
+
+from _bootstrap import load, load_at
+from _prompt_corpus import load_prompts
+
+SHORT_PROMPT = "silver hair, twintails, smile"
+
+
+def _functions(module) -> dict[str, Callable[[str], str]]:
+    def _chain(prompt: str) -> str:
+        if hasattr(module, "postprocess_prompt"):
+            return module.postprocess_prompt(
+                prompt,
+                remove_self_character=True,
+                remove_persona_appearance=True,
+                remove_selfie_appearance=True,
+                normalize_order=True,
+                sanitize_sfw=True,
+            )
+        prompt = module.remove_self_character_tags(prompt, remove_persona_appearance=True)
+        prompt = module.remove_selfie_appearance_tags(prompt)
+        return module.sanitize_sfw_prompt(module.normalize_prompt_order(prompt))
+
+    return {
+        "remove_selfie_appearance_tags": module.remove_selfie_appearance_tags,
+        "remove_self_character_tags": lambda prompt: module.remove_self_character_tags(
+            prompt, remove_persona_appearance=True
+        ),
+        "full chain": _chain,
+    }
+
+
+def _per_call_seconds(fn: Callable[[str], str], prompts: list[str], runs: int) -> float:
+    best = float("inf")
+    for _ in range(runs):
+        started = time.perf_counter()
+        for prompt in prompts:
+            fn(prompt)
+        best = min(best, time.perf_counter() - started)
+    return best / len(prompts)
+
+
+def _per_call_peak(fn: Callable[[str], str], prompts: list[str]) -> float:
+    """单次调用期间的峰值分配（字节），取平均。"""
+    fn(prompts[0])
+    gc.collect()
+    tracemalloc.start()
+    total = 0
+    for prompt in prompts:
+        baseline, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        fn(prompt)
+        _, peak = tracemalloc.get_traced_memory()
+        total += peak - baseline
+    tracemalloc.stop()
+    return total / len(prompts)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--baseline", default="", help="对比的 git 版本，如 7d880f6~1（规则表预编译之前）")
+    parser.add_argument("--size", type=int, default=2000)
+    parser.add_argument("--corpus", default="", help="LLM 回复文件（每行一条回复的 JSON 字符串）")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    prompts = load_prompts(args.corpus, args.size)
+    sample = prompts[:300]
+    print(f"{len(prompts)} 条 prompt 计时，前 {len(sample)} 条测分配；短 prompt: {SHORT_PROMPT!r}")
+
+    versions = {"current": load("core.utils.prompt_postprocessor")}
+    if args.baseline:
+        versions[args.baseline] = load_at("core.utils.prompt_postprocessor", args.baseline)
+    for version, module in versions.items():
+        print(f"-- {version}")
+        for name, fn in _functions(module).items():
+            print(
+                f"   {name:30s} {_per_call_seconds(fn, prompts, args.runs) * 1e6:7.1f} us/call"
+                f"   peak {_per_call_peak(fn, sample):7.0f} B/call"
+                f"   short {_per_call_seconds(fn, [SHORT_PROMPT] * 2000, args.runs) * 1e6:5.1f} us,"
+                f" {_per_call_peak(fn, [SHORT_PROMPT] * 50):5.0f} B"
+            )
+
+
+if __name__ == "__main__":
+    main()
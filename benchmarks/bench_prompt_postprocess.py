@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+prompt 后处理链耗时（user-031）：一次解析成 tag AST、一次遍历、一次序列化。
+
+整条链（去 bot 角色 tag + 人设外貌、去自拍外貌、调整顺序、SFW 清洗）在语料上逐条运行，报告每条 prompt 的耗时；
+给了 --baseline 时，同时运行该 git 版本的实现（旧版依次调用四个函数），并核对不含角色行的 prompt 输出是否一致。
+语料见 _prompt_corpus.py。
+
+    python plugins/<插件目录>/benchmarks/bench_prompt_postprocess.py [--baseline 83e8991~1] [--size 2000] [--corpus replies.jsonl]
+"""
+
+from __future__ import annotations
+
+import argparse
+import time
+from typing import Callable
+
+from _bootstrap import load, load_at
+from _prompt_corpus import load_prompts
+
+
+def _chain(module) -> Callable[[str], str]:
+    if hasattr(module, "postprocess_prompt"):
+        return lambda prompt: module.postprocess_prompt(
+            prompt,
+            remove_self_character=True,
+            remove_persona_appearance=True,
+            remove_selfie_appearance=True,
+            normalize_order=True,
+            sanitize_sfw=True,
+        )
+
+    def _sequential(prompt: str) -> str:
+        prompt = module.remove_self_character_tags(prompt, remove_persona_appearance=True)
+        prompt = module.remove_selfie_appearance_tags(prompt)
+        prompt = module.normalize_prompt_order(prompt)
+        return module.sanitize_sfw_prompt(prompt)
+
+    return _sequential
+
+
+def _best_of(runs: int, fn: Callable[[str], str], prompts: list[str]) -> float:
+    best = float("inf")
+    for _ in range(runs):
+        started = time.perf_counter()
+        for prompt in prompts:
+            fn(prompt)
+        best = min(best, time.perf_counter() - started)
+    return best / len(prompts)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--baseline", default="", help="对比的 git 版本，如 83e8991~1（AST 改造之前）")
+    parser.add_argument("--size", type=int, default=2000)
+    parser.add_argument("--corpus", default="", help="LLM 回复文件（每行一条回复的 JSON 字符串）")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    prompts = load_prompts(args.corpus, args.size)
+    print(f"{len(prompts)} 条 prompt，平均 {sum(len(p) for p in prompts) / len(prompts):.0f} 字符，取 {args.runs} 轮最好成绩")
+
+    chains = {"current": _chain(load("core.utils.prompt_postprocessor"))}
+    if args.baseline:
+        chains[args.baseline] = _chain(load_at("core.utils.prompt_postprocessor", args.baseline))
+    for name, fn in chains.items():
+        print(f"{name:12s} {_best_of(args.runs, fn, prompts) * 1e6:8.1f} us/prompt")
+
+    if args.baseline:
+        current, baseline = chains["current"], chains[args.baseline]
+        plain = [p for p in prompts if "char" not in p.lower() and "::" not in p]
+        differing = sum(current(p) != baseline(p) for p in plain)
+        print(f"不含角色行/权重语法的 {len(plain)} 条 prompt 中，输出与 {args.baseline} 不同的有 {differing} 条")
+
+
+if __name__ == "__main__":
+    main()
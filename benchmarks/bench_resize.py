@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+附图缩放的耗时、峰值内存与画质（user-042）。
+
+对一张 12MP（4000x3000）JPEG 分别做 WD14 / 编辑 / NAI 参考图缩放，比较 fast / quality / exact 三种模式：
+每个组合在独立子进程里跑，取 5 次中位数耗时与峰值 RSS 增量，并给出相对 exact 的 PSNR
+（不给 --image 时用生成的带噪声渐变图，比真实照片难压缩，数值只适合横向比较）。
+
+    python plugins/<插件目录>/benchmarks/bench_resize.py [--image photo.jpg] [--runs 5]
+
+峰值 RSS 依赖 resource 模块（仅 Unix）。
+"""
+
+from __future__ import annotations
+
+import argparse
+import base64
+import json
+import math
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from _bootstrap import load, sample_jpeg_base64
+
+CASES = {
+    "wd14": ("_resize_image_for_wd14", (1024,)),
+    "edit": ("_resize_image_for_edit", (1_000_000,)),
+    "nai": ("_resize_image_for_nai", ((832, 1216),)),
+}
+MODES = ("exact", "quality", "fast")
+
+
+def _run_case(case: str, mode: str, image_path: str, runs: int, output: str) -> None:
+    """子进程：跑一个 (用途, 模式) 组合，把耗时与峰值内存以 JSON 打到 stdout，结果图写到 output。"""
+    import resource
+
+    utils = load("utils")
+    fn_name, args = CASES[case]
+    fn = getattr(utils, fn_name)
+    # 父进程已写好 base64 文本，直接读入，避免编码时的临时副本抬高基线峰值
+    image = Path(image_path).read_text()
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    timings = []
+    result = ""
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = fn(image, *args, mode=mode)
+        timings.append(time.perf_counter() - started)
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline
+    Path(output).write_bytes(base64.b64decode(result.split(",", 1)[-1]))
+    timings.sort()
+    print(json.dumps({"median_ms": timings[len(timings) // 2] * 1000, "peak_mb": peak_kb / 1024}))
+
+
+def _psnr(path_a: Path, path_b: Path) -> float:
+    from PIL import Image, ImageChops, ImageStat
+
+    a = Image.open(path_a).convert("RGB")
+    b = Image.open(path_b).convert("RGB")
+    if a.size != b.size:
+        return float("nan")
+    mse = sum(value ** 2 for value in ImageStat.Stat(ImageChops.difference(a, b)).rms) / 3
+    return float("inf") if mse == 0 else 10 * math.log10(255 ** 2 / mse)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--image", default="", help="用真实照片代替生成的 4000x3000 测试图")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--case", help=argparse.SUPPRESS)
+    parser.add_argument("--mode", help=argparse.SUPPRESS)
+    parser.add_argument("--output", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.case == "prepare":
+        Path(args.output).write_text(sample_jpeg_base64((4000, 3000), 90, args.image))
+        return
+    if args.case:
+        _run_case(args.case, args.mode, args.image, args.runs, args.output)
+        return
+
+    # Linux 下子进程的 ru_maxrss 从 fork 时父进程的峰值起算，所以父进程不碰大图：生成测试图、
+    # 跑每个组合都放在子进程里，PSNR 等全部跑完再算
+    def child(*extra: str) -> str:
+        command = [sys.executable, __file__, "--runs", str(args.runs), *extra]
+        return subprocess.run(command, check=True, capture_output=True, text=True).stdout
+
+    workdir = Path(tempfile.mkdtemp(prefix="llm2pic-bench-"))
+    source = workdir / "source.b64"
+    child("--case", "prepare", "--image", args.image, "--output", str(source))
+    stats = {}
+    for case in CASES:
+        for mode in MODES:
+            output = str(workdir / f"{case}-{mode}.img")
+            stdout = child("--case", case, "--mode", mode, "--image", str(source), "--output", output)
+            stats[case, mode] = json.loads(stdout.strip().splitlines()[-1])
+    for (case, mode), row in stats.items():
+        quality = ""
+        if mode != "exact":
+            quality = f"   PSNR vs exact {_psnr(workdir / f'{case}-{mode}.img', workdir / f'{case}-exact.img'):5.1f} dB"
+        print(f"{case:5s} {mode:8s} median {row['median_ms']:7.1f} ms   peak RSS +{row['peak_mb']:5.1f} MB{quality}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+SFW 违禁 tag 匹配随违禁词表规模的变化（user-032）。
+
+语料里的全部 tag 逐个判定，对比四种做法（结果先核对一致）：
+- naive loop：旧版 is_forbidden，逐个子串 `in`
+- plain alternation：所有子串拼成一个普通 | 正则
+- trie per tag：SfwTagMatcher.is_forbidden（前缀合并的 trie 正则）
+- trie one scan：SfwTagMatcher.classify，整批 tag 拼成一段文本扫一遍
+
+违禁子串表在内置规则之外用固定种子的随机词补足到 --sizes 给出的条数。语料见 _prompt_corpus.py。
+
+    python plugins/<插件目录>/benchmarks/bench_sfw_matcher.py [--sizes 1000] [--size 2000] [--corpus replies.jsonl]
+"""
+
+from __future__ import annotations
+
+import argparse
+import random
+import re
+import time
+from typing import Callable
+
+from _bootstrap import load
+from _prompt_corpus import load_prompts
+
+_RELATION_PREFIX_RE = re.compile(r"^(?:source|target|mutual)#")
+
+
+def _random_words(count: int, seed: int = 1) -> list[str]:
+    rng = random.Random(seed)
+    words = []
+    for _ in range(count):
+        word = "".join(rng.choice("abcdefghijklmnopqrstuvwxyz ") for _ in range(rng.randint(4, 14))).strip()
+        words.append(word or "zz")
+    return words
+
+
+def _best_of(runs: int, fn: Callable[[], object]) -> float:
+    best = float("inf")
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="1000", help="违禁子串表补足到的条数，逗号分隔（内置表总会测）")
+    parser.add_argument("--size", type=int, default=2000)
+    parser.add_argument("--corpus", default="", help="LLM 回复文件（每行一条回复的 JSON 字符串）")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    postprocessor = load("core.utils.prompt_postprocessor")
+    prompt_ast = load("core.utils.prompt_ast")
+    sfw = postprocessor.load_postprocess_rules().data.get("sfw") or {}
+    exact = frozenset(str(tag).strip().lower() for tag in sfw.get("banned_exact") or ())
+    builtin = [str(word).strip().lower() for word in sfw.get("banned_substrings") or ()]
+
+    cores = [tag.core for prompt in load_prompts(args.corpus, args.size) for tag in prompt_ast.parse_prompt(prompt).iter_tags()]
+    print(f"{len(cores)} 个 tag，精确违禁 {len(exact)} 条，取 {args.runs} 轮最好成绩")
+
+    sizes = [len(builtin)] + [int(size) for size in args.sizes.split(",") if size.strip() and int(size) > len(builtin)]
+    for size in sizes:
+        substrings = builtin + _random_words(size - len(builtin))
+        alternation = re.compile("|".join(map(re.escape, sorted(substrings, key=len, reverse=True))))
+        matcher = postprocessor.SfwTagMatcher(exact, substrings)
+
+        def naive(core: str) -> bool:
+            core = _RELATION_PREFIX_RE.sub("", core).strip()
+            return bool(core) and (core in exact or any(word in core for word in substrings))
+
+        def alternated(core: str) -> bool:
+            core = _RELATION_PREFIX_RE.sub("", core).strip()
+            return bool(core) and (core in exact or alternation.search(core) is not None)
+
+        expected = [naive(core) for core in cores]
+        assert expected == [alternated(core) for core in cores] == matcher.classify(cores)
+        assert expected == [matcher.is_forbidden(core) for core in cores]
+
+        cases = (
+            ("naive loop", lambda: [naive(core) for core in cores]),
+            ("plain alternation", lambda: [alternated(core) for core in cores]),
+            ("trie per tag", lambda: [matcher.is_forbidden(core) for core in cores]),
+            ("trie one scan", lambda: matcher.classify(cores)),
+        )
+        print(f"-- {size} 条违禁子串，命中 {sum(expected)} 个 tag")
+        for name, fn in cases:
+            print(f"   {name:18s} {_best_of(args.runs, fn) * 1e9 / len(cores):8.0f} ns/tag")
+
+
+if __name__ == "__main__":
+    main()
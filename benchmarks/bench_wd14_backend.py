@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+本地 ONNX 反推后端与远程 endpoint 的耗时对比（user-048）。
+
+需要真实的 WD14 模型目录（model.onnx + selected_tags.csv，如 SmilingWolf/wd-swinv2-tagger-v3）；
+远程一侧默认是本机 stub HTTP 服务，按 --rtt 模拟网络往返，也可用 --endpoint 指向真实服务。
+每张图都是不同的 1024px JPEG，直接调用后端的 tag()，不经过反推缓存。
+
+    python plugins/<插件目录>/benchmarks/bench_wd14_backend.py --model-dir /path/to/wd-swinv2-tagger-v3 \
+        [--images 8] [--concurrency 8] [--rtt 0.15] [--endpoint https://...] [--threads 2] [--batch-size 4]
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from _bootstrap import load, sample_jpeg_base64
+
+_STUB_RESPONSE = json.dumps(
+    {"prompt": "1girl, solo", "general": {"1girl": 0.98, "solo": 0.95}, "character": {}, "rating": {"general": 0.9}}
+).encode()
+
+
+def _start_stub(rtt: float) -> str:
+    """读完请求体后睡 rtt 秒再返回固定结果，只模拟网络往返，不含服务端推理时间。"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self) -> None:
+            self.rfile.read(int(self.headers.get("Content-Length", "0")))
+            time.sleep(rtt)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(_STUB_RESPONSE)))
+            self.end_headers()
+            self.wfile.write(_STUB_RESPONSE)
+
+        def log_message(self, *args) -> None:
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}/tag"
+
+
+async def _measure(label: str, backend, images: list[str], concurrency: int) -> None:
+    started = time.perf_counter()
+    await backend.tag(images[0], 0.35, 120.0)
+    first = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for image in images:
+        await backend.tag(image, 0.35, 120.0)
+    sequential = (time.perf_counter() - started) / len(images)
+
+    batch = (images * (concurrency // len(images) + 1))[:concurrency]
+    started = time.perf_counter()
+    await asyncio.gather(*(backend.tag(image, 0.35, 120.0) for image in batch))
+    concurrent = time.perf_counter() - started
+
+    print(
+        f"{label:7s} first call {first * 1000:7.0f} ms   sequential {sequential * 1000:7.0f} ms/img   "
+        f"{concurrency} concurrent {concurrent * 1000:7.0f} ms total"
+    )
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model-dir", default="", help="WD14 模型目录，默认是插件数据目录下的 wd14_model")
+    parser.add_argument("--images", type=int, default=8)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rtt", type=float, default=0.15, help="stub endpoint 的模拟往返时间（秒）")
+    parser.add_argument("--endpoint", default="", help="改用真实远程 endpoint")
+    parser.add_argument("--threads", type=int, default=2)
+    parser.add_argument("--batch-size", type=int, default=4)
+    args = parser.parse_args()
+
+    metrics = load("metrics")
+    wd14_client = load("wd14_client")
+    wd14_local = load("wd14_local")
+
+    images = [sample_jpeg_base64((1024, 768), 88) for _ in range(max(1, args.images))]
+    endpoint = args.endpoint or _start_stub(args.rtt)
+    print(f"{len(images)} 张 1024x768 JPEG；远程: {args.endpoint or f'本机 stub，RTT {args.rtt * 1000:.0f}ms'}")
+
+    await _measure("remote", wd14_client.RemoteWd14Backend(endpoint), images, args.concurrency)
+
+    tagger = wd14_local.get_local_tagger(args.model_dir, args.threads, args.batch_size)
+    if tagger is None:
+        print("local   不可用（见上方告警：需要 onnxruntime 与模型文件）")
+        return
+    try:
+        await _measure("local", tagger, images, args.concurrency)
+    finally:
+        wd14_local.reset_local_tagger()
+    print(metrics.format_report("wd14.local"))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
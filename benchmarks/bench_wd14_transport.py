@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+WD14 上传方式对比（user-049）：json（base64）/ octet-stream / multipart。
+
+本机 stub endpoint 三种格式都接受，并对 json-only endpoint 演示 auto 协商只多一次被拒的二进制请求。
+每种方式报告：请求体大小、客户端每次请求耗时、服务端解析请求体耗时、客户端峰值分配（tracemalloc）。
+
+    python plugins/<插件目录>/benchmarks/bench_wd14_transport.py [--requests 30] [--image photo.jpg]
+"""
+
+from __future__ import annotations
+
+import argparse
+import base64
+import json
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from _bootstrap import load, sample_jpeg_base64
+
+_RESPONSE = json.dumps({"prompt": "1girl, solo", "general": {"1girl": 0.9}, "character": {}, "rating": {}}).encode()
+
+
+class _Stub:
+    """本机 WD14 stub：记录每个请求的 Content-Type、体积和解析耗时。"""
+
+    def __init__(self, json_only: bool) -> None:
+        self.seen: list[str] = []
+        self.body_bytes: list[int] = []
+        self.parse_seconds: list[float] = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self) -> None:
+                content_type = self.headers["Content-Type"]
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                stub.seen.append(content_type.split(";")[0])
+                if json_only and not content_type.startswith("application/json"):
+                    self.send_response(415)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                started = time.perf_counter()
+                image = stub.parse(content_type, body)
+                stub.parse_seconds.append(time.perf_counter() - started)
+                stub.body_bytes.append(len(body))
+                assert image[:2] == b"\xff\xd8", "stub 收到的不是 JPEG"
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(_RESPONSE)))
+                self.end_headers()
+                self.wfile.write(_RESPONSE)
+
+            def log_message(self, *args) -> None:
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.endpoint = f"http://127.0.0.1:{self.server.server_port}/tag"
+
+    @staticmethod
+    def parse(content_type: str, body: bytes) -> bytes:
+        if content_type.startswith("application/json"):
+            return base64.b64decode(json.loads(body)["image_base64"])
+        if content_type.startswith("multipart/form-data"):
+            boundary = content_type.split("boundary=", 1)[1].encode()
+            for part in body.split(b"--" + boundary):
+                if b'name="image"' in part:
+                    return part.split(b"\r\n\r\n", 1)[1][:-2]
+            raise ValueError("multipart 里没有 image 字段")
+        return body
+
+    def reset(self) -> None:
+        self.seen.clear()
+        self.body_bytes.clear()
+        self.parse_seconds.clear()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=30)
+    parser.add_argument("--image", default="", help="用真实照片代替生成的 1024x768 测试图")
+    args = parser.parse_args()
+
+    wd14_client = load("wd14_client")
+    image = sample_jpeg_base64((1024, 768), 88, args.image)
+    print(f"JPEG {len(base64.b64decode(image)) // 1024} KB，base64 {len(image) // 1024} KB，每种方式 {args.requests} 次")
+
+    stub = _Stub(json_only=False)
+    for transport in (wd14_client.TRANSPORT_JSON, wd14_client.TRANSPORT_OCTET_STREAM, wd14_client.TRANSPORT_MULTIPART):
+        wd14_client._call_wd14_endpoint(image, stub.endpoint, 0.35, 10, transport)
+        stub.reset()
+        started = time.perf_counter()
+        for _ in range(args.requests):
+            wd14_client._call_wd14_endpoint(image, stub.endpoint, 0.35, 10, transport)
+        client = (time.perf_counter() - started) / args.requests
+        tracemalloc.start()
+        wd14_client._call_wd14_endpoint(image, stub.endpoint, 0.35, 10, transport)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        parse = sum(stub.parse_seconds) / len(stub.parse_seconds)
+        print(
+            f"{transport:13s} body {stub.body_bytes[0] // 1024:5d} KB   client {client * 1000:6.2f} ms/req   "
+            f"server parse {parse * 1000:5.2f} ms   client peak alloc {peak // 1024:5d} KB"
+        )
+
+    json_only = _Stub(json_only=True)
+    wd14_client.reset_transport_negotiation()
+    for _ in range(3):
+        wd14_client._call_wd14_endpoint(image, json_only.endpoint, 0.35, 10, wd14_client.TRANSPORT_AUTO)
+    print(f"json-only endpoint + auto，3 次调用实际发出: {json_only.seen}")
+
+
+if __name__ == "__main__":
+    main()
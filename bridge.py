@@ -4,8 +4,9 @@
 将生图逻辑桥接到 rdev 原生运行时上下文。
 """
 
-from dataclasses import dataclass
-from typing import Any, Mapping, Optional
+import asyncio
+from dataclasses import dataclass, replace
+from typing import Any, AsyncIterator, Mapping, Optional
 import re
 import time
 
@@ -15,6 +16,8 @@ from .danbooru_generator import (
     _validate_prompt_llm_response,
     _cleanup_llm_prompt,
 )
+from . import metrics
+from .runtime_config import RuntimeConfig, get_runtime_config
 from .utils import download_image_to_base64, _peel_envelope
 from .style_router import LLMOutputParser, DEFAULT_SYSTEM_PROMPT
 from .actions import DrawPictureToolMetadata
@@ -29,6 +32,11 @@ logger = get_logger("MaiBot_LLM2pic")
 class _LLMTarget:
     task_name: str = "planner"
     model_name: Optional[str] = None
+    race_targets: tuple["_LLMTarget", ...] = ()
+
+    @property
+    def label(self) -> str:
+        return self.model_name or self.task_name
 
 
 
@@ -51,41 +59,101 @@ class _FallbackLLMProxy:
         self._target = target
 
     async def generate(self, **kwargs: Any) -> dict[str, Any]:
+        if kwargs.pop("prefer_fallback", False) and self._target.model_name:
+            # 近期首选模型频繁过载：本次直接走回退任务
+            logger.info(
+                "[LLM2picBridge] 指定模型 %s 近期频繁过载，本次直接使用任务 %s",
+                self._target.model_name,
+                self._target.task_name,
+            )
+            return await self._generate_for_target(_LLMTarget(task_name=self._target.task_name), kwargs, allow_fallback=True)
+        if len(self._target.race_targets) >= 2:
+            result = await self._race(kwargs)
+            if _llm_response_usable_for_prompt(result):
+                return result
+            logger.warning("[LLM2picBridge] 竞速模型均未返回可用结果，回退单模型路径")
+        return await self._generate_for_target(self._target, kwargs, allow_fallback=True)
+
+    async def _race(self, kwargs: dict[str, Any]) -> Optional[dict[str, Any]]:
+        """同时请求多个模型，取第一个通过 prompt 校验的结果，其余取消。"""
+        started = time.monotonic()
+        racers = {
+            asyncio.ensure_future(self._generate_for_target(target, kwargs, allow_fallback=False)): target.label
+            for target in self._target.race_targets
+        }
+        pending = set(racers)
+        last_result: Optional[dict[str, Any]] = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    label = racers[task]
+                    metrics.observe(f"llm.race.latency.{label}", time.monotonic() - started)
+                    if task.exception() is not None:
+                        metrics.incr(f"llm.race.error.{label}")
+                        logger.warning("[LLM2picBridge] 竞速模型 %s 调用异常: %s", label, task.exception())
+                        continue
+                    result = task.result()
+                    if _llm_response_usable_for_prompt(result):
+                        metrics.incr(f"llm.race.win.{label}")
+                        logger.info(
+                            "[LLM2picBridge] 竞速胜出模型 %s，用时 %.2fs",
+                            label,
+                            time.monotonic() - started,
+                        )
+                        return result
+                    metrics.incr(f"llm.race.invalid.{label}")
+                    last_result = result
+        finally:
+            for task in pending:
+                metrics.incr(f"llm.race.cancelled.{racers[task]}")
+                task.cancel()
+        return last_result
+
+    async def _generate_for_target(
+        self,
+        target: _LLMTarget,
+        kwargs: dict[str, Any],
+        *,
+        allow_fallback: bool,
+    ) -> dict[str, Any]:
         prompt = kwargs.get("prompt")
         temperature = kwargs.get("temperature")
         max_tokens = kwargs.get("max_tokens")
         image_base64 = kwargs.get("image_base64") or ""
 
-        if self._target.model_name:
+        if target.model_name:
             try:
                 result = await self._runtime._ctx_generate_with_direct_model(
                     prompt=prompt,
-                    task_name=self._target.task_name,
-                    model_name=self._target.model_name,
+                    task_name=target.task_name,
+                    model_name=target.model_name,
                     temperature=temperature,
                     max_tokens=max_tokens,
                     image_base64=image_base64 or None,
                     chat_messages=kwargs.get("chat_messages"),
                 )
-                if _llm_response_usable_for_prompt(result):
+                if _llm_response_usable_for_prompt(result) or not allow_fallback:
                     return result
                 logger.warning(
                     "[LLM2picBridge] 指定模型 %s 生成失败，将回退任务 %s: %s",
-                    self._target.model_name,
-                    self._target.task_name,
+                    target.model_name,
+                    target.task_name,
                     str((result or {}).get("error") if isinstance(result, dict) else result)[:120],
                 )
             except Exception as exc:
+                if not allow_fallback:
+                    raise
                 logger.warning(
                     "[LLM2picBridge] 指定模型 %s 调用异常，将回退任务 %s: %s",
-                    self._target.model_name,
-                    self._target.task_name,
+                    target.model_name,
+                    target.task_name,
                     exc,
                     exc_info=True,
                 )
 
         fallback_kwargs = dict(kwargs)
-        fallback_kwargs["model"] = self._target.task_name
+        fallback_kwargs["model"] = target.task_name
         had_image = bool(fallback_kwargs.pop("image_base64", None) or image_base64)
         chat_messages = fallback_kwargs.pop("chat_messages", None)
         prompt = fallback_kwargs.get("prompt")
@@ -104,12 +172,47 @@ class _FallbackLLMProxy:
                 fallback_kwargs["prompt"] = f"{prompt}{vlm_block}"
         return await self._runtime.ctx.llm.generate(**fallback_kwargs)
 
+    def supports_streaming(self) -> bool:
+        """运行时提供 llm.generate_stream 且未指定具体模型/竞速时才走流式（直连模型没有流式接口）。"""
+        if self._target.model_name or self._target.race_targets:
+            return False
+        return callable(getattr(self._runtime.ctx.llm, "generate_stream", None))
+
+    async def generate_stream(self, **kwargs: Any) -> AsyncIterator[str]:
+        """流式生成，逐段产出文本增量；不传图（流式仅用于纯文本调用）。"""
+        stream_kwargs = dict(kwargs)
+        stream_kwargs["model"] = self._target.task_name
+        stream_kwargs.pop("image_base64", None)
+        stream_kwargs.pop("chat_messages", None)
+        stream_kwargs.pop("prefer_fallback", None)
+        stream = self._runtime.ctx.llm.generate_stream(**stream_kwargs)
+        if asyncio.iscoroutine(stream):
+            stream = await stream
+        try:
+            async for chunk in stream:
+                if isinstance(chunk, dict):
+                    if chunk.get("success") is False:
+                        raise RuntimeError(str(chunk.get("error") or "LLM 流式生成失败"))
+                    text = chunk.get("delta") or chunk.get("content") or chunk.get("response") or ""
+                else:
+                    text = chunk
+                if text:
+                    yield str(text)
+        finally:
+            aclose = getattr(stream, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
 
 class _RuntimeBridgeMixin:
     """为生图逻辑补齐 rdev 原生运行时上下文。"""
 
     ctx: Any
 
+    def _runtime_config(self) -> RuntimeConfig:
+        """当前配置的快照（同一份配置只解析一次）。"""
+        return get_runtime_config(self.get_plugin_config_data())
+
     def _config_get(self, path: str, default: Any = None) -> Any:
         current: Any = self.get_plugin_config_data()
         for part in str(path or "").split("."):
@@ -220,10 +323,23 @@ class _RuntimeBridgeMixin:
         return (await self._ctx_resolve_llm_target()).task_name
 
     async def _ctx_resolve_llm_target(self) -> _LLMTarget:
-        custom_model_name = str(self._config_get("llm.model_name", "") or "").strip()
-        if not custom_model_name:
-            return _LLMTarget()
-
+        llm_config = self._runtime_config().llm
+        custom_model_name = llm_config.model_name
+        target = self._ctx_resolve_llm_target_by_name(custom_model_name) if custom_model_name else _LLMTarget()
+
+        if not llm_config.race_enabled:
+            return target
+        race_targets: list[_LLMTarget] = []
+        for name in llm_config.race_model_names:
+            race_target = self._ctx_resolve_llm_target_by_name(name)
+            if race_target not in race_targets:
+                race_targets.append(race_target)
+        if len(race_targets) < 2:
+            logger.warning("[LLM2picBridge] 竞速模式至少需要两个可用模型，当前 %s 个，按单模型处理", len(race_targets))
+            return target
+        return replace(target, race_targets=tuple(race_targets))
+
+    def _ctx_resolve_llm_target_by_name(self, custom_model_name: str) -> _LLMTarget:
         try:
             from src.llm_models.utils_model import TempMethodsLLMUtils
             from src.services import llm_service
@@ -478,6 +594,7 @@ class _RuntimeBridgeMixin:
         reference_tags: str = "",
         reference_image_base64: str = "",
         vlm_description: str = "",
+        reference_tags_task: Optional[asyncio.Future] = None,
     ) -> PromptGenerationResult:
         # 当有参考图但写 tag 的模型不支持视觉时，把 VLM 识图结果拼到 reference_tags
         effective_reference_tags = reference_tags
@@ -489,10 +606,12 @@ class _RuntimeBridgeMixin:
             vlm_block = f"\n\n## VLM 识图结果（写 tag 的模型不支持视觉，由 VLM 识别补充）\n{vlm_description}"
             effective_reference_tags = f"{effective_reference_tags}{vlm_block}".strip()
 
-        if str(self._config_get("llm.prompt_mode", "danbooru") or "danbooru").strip().lower() == "danbooru":
+        runtime = self._runtime_config()
+        if runtime.llm.prompt_mode == "danbooru":
             llm_target = await self._ctx_resolve_llm_target()
             return await generate_danbooru_prompt(
-                config=self.get_plugin_config_data(),
+                config=runtime.raw,
+                runtime=runtime,
                 llm=_FallbackLLMProxy(self, llm_target),
                 model=llm_target.task_name,
                 user_request=user_request,
@@ -503,6 +622,7 @@ class _RuntimeBridgeMixin:
                 custom_system_prompt=custom_system_prompt,
                 reference_tags=effective_reference_tags,
                 reference_image_base64=reference_image_base64,
+                reference_tags_task=reference_tags_task,
             )
 
         base_prompt = custom_system_prompt.strip() if custom_system_prompt else DEFAULT_SYSTEM_PROMPT
@@ -590,8 +710,9 @@ class _ToolRuntimeProxy(DrawPictureToolMetadata):
         return await self._runtime._ctx_get_persona()
 
     async def _get_recent_chat_messages(self) -> str:
-        message_limit = int(self.get_config("llm.context_message_limit", 20) or 20)
-        time_minutes = int(self.get_config("llm.context_time_minutes", 30) or 30)
+        llm_config = self._runtime._runtime_config().llm
+        message_limit = llm_config.context_message_limit
+        time_minutes = llm_config.context_time_minutes
         return await self._runtime._ctx_get_recent_chat_messages(
             self._stream_id,
             message_limit=message_limit,
@@ -610,6 +731,7 @@ class _ToolRuntimeProxy(DrawPictureToolMetadata):
         reference_tags: str = "",
         reference_image_base64: str = "",
         vlm_description: str = "",
+        reference_tags_task: Optional[asyncio.Future] = None,
     ) -> PromptGenerationResult:
         return await self._runtime._ctx_generate_prompt_with_style(
             user_request=user_request,
@@ -621,6 +743,7 @@ class _ToolRuntimeProxy(DrawPictureToolMetadata):
             reference_tags=reference_tags,
             reference_image_base64=reference_image_base64,
             vlm_description=vlm_description,
+            reference_tags_task=reference_tags_task,
         )
 
 
@@ -666,6 +789,7 @@ class _CommandRuntimeProxy(DirectPicCommand):
         reference_tags: str = "",
         reference_image_base64: str = "",
         vlm_description: str = "",
+        reference_tags_task: Optional[asyncio.Future] = None,
     ) -> PromptGenerationResult:
         return await self._runtime._ctx_generate_prompt_with_style(
             user_request=user_request,
@@ -677,4 +801,5 @@ class _CommandRuntimeProxy(DirectPicCommand):
             reference_tags=reference_tags,
             reference_image_base64=reference_image_base64,
             vlm_description=vlm_description,
+            reference_tags_task=reference_tags_task,
         )
@@ -68,8 +68,11 @@ class GenerationContext:
     # ── 请求控制 ──
     max_tokens: int = 100000   # OpenAI max_tokens = Anlas × 10000
     timeout: int = 180
+    deadline: Optional[float] = None   # time.monotonic() 截止时间点，收紧 timeout 与重试
     retry_attempts: int = 3
     proxy_mode: str = "auto"   # auto | inherit | direct
+    rate_limit_per_minute: float = 0.0   # 0 = 不预设上限，按 429 反馈自适应
+    rate_limit_burst: int = 2
 
     # ── 扩展参数（legacy 端点兼容）──
     extra_params: Optional[dict] = None
@@ -14,6 +14,7 @@ API 文档：见 references/api-20260527-full.md
 
 from __future__ import annotations
 
+import asyncio
 import json
 import re
 import time
@@ -23,6 +24,9 @@ from typing import Any, Optional
 
 from src.common.logger import get_logger
 
+from ..image_probe import probe_image
+from ..rate_limiter import AdaptiveRateLimiter, get_rate_limiter, parse_retry_after
+from ..utils import _deadline_passed, _timeout_until
 from .base import (
     GenerationContext,
     GenerationResult,
@@ -285,8 +289,11 @@ class NewApiNaiClient(ImageClient):
             "max_tokens": max_tokens,
         }
 
-        # 发请求
-        resp_data = self._post(payload, ctx)
+        # 限流排队（首个令牌异步获取），再把同步 urllib + 重试放到线程里，多个端点的请求才能并行
+        limiter = get_rate_limiter(self.base_url, self.api_key, ctx.rate_limit_per_minute, ctx.rate_limit_burst)
+        if await limiter.acquire(ctx.deadline) is None:
+            return GenerationResult(success=False, error="NewAPI 限流排队超过时间预算")
+        resp_data = await asyncio.to_thread(self._post, payload, ctx, limiter)
         if resp_data is None:
             return GenerationResult(success=False, error="NewAPI 请求失败")
 
@@ -323,6 +330,12 @@ class NewApiNaiClient(ImageClient):
                 raw_content=content,
             )
 
+        # 只读文件头校验图片，不解码整张图
+        probe = probe_image(image_b64)
+        if probe is None or probe.truncated:
+            detail = "不是可识别的图片" if probe is None else f"不完整（{probe.format}, {probe.size} bytes）"
+            return GenerationResult(success=False, error=f"NewAPI 返回的图片数据{detail}", raw_content=content)
+
         # 提取 seed + vibe_cache_ids
         seeds = extract_seeds(content)
         seed = seeds[0] if seeds else -1
@@ -434,8 +447,13 @@ class NewApiNaiClient(ImageClient):
 
     # ── HTTP 请求 ──
 
-    def _post(self, payload: dict, ctx: GenerationContext) -> Optional[dict]:
-        """发送 POST 请求，带重试。返回解析后的 JSON dict 或 None。"""
+    def _post(
+        self, payload: dict, ctx: GenerationContext, limiter: Optional[AdaptiveRateLimiter] = None
+    ) -> Optional[dict]:
+        """发送 POST 请求，带重试。返回解析后的 JSON dict 或 None。
+
+        首次请求的令牌由调用方获取；429 交给 limiter 降速，重试前在限流队列里等待。
+        """
         endpoint = f"{self.base_url}/chat/completions"
         data = json.dumps(payload).encode("utf-8")
         headers = {
@@ -457,14 +475,20 @@ class NewApiNaiClient(ImageClient):
         proxy_mode = ctx.proxy_mode
 
         for attempt in range(1, retry_attempts + 1):
+            if attempt > 1 and _deadline_passed(ctx.deadline):
+                return {"error": {"message": "NewAPI 请求超过时间预算"}}
+            if attempt > 1 and limiter is not None and limiter.wait_blocking(ctx.deadline) is None:
+                return {"error": {"message": "NewAPI 限流排队超过时间预算"}}
             try:
-                response = self._urlopen(req, timeout=timeout, proxy_mode=proxy_mode)
+                response = self._urlopen(req, timeout=_timeout_until(ctx.deadline, timeout), proxy_mode=proxy_mode)
                 with response as resp:
                     body = resp.read().decode("utf-8")
                     status = resp.status if hasattr(resp, "status") else resp.getcode()
                     if not 200 <= status < 300:
                         return {"error": {"message": f"HTTP {status}: {body[:300]}"}}
 
+                if limiter is not None:
+                    limiter.on_success()
                 return json.loads(body)
 
             except urllib.error.HTTPError as exc:
@@ -474,12 +498,18 @@ class NewApiNaiClient(ImageClient):
                 except Exception:
                     pass
 
-                if exc.code in _RETRYABLE_STATUS_CODES and attempt < retry_attempts:
+                if exc.code == 429 and limiter is not None:
+                    retry_after = parse_retry_after(exc.headers.get("Retry-After") if exc.headers else None)
+                    wait_seconds = limiter.on_throttled(retry_after)
+                    if attempt < retry_attempts:
+                        logger.warning(f"{self.log_prefix} HTTP 429，限流排队约 {wait_seconds:.1f}s 后重试")
+                        continue
+                elif exc.code in _RETRYABLE_STATUS_CODES and attempt < retry_attempts:
                     sleep_seconds = 6.0 if exc.code == 429 else 1.5 * attempt
                     logger.warning(
                         f"{self.log_prefix} HTTP {exc.code}，{sleep_seconds:.1f}s 后重试"
                     )
-                    time.sleep(sleep_seconds)
+                    time.sleep(_timeout_until(ctx.deadline, sleep_seconds))
                     continue
 
                 logger.error(f"{self.log_prefix} HTTP 错误: {exc.code} - {error_body}")
@@ -491,7 +521,7 @@ class NewApiNaiClient(ImageClient):
                     logger.warning(
                         f"{self.log_prefix} 网络错误，{sleep_seconds:.1f}s 后重试: {exc}"
                     )
-                    time.sleep(sleep_seconds)
+                    time.sleep(_timeout_until(ctx.deadline, sleep_seconds))
                     continue
                 logger.error(f"{self.log_prefix} 连接错误: {exc}")
                 return {"error": {"message": f"连接错误: {getattr(exc, 'reason', exc)}"}}
@@ -506,7 +536,7 @@ class NewApiNaiClient(ImageClient):
 
         return {"error": {"message": "NewAPI 请求失败（重试耗尽）"}}
 
-    def _urlopen(self, req: urllib.request.Request, *, timeout: int, proxy_mode: str):
+    def _urlopen(self, req: urllib.request.Request, *, timeout: float, proxy_mode: str):
         """根据 proxy_mode 选择 urlopen 方式。"""
         if proxy_mode == "direct":
             opener = urllib.request.build_opener(urllib.request.ProxyHandler({}))
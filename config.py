@@ -99,6 +99,14 @@ class GenerationConfig(PluginConfigBase):
     crop_enabled: bool = Field(default=False, description="发送前是否裁掉图片边缘（常用于去掉底部水印条）。")
     crop_position: Literal["top", "bottom", "left", "right"] = Field(default="bottom", description="裁切条所在边：top/bottom/left/right，配合 crop_pixels 使用。")
     crop_pixels: int = Field(default=40, ge=0, description="从指定边裁掉的像素宽度/高度。")
+    resize_mode: Literal["fast", "quality", "exact"] = Field(default="quality", description="参考图（i2i/char-ref/vibe）与图片编辑的缩图模式：quality 先按 JPEG 缩放解码到目标的 1.5 倍以上再 LANCZOS，画质与 exact 几乎无差；fast 更快更省内存。")
+    output_format: Literal["png", "jpeg", "webp"] = Field(default="png", description="发送到聊天前的编码：png 原样发送；jpeg/webp 转码以减小体积、加快上传（GitHub 存档始终是原始 PNG）。")
+    output_target_kb: int = Field(default=0, ge=0, le=20480, description="转码的目标体积（KB），在 output_quality 以下二分查找不超过此体积的最高质量；0 表示固定用 output_quality。")
+    output_quality: int = Field(default=90, ge=40, le=100, description="jpeg/webp 转码质量（有目标体积时为上限）。")
+    rendition_cache_ttl_seconds: float = Field(default=120.0, ge=0.0, le=3600.0, description="附图解码后的各种缩放结果（WD14/识图/参考图/编辑）按原图缓存的秒数，期间引用同一张图不再重新解码；0 表示不跨请求缓存。")
+    image_process_workers: int = Field(default=2, ge=0, le=16, description="图片缩放/裁切/转码的 worker 数，在事件循环之外运行 Pillow；0 表示始终用单线程处理。")
+    image_process_pool: Literal["thread", "process"] = Field(default="thread", description="图片处理执行器：thread 线程池（Pillow 运算大多释放 GIL，默认）；process 用 forkserver 进程池，要求插件包可被子进程导入，否则自动退回线程池。")
+    image_process_timeout_seconds: float = Field(default=30.0, ge=0.0, le=600.0, description="进程池中单个图片任务的超时（秒），超时后结束子进程并改用线程池重做；0 表示不限。")
 
     ref_image: RefImageConfig = Field(
         default_factory=RefImageConfig,
@@ -201,6 +209,23 @@ class NewApiNaiEndpointConfig(PluginConfigBase):
     auto_smea: bool = Field(default=False, description="NAI autoSmea 增强开关。")
     variety_boost: bool = Field(default=False, description="NAI variety_boost，增加画面多样性。")
     extra_params: dict[str, Any] = Field(default_factory=dict, description="高级：合并进请求体的键值对，勿乱填以免 API 报错。")
+    weight: float = Field(default=1.0, gt=0, description="主端点（上面的 base_url/api_key）在负载均衡中的权重。")
+    mirrors: list[dict[str, Any]] = Field(
+        default_factory=list,
+        description="额外端点列表，每项 {base_url, api_key, weight}；base_url/api_key 省略时沿用主端点，可用于多 key 分流。",
+    )
+    balance_strategy: Literal["least_outstanding", "ewma"] = Field(
+        default="least_outstanding",
+        description="多端点选择策略：least_outstanding 进行中请求最少优先；ewma 按平滑延迟×负载选择。",
+    )
+    eject_after_failures: int = Field(default=3, ge=1, description="端点连续失败多少次后暂时摘除。")
+    eject_cooldown_seconds: float = Field(default=60, ge=1, description="端点被摘除后多久放行探测请求（秒）。")
+    rate_limit_per_minute: float = Field(
+        default=0,
+        ge=0,
+        description="每个端点+密钥每分钟最多发起的出图请求数；0 表示不预设，收到 429 后按 Retry-After 自适应降速。",
+    )
+    rate_limit_burst: int = Field(default=2, ge=1, description="限流令牌桶容量（允许的瞬时并发突发数）。")
 
 
 class AnimeConfig(PluginConfigBase):
@@ -215,6 +240,15 @@ class AnimeConfig(PluginConfigBase):
         default="gradio",
         description="实际调用的后端：推荐 newapi_nai；其余为备用或测试。",
     )
+    failover: list[Literal["regex_url", "newapi_nai", "openai", "gradio", "sd_api", "novelai"]] = Field(
+        default_factory=list,
+        description="故障转移链：主后端报错或超时后依次改用的后端（如 novelai、sd_api、gradio），复用已生成的 prompt。",
+    )
+    failover_hop_timeout_seconds: float = Field(
+        default=150,
+        ge=0,
+        description="配置了故障转移时每一跳（含主后端）的超时预算（秒），0 表示不限。",
+    )
     regex_url: RegexUrlEndpointConfig = Field(default_factory=RegexUrlEndpointConfig, description="当 api_type=regex_url 时展开的配置。")
     newapi_nai: NewApiNaiEndpointConfig = Field(default_factory=NewApiNaiEndpointConfig, description="当 api_type=newapi_nai 时展开的配置（主路径）。")
     openai: OpenAIEndpointConfig = Field(default_factory=OpenAIEndpointConfig, description="当 api_type=openai 时展开的配置。")
@@ -248,8 +282,25 @@ class LlmConfig(PluginConfigBase):
     prompt_mode: Literal["legacy", "danbooru"] = Field(default="danbooru", description="danbooru：结构化 tag + 规则（推荐）；legacy：旧版 JSON prompt。")
     temperature: float = Field(default=0.2, ge=0.0, le=2.0, description="越低 tag 越稳，越高越发散。建议 0.1–0.3。")
     danbooru_sfw_mode: bool = Field(default=True, description="true：默认用 SFW 规则模板并过滤擦边 tag；/pic nsfw 或 nsfw_allowed=true 单次放开。")
+    sfw_extra_banned_tags: list[str] = Field(default_factory=list, description="SFW 模式下额外禁止的 tag（整词匹配，不区分大小写），追加到内置规则。")
+    sfw_extra_banned_substrings: list[str] = Field(default_factory=list, description="SFW 模式下额外禁止的子串：tag 中包含任一子串即移除，追加到内置规则。")
+    postprocess_rules_file: str = Field(default="", description="追加后处理规则的 JSON 文件路径（结构同 core/rules/postprocess_rules.json，列表与内置规则合并），用于人设专属 tag 等；留空只用内置规则。")
     enforce_tag_order: bool = Field(default=True, description="true：把 1girl/镜头词/year 等按习惯前置/后置，利于 NAI 构图；false 保持 LLM 原顺序。")
     selfie_appearance_policy: Literal["auto", "never", "keep"] = Field(default="auto", description="auto：未描述外貌时去掉 persona 外貌 tag 防乱脸；never 总是去掉；keep 总是保留。")
+    prompt_cache_enabled: bool = Field(default=True, description="相同请求/人设/参考图/SFW 开关时复用上次生成的 tag，跳过 LLM（期间新增的聊天消息不影响命中）；用户说「换一张」「不一样」时自动不走缓存。")
+    prompt_cache_ttl_seconds: int = Field(default=600, ge=0, le=86400, description="prompt 缓存有效期（秒），0 表示关闭缓存。")
+    prompt_cache_max_entries: int = Field(default=64, ge=1, le=1024, description="prompt 缓存最多保留的条目数，超出按最久未用淘汰。")
+    speculative_budget_seconds: float = Field(default=0.0, ge=0.0, le=30.0, description="推测执行预算（秒）：tag 候选检索/WD14 反推超过该时间仍未返回，就先用已有信息调用 LLM；0 表示关闭，等全部完成。")
+    speculative_race_enriched: bool = Field(default=False, description="推测执行时同时等富化完成后再发一次 LLM，两路竞速取先返回的有效结果（多消耗一次 token）。")
+    streaming_enabled: bool = Field(default=False, description="运行时支持流式时边收边检查 LLM 输出：开头是拒答/网关报错就立即中止重试，JSON 闭合后不再等尾部内容。")
+    race_enabled: bool = Field(default=False, description="竞速模式：同时向 race_model_names 中的模型发 prompt 请求，取第一个通过校验的结果并取消其余（多消耗 token，换 p95 延迟）。")
+    race_model_names: list[str] = Field(default_factory=list, description="参与竞速的模型或任务名（至少两个，写法同 model_name）；全部失败时回退单模型路径。")
+    retry_max_delay_seconds: float = Field(default=20.0, ge=0.5, le=120.0, description="负载类报错重试的指数退避上限（秒），实际等待在 0~上限 间随机抖动。")
+    fallback_after_overloads: int = Field(default=3, ge=0, le=50, description="窗口内负载报错达到该次数后，后续请求跳过 model_name 直接走回退任务；0 表示不切换。")
+    overload_window_seconds: int = Field(default=120, ge=10, le=3600, description="统计负载报错次数的滑动窗口（秒）。")
+    retry_budget_capacity: int = Field(default=10, ge=1, le=1000, description="全局重试预算上限（令牌数），每次重试消耗一个。")
+    retry_budget_ratio: float = Field(default=0.2, ge=0.0, le=1.0, description="每个新请求补充的重试令牌数；故障期间重试总量约为请求量的该比例。")
+    retry_budget_refill_per_minute: float = Field(default=1.0, ge=0.0, le=60.0, description="重试预算每分钟按时间补充的令牌数，故障过后即使请求稀少也能恢复重试；0 表示只靠新请求补充。")
     system_prompt: str = Field(default="", description="追加到 Danbooru 生成器后的本地规则（OC、东雪莲、禁止雪景联想等）。支持多行。", json_schema_extra={"ui_type": "textarea", "rows": 8})
 
 
@@ -283,10 +334,22 @@ class Wd14Config(PluginConfigBase):
     __ui_order__ = 7
 
     enabled: bool = Field(default=True, description="关闭则不发图/引用图时跳过 WD14（参考图 i2i 仍可用图，只是少 tag 融合）。")
+    backend: Literal["remote", "local"] = Field(default="remote", description="反推后端：remote 调用下方 endpoint；local 用本地 ONNX 模型在 CPU 上推理（需安装 onnxruntime 并放好模型文件，不可用时自动退回 remote）。")
     endpoint: str = Field(default=WD14_DEFAULT_ENDPOINT, description="WD14 Tagger 推理服务地址（如自建或公共 endpoint）。")
+    transport: Literal["auto", "json", "octet-stream", "multipart"] = Field(default="json", description="上传方式：json 为 base64 放在 JSON 里（所有 endpoint 都支持，默认的 Modal 部署只认这种）；octet-stream / multipart 直接上传图片字节，体积少约 1/3，需要 endpoint 支持；auto 先试 octet-stream，被拒或没返回 tag 时退回 json，拿到 tag 后记住可用的方式。")
+    local_model_dir: str = Field(default="", description="本地模型目录，需包含 model.onnx 与 selected_tags.csv（SmilingWolf WD14 tagger 格式）；留空为插件 data 目录下的 wd14_model。")
+    local_threads: int = Field(default=2, ge=1, le=32, description="本地推理线程数（预处理/推理线程池大小，同时也是 ONNX Runtime 的算子线程数）。")
+    local_batch_size: int = Field(default=4, ge=1, le=32, description="本地推理时，同时到达的图片最多拼成一个 batch 的张数。")
+    local_character_threshold: float = Field(default=0.85, ge=0.0, le=1.0, description="本地推理时角色 tag 的置信度阈值（角色误判代价高，通常比 general 阈值高）。")
     threshold: float = Field(default=0.35, ge=0.0, le=1.0, description="高于此置信度的 tag 才会写入参考信息，过低噪声多、过高 tag 少。")
     timeout: float = Field(default=60.0, ge=5.0, le=300.0, description="WD14 HTTP 请求超时。")
     max_image_size: int = Field(default=1024, ge=128, le=4096, description="发送 WD14 前把长边缩到此值以内，减轻超时与内存。")
+    cache_memory_entries: int = Field(default=64, ge=1, le=4096, description="反推结果内存缓存条数（LRU）。")
+    cache_disk_enabled: bool = Field(default=True, description="是否把反推结果存到插件 data 目录的 SQLite，重启后同一张图不再重复请求 WD14。")
+    cache_disk_max_mb: int = Field(default=32, ge=1, le=4096, description="磁盘缓存上限（MB），超出时淘汰最久未用的条目。")
+    cache_ttl_hours: float = Field(default=168.0, ge=0.1, le=8760.0, description="反推结果缓存有效期（小时），内存与磁盘共用。")
+    negative_cache_ttl_seconds: float = Field(default=300.0, ge=0.0, le=86400.0, description="反推确定性失败（4xx、结果为空）的负缓存秒数，期间同一张图直接跳过反推；0 表示不缓存失败。")
+    resize_mode: Literal["fast", "quality", "exact"] = Field(default="fast", description="WD14 缩图模式：fast 用 JPEG 缩放解码 + 整数倍快速缩小（反推对画质不敏感）；quality 留余量；exact 完整解码后 LANCZOS。")
 
 
 class ComponentsConfig(PluginConfigBase):
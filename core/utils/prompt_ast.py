@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+"""
+提示词 tag 结构（AST）
+
+把一条 Danbooru prompt 解析为「段落 → tag」的结构，只解析一次：
+- 段落：多行 / 单行 `base | char1 | char2` 两种多人分隔风格
+- 段落前缀：`|` 分隔符、`char1:` 角色前缀（原样保留，包括其后的空白）
+- tag：原始文本（权重/括号包装原样保留）+ 预先算好的规范化 core（用于规则匹配）
+- 段落末尾的续接逗号
+
+后处理规则（过滤、排序）都在这个结构上进行，最后一次性序列化回字符串。
+"""
+
+from __future__ import annotations
+
+import re
+from typing import Callable, Iterable, List
+
+STYLE_SINGLE = "single"
+STYLE_NEWLINE = "newline"
+STYLE_BAR = "bar"
+
+_ROLE_PREFIX_RE = re.compile(r"^(char\d+:\s*)(.*)$", re.IGNORECASE | re.DOTALL)
+# NAI 权重语法：tag 前的分组起始（{ [ 与 NAI4 数值权重 1.2::），tag 后的分组结束（} ] 与 ::）。
+# 圆括号不是 NAI 的权重记号，`azuma seren (vtuber)` 这类限定词属于 tag 正文；
+# 只有跨 tag 或包住整个正文的 ( ) 才按分组处理，见 _split_weight_syntax。
+_LEAD_TOKEN_RE = re.compile(r"\s*([{\[(]|[+-]?\d+(?:\.\d+)?::)")
+_OPEN_TOKEN_RE = re.compile(r"[{\[(]|[+-]?\d+(?:\.\d+)?::")
+_CLOSE_TOKEN_RE = re.compile(r"[}\])]|::")
+_WHITESPACE_RE = re.compile(r"\s+")
+_CLOSER_FOR = {"{": "}", "[": "]", "(": ")"}
+
+
+def _closes(open_token: str, close_token: str) -> bool:
+    return _CLOSER_FOR.get(open_token, "::") == close_token
+
+
+def _paren_partners(text: str) -> dict[int, int]:
+    """tag 内圆括号的配对位置（双向），配不上对的括号对应 -1。"""
+    partners: dict[int, int] = {}
+    opened: List[int] = []
+    for index, char in enumerate(text):
+        if char == "(":
+            opened.append(index)
+        elif char == ")":
+            if opened:
+                start = opened.pop()
+                partners[start], partners[index] = index, start
+            else:
+                partners[index] = -1
+    for index in opened:
+        partners[index] = -1
+    return partners
+
+
+def _split_weight_syntax(text: str) -> tuple[str, str, str]:
+    """把 tag 拆成 (起始分组记号, 正文, 结束分组记号)，三段拼回即原文。
+
+    圆括号只有两种情况算分组记号：在 tag 内配不上对（分组跨了多个 tag），
+    或者这一对括号把整个正文包起来；`name (qualifier)` 里的括号留在正文。
+    """
+    partners = _paren_partners(text) if "(" in text or ")" in text else {}
+
+    lead_ends: List[int] = []
+    paren_leads: List[int] = []
+    start = 0
+    while True:
+        match = _LEAD_TOKEN_RE.match(text, start)
+        if not match:
+            break
+        if match.group(1) == "(":
+            paren_leads.append(match.start(1))
+        start = match.end()
+        lead_ends.append(start)
+
+    while True:
+        lead_end = lead_ends[-1] if lead_ends else 0
+        while lead_end < len(text) and text[lead_end].isspace():
+            lead_end += 1
+        end = _trail_start(text, lead_end, partners)
+        # 起始处配上对的 ( 只有在它的 ) 也落在结束记号里时才算分组，否则从这里截断 lead 重来
+        trail_parens = {index for index in range(end, len(text)) if text[index] == ")"}
+        stray = [index for index in paren_leads if partners[index] >= 0 and partners[index] not in trail_parens]
+        if not stray:
+            return text[:lead_end], text[lead_end:end], text[end:]
+        cut = stray[0]
+        lead_ends = [position for position in lead_ends if position <= cut]
+        paren_leads = [index for index in paren_leads if index < cut]
+
+
+def _trail_start(text: str, start: int, partners: dict[int, int]) -> int:
+    end = len(text)
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    while end > start:
+        char = text[end - 1]
+        if char in "}]" or (char == ")" and partners[end - 1] < start):
+            token_start = end - 1
+        elif text.endswith("::", start, end):
+            token_start = end - 2
+        else:
+            break
+        end = token_start
+        while end > start and text[end - 1].isspace():
+            end -= 1
+    return end
+
+
+def _normalize_core(body: str) -> str:
+    return _WHITESPACE_RE.sub(" ", body).strip().lower()
+
+
+def tag_core(tag: str) -> str:
+    """去掉权重/括号包装并规范空白、转小写，仅用于规则匹配。"""
+    return _normalize_core(_split_weight_syntax(tag.strip())[1])
+
+
+class PromptTag:
+    """单个 tag：lead/body/trail 为原文三段（权重分组记号 + 正文），core 为匹配用的规范化正文。
+
+    逗号会切开跨多个 tag 的分组（如 ``1.2::blue hair, long hair::``），
+    分组记号就挂在各自所在的 tag 上；删除 tag 时由 PromptAst 负责迁移或抵消。
+    """
+
+    __slots__ = ("lead", "body", "trail", "core")
+
+    def __init__(self, text: str) -> None:
+        self.lead, self.body, self.trail = _split_weight_syntax(text)
+        self.core = _normalize_core(self.body)
+
+    @property
+    def text(self) -> str:
+        return f"{self.lead}{self.body}{self.trail}"
+
+    @property
+    def depth_delta(self) -> int:
+        """该 tag 使分组嵌套深度变化多少（起始记号数 - 结束记号数）。"""
+        return len(_OPEN_TOKEN_RE.findall(self.lead)) - len(_CLOSE_TOKEN_RE.findall(self.trail))
+
+    def __repr__(self) -> str:
+        return f"PromptTag({self.text!r})"
+
+
+class PromptSegment:
+    """一个段落（一行或一个 `|` 分段）。"""
+
+    __slots__ = ("bar", "role", "tags", "trailing_comma")
+
+    def __init__(self, tags: List[PromptTag], *, bar: bool = False, role: str = "", trailing_comma: bool = False) -> None:
+        self.bar = bar
+        self.role = role
+        self.tags = tags
+        self.trailing_comma = trailing_comma
+
+    def render(self) -> str:
+        body = ", ".join(tag.text for tag in self.tags)
+        if self.trailing_comma and body and not body.endswith(","):
+            body = f"{body},"
+        return f"{self.role}{body}" if self.role else body
+
+
+class PromptAst:
+    """整条 prompt 的结构，style 记录原始的多人分隔风格。"""
+
+    __slots__ = ("style", "segments")
+
+    def __init__(self, segments: List[PromptSegment], style: str = STYLE_SINGLE) -> None:
+        self.style = style
+        self.segments = segments
+
+    def iter_tags(self) -> Iterable[PromptTag]:
+        for segment in self.segments:
+            yield from segment.tags
+
+    def filter_tags(self, should_remove: Callable[[PromptTag], bool]) -> None:
+        """按谓词删除 tag；删空的段落整体去掉。
+
+        被删 tag 上的分组记号不会丢：起始记号顺延到下一个保留的 tag，结束记号挂回上一个保留的 tag，
+        同一段被整体删掉的分组（起止都在被删 tag 上）相互抵消。
+        """
+        kept_segments: List[PromptSegment] = []
+        for segment in self.segments:
+            kept: List[PromptTag] = []
+            pending: List[str] = []  # 待顺延的起始记号
+            for tag in segment.tags:
+                if not should_remove(tag):
+                    if pending:
+                        tag.lead = "".join(pending) + tag.lead
+                        pending = []
+                    kept.append(tag)
+                    continue
+                pending.extend(_OPEN_TOKEN_RE.findall(tag.lead))
+                closes = _CLOSE_TOKEN_RE.findall(tag.trail)
+                while pending and closes and _closes(pending[-1], closes[0]):
+                    pending.pop()
+                    closes.pop(0)
+                if closes and kept:
+                    kept[-1].trail += "".join(closes)
+            segment.tags = kept
+            if kept:
+                kept_segments.append(segment)
+        self.segments = kept_segments
+
+    def reorder_tags(self, rank: Callable[[PromptTag], int], *, default_rank: int = 0) -> None:
+        """段内按 rank 稳定排序（同组保持原相对顺序）。
+
+        跨多个 tag 的权重分组作为整体移动；组内 rank 不一致时整体按 default_rank 处理。
+        """
+        for segment in self.segments:
+            units: List[List[PromptTag]] = []
+            depth = 0
+            for tag in segment.tags:
+                if depth <= 0:
+                    units.append([])
+                    depth = 0
+                units[-1].append(tag)
+                depth += tag.depth_delta
+
+            def unit_rank(unit: List[PromptTag]) -> int:
+                ranks = {rank(tag) for tag in unit}
+                return ranks.pop() if len(ranks) == 1 else default_rank
+
+            units.sort(key=unit_rank)
+            segment.tags = [tag for unit in units for tag in unit]
+
+    def serialize(self) -> str:
+        rendered = [(segment.bar, segment.render()) for segment in self.segments]
+        if self.style == STYLE_BAR:
+            return " | ".join(text for _, text in rendered if text).strip()
+        lines = [f"| {text}".strip() if bar else text for bar, text in rendered]
+        return "\n".join(lines).strip()
+
+
+def _split_segments(text: str) -> tuple[str, List[str]]:
+    if "\n" in text:
+        return STYLE_NEWLINE, [segment.strip() for segment in text.split("\n") if segment.strip()]
+    if "|" in text:
+        parts = [part.strip() for part in text.split("|")]
+        return STYLE_BAR, [part if index == 0 else f"| {part}" for index, part in enumerate(parts) if part]
+    return STYLE_SINGLE, [text]
+
+
+def parse_prompt(prompt: str) -> PromptAst:
+    """把 prompt 字符串解析为 PromptAst。"""
+    text = (prompt or "").strip()
+    if not text:
+        return PromptAst([])
+
+    style, raw_segments = _split_segments(text)
+    segments: List[PromptSegment] = []
+    for raw in raw_segments:
+        trailing_comma = raw.rstrip().endswith(",")
+        bar = False
+        if raw.startswith("|"):
+            bar = True
+            raw = raw[1:].strip()
+
+        role = ""
+        role_match = _ROLE_PREFIX_RE.match(raw)
+        if role_match:
+            role = role_match.group(1)
+            raw = role_match.group(2)
+
+        tags = [PromptTag(part.strip()) for part in raw.split(",") if part.strip()]
+        if tags:
+            segments.append(PromptSegment(tags, bar=bar, role=role, trailing_comma=trailing_comma))
+    return PromptAst(segments, style)
@@ -9,6 +9,11 @@ LLM 输出解析工具
 - JSON 被 ```json 代码块包裹
 - JSON 前后夹杂少量无关文本（尽量提取包含 "prompt" 的 JSON 对象）
 - v3 多人 JSON 抽取结构化 characters payload（含 position 网格）
+- 输出被截断（超出 max_tokens、流式中断）时尽量补全括号后解析，而不是整轮重试
+
+每次 LLM 回复只解码一次：parse_llm_output() 产出 ParsedLLMOutput，
+prompt / aspect / characters / continuity 都从同一个 payload 取；
+下面的各个 helper 同时接受原始字符串和 ParsedLLMOutput。
 
 解析失败时返回 None，调用方应回退到原有的纯文本清洗逻辑。
 """
@@ -17,7 +22,8 @@ from __future__ import annotations
 
 import json
 import re
-from typing import Optional, Dict, Any, List
+from dataclasses import dataclass
+from typing import Optional, Dict, Any, List, Union
 
 
 # 5×5 网格坐标 [A-E][1-5]（NewAPI 多角色 position 字面量）
@@ -71,19 +77,107 @@ def _join_tags(tags) -> str:
     return ", ".join([t.strip() for t in tags if isinstance(t, str) and t.strip()]).strip()
 
 
-def parse_structured_prompt_payload(text: str) -> Optional[Dict[str, Any]]:
-    """
-    从结构化输出中提取原始 payload。
+def _is_v2(obj: dict) -> bool:
+    version = obj.get("version")
+    return version == 2 or version == 3 or (isinstance(version, int) and version >= 2)
 
-    成功时返回 JSON 对象本身，失败返回 None。
-    调用方可进一步读取 intent / continuity / global / people 等字段。
+
+def _is_accepted_payload(obj: Any) -> bool:
+    if not isinstance(obj, dict):
+        return False
+    has_v2_fields = isinstance(obj.get("global"), list)
+    has_v1_prompt = isinstance(obj.get("prompt"), str) and obj.get("prompt", "").strip()
+    if _is_v2(obj):
+        return bool(has_v2_fields or has_v1_prompt)
+    return bool(has_v1_prompt)
+
+
+# 截断 JSON 末尾可以安全丢掉的尾巴：完整字符串 / 数字或字面量片段
+_TRAILING_TOKEN_RE = re.compile(r'(?:"(?:[^"\\]|\\.)*"|[-+\w.]+)\s*$')
+_CLOSER_OF = {"{": "}", "[": "]"}
+
+
+def _repair_truncated_json(text: str) -> Optional[str]:
+    """补全被截断的 JSON 对象：丢掉未闭合的字符串与悬空的键/逗号，再按嵌套补齐括号。
+
+    只处理「从第一个 { 开始、到结尾仍未闭合」的情况；括号不匹配或对象已完整闭合时返回 None。
+    被截断的最后一个字符串（通常是半个 tag）整体丢弃，不会拼出残缺 tag。
     """
+    start = text.find("{")
+    if start == -1:
+        return None
+    body = text[start:]
+
+    stack: List[str] = []
+    in_string = False
+    escape = False
+    string_start = -1
+    for index, char in enumerate(body):
+        if in_string:
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == '"':
+                in_string = False
+            continue
+        if char == '"':
+            in_string = True
+            string_start = index
+        elif char in "{[":
+            stack.append(char)
+        elif char in "}]":
+            if not stack or _CLOSER_OF[stack[-1]] != char:
+                return None
+            stack.pop()
+            if not stack:
+                return None
+    if not stack:
+        return None
+
+    if in_string:
+        body = body[:string_start]
+    closers = "".join(_CLOSER_OF[opener] for opener in reversed(stack))
+    # 依次去掉尾部的逗号/冒号与悬空 token（如只写了一半的 "key": ），直到能解析
+    for _ in range(4):
+        body = body.rstrip().rstrip(",:").rstrip()
+        candidate = body + closers
+        try:
+            json.loads(candidate)
+            return candidate
+        except ValueError:
+            pass
+        trimmed = _TRAILING_TOKEN_RE.sub("", body)
+        if trimmed == body:
+            return None
+        body = trimmed
+    return None
+
+
+def _repaired_payload_usable(obj: Dict[str, Any]) -> bool:
+    """修补后的 payload 是否还值得用：多人输出截断到不足 2 人时宁可重试，不降级成单人图。"""
+    if not _is_v2(obj):
+        return True
+    if not _join_tags(obj.get("global")):
+        return False
+    if str(obj.get("format", "") or "").strip().lower() != "multi":
+        return True
+    people = obj.get("people")
+    if not isinstance(people, list):
+        return False
+    valid = [tags for tags in people if isinstance(tags, list) and _join_tags(tags)]
+    return len(valid) >= 2
+
+
+def _decode_payload(text: str) -> tuple[Optional[Dict[str, Any]], bool]:
+    """解码结构化 payload，返回 (payload, 是否经过截断修补)。"""
     cleaned = _strip_code_fence(text).strip()
     if not cleaned:
-        return None
+        return None, False
 
     candidates = [cleaned]
-    if any(token in cleaned for token in ('"prompt"', '"global"', '"people"')):
+    looks_structured = any(token in cleaned for token in ('"prompt"', '"global"', '"people"'))
+    if looks_structured:
         start = cleaned.find("{")
         end = cleaned.rfind("}")
         if start != -1 and end != -1 and end > start:
@@ -94,22 +188,75 @@ def parse_structured_prompt_payload(text: str) -> Optional[Dict[str, Any]]:
             obj = json.loads(cand)
         except Exception:
             continue
+        if _is_accepted_payload(obj):
+            return obj, False
 
-        if not isinstance(obj, dict):
-            continue
+    if looks_structured:
+        repaired = _repair_truncated_json(cleaned)
+        if repaired is not None:
+            obj = json.loads(repaired)
+            if _is_accepted_payload(obj) and _repaired_payload_usable(obj):
+                return obj, True
 
-        version = obj.get("version")
-        has_v2_fields = isinstance(obj.get("global"), list)
-        has_v1_prompt = isinstance(obj.get("prompt"), str) and obj.get("prompt", "").strip()
-        if version == 2 or version == 3 or (isinstance(version, int) and version >= 2):
-            if has_v2_fields or has_v1_prompt:
-                return obj
-            continue
+    return None, False
 
-        if has_v1_prompt:
-            return obj
 
-    return None
+@dataclass(frozen=True)
+class ParsedLLMOutput:
+    """一次 LLM 回复的解析结果（只解码一次，供各 helper 复用）。
+
+    payload 为 None 表示不是结构化输出，prompt 等字段也都为空，调用方回退到纯文本清洗。
+    characters 与 :func:`extract_multi_character_payload` 返回值同结构。
+    """
+
+    raw: str
+    payload: Optional[Dict[str, Any]] = None
+    prompt: Optional[str] = None
+    aspect: Optional[str] = None
+    characters: Optional[Dict[str, Any]] = None
+    intent: str = ""
+    continuity: str = ""
+    repaired: bool = False
+
+    @property
+    def structured(self) -> bool:
+        return self.payload is not None
+
+
+def parse_llm_output(text: str) -> ParsedLLMOutput:
+    """解析一次 LLM 回复，产出 prompt / aspect / characters / continuity 等字段。"""
+    raw = str(text or "")
+    obj, repaired = _decode_payload(raw)
+    if obj is None:
+        return ParsedLLMOutput(raw)
+    return ParsedLLMOutput(
+        raw=raw,
+        payload=obj,
+        prompt=_prompt_from_payload(obj),
+        aspect=normalize_aspect(obj.get("aspect") or obj.get("size") or obj.get("orientation")),
+        characters=_multi_character_payload_from_payload(obj),
+        intent=str(obj.get("intent") or "").strip().lower(),
+        continuity=str(obj.get("continuity") or "").strip().lower(),
+        repaired=repaired,
+    )
+
+
+def _as_parsed(output: Union[str, ParsedLLMOutput]) -> ParsedLLMOutput:
+    if isinstance(output, ParsedLLMOutput):
+        return output
+    return parse_llm_output(output)
+
+
+def parse_structured_prompt_payload(text: Union[str, ParsedLLMOutput]) -> Optional[Dict[str, Any]]:
+    """
+    从结构化输出中提取原始 payload。
+
+    成功时返回 JSON 对象本身，失败返回 None。
+    调用方可进一步读取 intent / continuity / global / people 等字段。
+    """
+    if isinstance(text, ParsedLLMOutput):
+        return text.payload
+    return _decode_payload(text)[0]
 
 
 def _render_from_v2(obj: dict) -> Optional[str]:
@@ -154,19 +301,8 @@ def _render_from_v2(obj: dict) -> Optional[str]:
     return "\n".join(lines).strip()
 
 
-def parse_prompt_from_structured_output(text: str) -> Optional[str]:
-    """
-    从结构化输出中解析 prompt 字段。
-
-    Returns:
-        prompt 字符串（可能包含换行，用于多人 | 分段），失败返回 None
-    """
-    obj = parse_structured_prompt_payload(text)
-    if not obj:
-        return None
-
-    version = obj.get("version")
-    if version == 2 or version == 3 or (isinstance(version, int) and version >= 2):
+def _prompt_from_payload(obj: Dict[str, Any]) -> Optional[str]:
+    if _is_v2(obj):
         rendered = _render_from_v2(obj)
         if rendered:
             return rendered
@@ -183,6 +319,16 @@ def parse_prompt_from_structured_output(text: str) -> Optional[str]:
     return None
 
 
+def parse_prompt_from_structured_output(text: Union[str, ParsedLLMOutput]) -> Optional[str]:
+    """
+    从结构化输出中解析 prompt 字段。
+
+    Returns:
+        prompt 字符串（可能包含换行，用于多人 | 分段），失败返回 None
+    """
+    return _as_parsed(text).prompt
+
+
 def normalize_aspect(value: object) -> Optional[str]:
     """把 LLM 输出的画幅值规整到 portrait/landscape/square。"""
     normalized = str(value or "").strip().lower()
@@ -192,15 +338,12 @@ def normalize_aspect(value: object) -> Optional[str]:
     return _ASPECT_ALIASES.get(normalized)
 
 
-def extract_aspect_from_structured_output(text: str) -> Optional[str]:
+def extract_aspect_from_structured_output(text: Union[str, ParsedLLMOutput]) -> Optional[str]:
     """从结构化 JSON 输出中提取画幅建议。"""
-    obj = parse_structured_prompt_payload(text)
-    if not obj:
-        return None
-    return normalize_aspect(obj.get("aspect") or obj.get("size") or obj.get("orientation"))
+    return _as_parsed(text).aspect
 
 
-def extract_multi_character_payload(text: str) -> Optional[Dict[str, Any]]:
+def extract_multi_character_payload(text: Union[str, ParsedLLMOutput]) -> Optional[Dict[str, Any]]:
     """从 v3 multi JSON 抽出结构化角色 payload，供 NewAPI `characters[]` 通道使用。
 
     Returns:
@@ -215,12 +358,11 @@ def extract_multi_character_payload(text: str) -> Optional[Dict[str, Any]]:
         - ``position`` 字面量不匹配 ``[A-E][1-5]`` 时被规整为 ``""``（不抛错，仅丢弃该坐标）
         - ``has_coords`` 为 ``True`` 当且仅当所有角色都有合法坐标，否则交由后端自动布局
     """
-    obj = parse_structured_prompt_payload(text)
-    if not obj:
-        return None
+    return _as_parsed(text).characters
 
-    version = obj.get("version")
-    if not (version == 2 or version == 3 or (isinstance(version, int) and version >= 2)):
+
+def _multi_character_payload_from_payload(obj: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    if not _is_v2(obj):
         return None
 
     if str(obj.get("format", "") or "").strip().lower() != "multi":
@@ -340,13 +482,14 @@ def extract_multi_character_payload_from_text(text: str) -> Optional[Dict[str, A
 
 
 def resolve_multi_character_payload(
-    raw_llm_response: str,
+    raw_llm_response: Union[str, ParsedLLMOutput],
     rendered_text: str,
 ) -> Optional[Dict[str, Any]]:
     """统一入口：优先用 v3 JSON 抽取，失败时回退到从拍平文本反解。
 
     Args:
-        raw_llm_response: LLM 的原始返回（可能是 JSON、JSON+噪声、纯文本任意一种）
+        raw_llm_response: LLM 的原始返回（可能是 JSON、JSON+噪声、纯文本任意一种），
+            或已解析好的 :class:`ParsedLLMOutput`
         rendered_text: 经 ``_cleanup_llm_prompt`` 拍平后的最终字符串（含 ``char1:/char2:``）
 
     Returns:
@@ -12,160 +12,22 @@
 
 from __future__ import annotations
 
+import json
 import re
-from typing import Any, Dict, List, Tuple
+from bisect import bisect_right
+from functools import lru_cache, partial
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 
+from src.common.logger import get_logger
 
-_COUNT_RE = re.compile(r"^(?:solo|\d+girls|\d+boys|\d+people|1girl|1boy)$", re.IGNORECASE)
-_YEAR_RE = re.compile(r"^year\s+\d{4}$", re.IGNORECASE)
-
-# 只覆盖少量“稳定且高频”的构图/视角/自拍标签，用于轻量前置
-_CAMERA_TAGS = {
-    "pov",
-    "female pov",
-    "looking at viewer",
-    "from above",
-    "from below",
-    "wide angle",
-    "close-up",
-    "close up",
-    "full body",
-    "upper body",
-    "lower body",
-    "selfie",
-    "mirror selfie",
-    "group selfie",
-    "holding phone",
-}
-
-_SFW_BANNED_EXACT_TAGS = {
-    "nsfw",
-    "nude",
-    "naked",
-    "sex",
-    "sexual",
-    "sexy",
-    "suggestive",
-    "seductive",
-    "lewd",
-    "erotic",
-    "explicit",
-    "penis",
-    "pussy",
-    "vagina",
-    "nipples",
-    "nipple",
-    "anus",
-    "anal",
-    "penetration",
-    "cum",
-    "ejaculation",
-    "fellatio",
-    "cunnilingus",
-    "paizuri",
-    "footjob",
-    "handjob",
-    "masturbation",
-    "orgasm",
-    "topless",
-    "bottomless",
-    "cameltoe",
-    "cleavage",
-    "underboob",
-    "sideboob",
-    "thighs",
-    "midriff",
-    "lingerie",
-    "bikini",
-    "swimsuit",
-    "panties",
-    "underwear",
-    "thong",
-    "bra",
-    "no bra",
-    "see-through",
-    "see through",
-    "transparent clothes",
-}
-_SFW_BANNED_SUBSTRINGS = (
-    "bikini",
-    "swimsuit",
-    "lingerie",
-    "panties",
-    "underwear",
-    "thong",
-    "cameltoe",
-    "cleavage",
-    "underboob",
-    "sideboob",
-    "see-through",
-    "see through",
-    "transparent",
-    "covered nipples",
-    "no bra",
-    "bra lift",
-    "pussy juice",
-    "grop",
-    "fondl",
-    "fingering",
-    "fingered",
-    "grabbing breast",
-    "breast grab",
-    "biting neck",
-)
-
-
-def _split_prompt_segments(prompt: str) -> List[str]:
-    """兼容旧的多行 `|` 分段和新的单行 `base | char1 | char2` 格式。"""
-    text = (prompt or "").strip()
-    if not text:
-        return []
-
-    if "\n" in text:
-        return [segment.strip() for segment in text.split("\n") if segment.strip()]
-
-    if "|" in text:
-        parts = [part.strip() for part in text.split("|")]
-        segments: List[str] = []
-        for index, part in enumerate(parts):
-            if not part:
-                continue
-            if index == 0:
-                segments.append(part)
-            else:
-                segments.append(f"| {part}")
-        return segments
-
-    return [text]
-
+from .prompt_ast import PromptTag, parse_prompt
 
-def _join_prompt_segments(lines: List[str], original_prompt: str) -> str:
-    """保持与输入一致的多人分隔风格。"""
-    if not lines:
-        return ""
+logger = get_logger("MaiBot_LLM2pic")
 
-    if "\n" in (original_prompt or ""):
-        return "\n".join(lines).strip()
 
-    if "|" in (original_prompt or ""):
-        normalized: List[str] = []
-        for index, line in enumerate(lines):
-            raw = line.strip()
-            if index == 0:
-                normalized.append(raw.lstrip("|").strip())
-            else:
-                normalized.append(raw.lstrip("|").strip())
-        return " | ".join([part for part in normalized if part]).strip()
-
-    return "\n".join(lines).strip()
-
-
-def _preserve_trailing_comma(rendered_line: str, raw_line: str) -> str:
-    """保留结构化多人提示词每行末尾的续接逗号。"""
-    line = rendered_line.strip()
-    if line and raw_line.rstrip().endswith(",") and not line.endswith(","):
-        return f"{line},"
-    return line
+_COUNT_RE = re.compile(r"^(?:solo|\d+girls|\d+boys|\d+people|1girl|1boy)$", re.IGNORECASE)
+_YEAR_RE = re.compile(r"^year\s+\d{4}$", re.IGNORECASE)
 
 
 def user_mentions_appearance(raw_request: str) -> bool:
@@ -193,113 +55,306 @@ def user_mentions_appearance(raw_request: str) -> bool:
     return any(k in s for k in en_keys)
 
 
-def _strip_wrappers(tag: str) -> str:
-    """去掉常见权重/括号包装，便于规则匹配（不改变原 tag 输出，仅用于判断）。"""
-    t = tag.strip()
-    # 去掉 NAI 花括号/方括号
-    t = t.lstrip("{[(").rstrip("}])")
-    t = t.strip()
-    # 去掉 NAI4/4.5 权重前缀与后缀，如 1.2::blue hair::
-    t = re.sub(r"^[+-]?\d+(?:\.\d+)?::", "", t).strip()
-    t = re.sub(r"::\s*$", "", t).strip()
-    return t
+# normalize_prompt_order 的分组次序：nsfw → 镜头 → 人数 → 其余 → year
+_RANK_NSFW, _RANK_CAMERA, _RANK_COUNT, _RANK_REST, _RANK_YEAR = range(5)
 
+_RULES_PATH = Path(__file__).resolve().parent.parent / "rules" / "postprocess_rules.json"
+_NON_WORD_RE = re.compile(r"[^a-z0-9\u4e00-\u9fff]+")
+_SFW_RELATION_PREFIX_RE = re.compile(r"^(?:source|target|mutual)#")
 
-def remove_selfie_appearance_tags(prompt: str) -> str:
-    """
-    去掉自拍里常见的“随机外貌标签”（发色/发型/瞳色）。
 
-    只移除明确的外貌 tag，尽量不伤及配饰（如 hair ribbon / hair ornament）。
-    """
-    if not prompt or not prompt.strip():
-        return prompt
+def _trie_pattern(words: Iterable[str]) -> str:
+    """把一组字面量编译成前缀合并的正则（trie 形式），避免逐个分支回溯。"""
+    trie: Dict[str, Any] = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = True
 
-    # 如果包含 NAI4/4.5 高级权重语法，字符串级按逗号拆分有概率破坏语法，直接跳过
-    # （想要在这种情况下也过滤，需要让 LLM 输出数组结构再做安全过滤）
-    if "::" in prompt:
-        return prompt
+    def render(node: Dict[str, Any]) -> str:
+        # 较短的词已经完整命中即可判定，更长的分支不必再匹配
+        if "" in node:
+            return ""
+        alternatives = [re.escape(char) + render(child) for char, child in sorted(node.items())]
+        if len(alternatives) == 1:
+            return alternatives[0]
+        return "(?:" + "|".join(alternatives) + ")"
+
+    return render(trie)
+
+
+def _compile_words(words: Iterable[str]) -> Optional[re.Pattern]:
+    tokens = sorted({str(word).strip().lower() for word in words if str(word).strip()})
+    return re.compile(_trie_pattern(tokens)) if tokens else None
 
-    hair_colors = {
-        "black", "blonde", "brown", "blue", "pink", "white", "silver",
-        "red", "green", "purple", "orange", "gray", "grey", "aqua", "cyan",
-    }
-    eye_colors = {
-        "black", "brown", "blue", "red", "green", "purple", "orange",
-        "gray", "grey", "golden", "yellow", "pink", "aqua", "cyan",
-    }
-    hair_styles_exact = {
-        "twintails",
-        "twin tails",
-        "ponytail",
-        "side ponytail",
-        "braid",
-        "side braid",
-        "pigtails",
-        "hair bun",
-        "bun",
-        "bob cut",
-        "hime cut",
-        "bangs",
-        "blunt bangs",
-        "straight hair",
-        "wavy hair",
-        "curly hair",
-        "messy hair",
-    }
-
-    def should_remove(tag: str) -> bool:
-        core = _strip_wrappers(tag).lower()
-        core = re.sub(r"\s+", " ", core).strip()
-
-        # 明确配饰：不移除
-        if "hair" in core and any(x in core for x in ("ribbon", "ornament", "clip", "pin", "bow", "band", "flower")):
+
+class SfwTagMatcher:
+    """SFW 违禁 tag 匹配器：精确集合 + 子串自动机（trie 正则），构建一次反复使用。"""
+
+    __slots__ = ("exact", "signature", "_substring_re")
+
+    def __init__(self, exact: Iterable[str], substrings: Iterable[str]) -> None:
+        self.exact = frozenset(str(item).strip().lower() for item in exact if str(item).strip())
+        tokens = sorted({str(item).strip().lower() for item in substrings if str(item).strip()})
+        # 规则内容指纹（进程内），用于缓存键区分不同规则集
+        self.signature = hash((self.exact, tuple(tokens)))
+        self._substring_re = _compile_words(tokens)
+
+    @staticmethod
+    def _match_core(core: str) -> str:
+        if "#" not in core:
+            return core
+        return _SFW_RELATION_PREFIX_RE.sub("", core, count=1).strip()
+
+    def is_forbidden(self, core: str) -> bool:
+        core = self._match_core(core)
+        if not core:
             return False
+        if core in self.exact:
+            return True
+        return self._substring_re is not None and self._substring_re.search(core) is not None
+
+    def classify(self, cores: List[str]) -> List[bool]:
+        """一次扫描判定全部 tag：拼成一段文本跑一遍子串自动机，再按偏移映射回 tag。"""
+        stripped = [self._match_core(core) for core in cores]
+        exact = self.exact
+        matched = [core in exact for core in stripped]
+        if self._substring_re is None or not stripped:
+            return matched
+
+        offsets: List[int] = []
+        position = 0
+        for core in stripped:
+            offsets.append(position)
+            position += len(core) + 1
+        for match in self._substring_re.finditer("\n".join(stripped)):
+            matched[bisect_right(offsets, match.start()) - 1] = True
+        return matched
+
+
+class PostprocessRules:
+    """编译好的后处理规则表（集合 + 预编译正则），由 JSON 规则文件构建一次。"""
+
+    __slots__ = (
+        "data",
+        "signature",
+        "camera_tags",
+        "hair_styles",
+        "appearance_re",
+        "accessory_re",
+        "self_banned_exact",
+        "persona_appearance",
+        "self_substring_re",
+        "sfw_matcher",
+    )
 
-        # 发色：xxx hair / xxx-haired
-        m = re.match(r"^([a-z]+)\s+hair$", core)
-        if m and m.group(1) in hair_colors:
+    def __init__(self, data: Dict[str, Any]) -> None:
+        self.data = data
+        self.signature = hash(json.dumps(data, sort_keys=True, ensure_ascii=False))
+        selfie = data.get("selfie_appearance") or {}
+        self_character = data.get("self_character") or {}
+        sfw = data.get("sfw") or {}
+
+        self.camera_tags = frozenset(_lower_words(data.get("camera_tags")))
+        self.hair_styles = frozenset(_lower_words(selfie.get("hair_styles")))
+        hair_colors = "|".join(map(re.escape, sorted(_lower_words(selfie.get("hair_colors"))))) or "(?!)"
+        eye_colors = "|".join(map(re.escape, sorted(_lower_words(selfie.get("eye_colors"))))) or "(?!)"
+        # 发色 xxx hair / xxx-haired、长度 (very) long/short/medium hair、瞳色 xxx eyes
+        self.appearance_re = re.compile(
+            rf"^(?:(?:{hair_colors})\s+hair|[a-z]+-haired|(?:very )?(?:long|short|medium)\s+hair|(?:{eye_colors})\s+eyes)$"
+        )
+        self.accessory_re = _compile_words(_lower_words(selfie.get("hair_accessory_words")))
+
+        self.self_banned_exact = frozenset(_lower_words(self_character.get("banned_exact")))
+        self.persona_appearance = frozenset(_lower_words(self_character.get("persona_appearance")))
+        self.self_substring_re = _compile_words(_lower_words(self_character.get("banned_substrings")))
+
+        self.sfw_matcher = SfwTagMatcher(sfw.get("banned_exact") or (), sfw.get("banned_substrings") or ())
+
+    def merged(self, extra: Dict[str, Any]) -> "PostprocessRules":
+        """合并追加规则（同结构 JSON，列表取并集），返回新的规则表。"""
+        return PostprocessRules(_merge_rule_data(self.data, extra))
+
+
+def _lower_words(values: Any) -> List[str]:
+    if not isinstance(values, (list, tuple, set, frozenset)):
+        return []
+    return [str(value).strip().lower() for value in values if str(value).strip()]
+
+
+def _merge_rule_data(base: Dict[str, Any], extra: Dict[str, Any]) -> Dict[str, Any]:
+    merged = dict(base)
+    for key, value in (extra or {}).items():
+        if key.startswith("_"):
+            continue
+        current = merged.get(key)
+        if isinstance(current, dict) and isinstance(value, dict):
+            merged[key] = _merge_rule_data(current, value)
+        elif isinstance(current, list) and isinstance(value, list):
+            merged[key] = current + [item for item in value if item not in current]
+        else:
+            merged[key] = value
+    return merged
+
+
+def _read_rule_file(path: Path) -> Dict[str, Any]:
+    with path.open("r", encoding="utf-8") as handle:
+        data = json.load(handle)
+    if not isinstance(data, dict):
+        raise ValueError(f"规则文件顶层必须是对象: {path}")
+    return data
+
+
+_DEFAULT_RULES = PostprocessRules(_read_rule_file(_RULES_PATH))
+
+
+@lru_cache(maxsize=8)
+def _load_extra_rules(path: str, mtime: float) -> PostprocessRules:
+    return _DEFAULT_RULES.merged(_read_rule_file(Path(path)))
+
+
+def load_postprocess_rules(extra_rules_file: str = "") -> PostprocessRules:
+    """内置规则 + 可选的追加规则文件（如人设专属 tag）；文件修改后自动重新加载。
+
+    追加文件不存在或格式错误时记录警告并回退内置规则。
+    """
+    path = str(extra_rules_file or "").strip()
+    if not path:
+        return _DEFAULT_RULES
+    try:
+        resolved = Path(path).expanduser().resolve()
+        return _load_extra_rules(str(resolved), resolved.stat().st_mtime)
+    except (OSError, ValueError) as exc:
+        logger.warning("[PromptPostprocess] 追加规则文件 %s 加载失败，使用内置规则: %s", path, exc)
+        return _DEFAULT_RULES
+
+
+@lru_cache(maxsize=8)
+def _build_sfw_matcher(
+    rules: PostprocessRules,
+    extra_exact: Tuple[str, ...],
+    extra_substrings: Tuple[str, ...],
+) -> SfwTagMatcher:
+    sfw = rules.data.get("sfw") or {}
+    return SfwTagMatcher(
+        (*(sfw.get("banned_exact") or ()), *extra_exact),
+        (*(sfw.get("banned_substrings") or ()), *extra_substrings),
+    )
+
+
+def get_sfw_matcher(
+    extra_exact: Iterable[str] = (),
+    extra_substrings: Iterable[str] = (),
+    *,
+    rules: Optional[PostprocessRules] = None,
+) -> SfwTagMatcher:
+    """规则表中的 SFW 规则 + 配置追加项的匹配器；相同追加项复用已编译的实例。"""
+    rules = rules or _DEFAULT_RULES
+    extra_exact = tuple(sorted({str(item).strip().lower() for item in extra_exact or () if str(item).strip()}))
+    extra_substrings = tuple(sorted({str(item).strip().lower() for item in extra_substrings or () if str(item).strip()}))
+    if not extra_exact and not extra_substrings:
+        return rules.sfw_matcher
+    return _build_sfw_matcher(rules, extra_exact, extra_substrings)
+
+
+def _is_selfie_appearance_tag(core: str, rules: PostprocessRules = _DEFAULT_RULES) -> bool:
+    """自拍里容易产生随机外貌的发色/发型/瞳色 tag（配饰不算）。"""
+    # 明确配饰：不移除
+    if "hair" in core and rules.accessory_re is not None and rules.accessory_re.search(core):
+        return False
+    return core in rules.hair_styles or rules.appearance_re.match(core) is not None
+
+
+def _is_self_character_tag(
+    core: str,
+    *,
+    remove_persona_appearance: bool,
+    rules: PostprocessRules = _DEFAULT_RULES,
+) -> bool:
+    """bot 人设 tag（角色名，可选连同人设外貌）。"""
+    core = core.strip("_")
+    normalized = core.replace("_", " ")
+    compact = _NON_WORD_RE.sub("", core)
+    for candidate in (core, normalized, compact):
+        if candidate in rules.self_banned_exact:
             return True
-        if re.match(r"^[a-z]+-haired$", core):
+        if remove_persona_appearance and candidate in rules.persona_appearance:
             return True
+    pattern = rules.self_substring_re
+    return pattern is not None and (pattern.search(core) is not None or pattern.search(normalized) is not None)
 
-        # 发型/长度：long hair / very long hair / short hair / medium hair
-        if re.match(r"^(?:very )?(?:long|short|medium)\s+hair$", core):
-            return True
 
-        # 常见发型词
-        if core in hair_styles_exact:
-            return True
+def _order_rank(tag: PromptTag, rules: PostprocessRules = _DEFAULT_RULES) -> int:
+    core = tag.core
+    if core == "nsfw":
+        return _RANK_NSFW
+    if _YEAR_RE.match(core):
+        return _RANK_YEAR
+    if _COUNT_RE.match(core):
+        return _RANK_COUNT
+    if core in rules.camera_tags:
+        return _RANK_CAMERA
+    return _RANK_REST
 
-        # 瞳色：xxx eyes
-        m2 = re.match(r"^([a-z]+)\s+eyes$", core)
-        if m2 and m2.group(1) in eye_colors:
-            return True
 
-        return False
+def postprocess_prompt(
+    prompt: str,
+    *,
+    remove_self_character: bool = False,
+    remove_persona_appearance: bool = False,
+    remove_selfie_appearance: bool = False,
+    normalize_order: bool = False,
+    sanitize_sfw: bool = False,
+    sfw_matcher: Optional[SfwTagMatcher] = None,
+    rules: Optional[PostprocessRules] = None,
+) -> str:
+    """一次解析、一次遍历完成整条后处理链，最后一次性序列化。
+
+    各开关与单独调用 remove_self_character_tags / remove_selfie_appearance_tags /
+    normalize_prompt_order / sanitize_sfw_prompt 的效果一致；rules 缺省为内置规则表。
+    """
+    if not prompt or not prompt.strip():
+        return prompt
 
-    lines = _split_prompt_segments(prompt)
-    out_lines: List[str] = []
-    for line in lines:
-        raw = line.strip()
-        if not raw:
-            continue
-        raw_line = raw
+    if not (remove_self_character or remove_selfie_appearance or normalize_order or sanitize_sfw):
+        return prompt
 
-        prefix = ""
-        if raw.startswith("|"):
-            prefix = "|"
-            raw = raw[1:].strip()
+    rules = rules or _DEFAULT_RULES
+    ast = parse_prompt(prompt)
 
-        tags = [t.strip() for t in raw.split(",") if t.strip()]
-        filtered = [t for t in tags if not should_remove(t)]
+    forbidden: set = set()
+    if sanitize_sfw:
+        tags = list(ast.iter_tags())
+        flags = (sfw_matcher or rules.sfw_matcher).classify([tag.core for tag in tags])
+        forbidden = {tag for tag, flag in zip(tags, flags) if flag}
 
-        joined = _preserve_trailing_comma(", ".join(filtered), raw_line)
-        if prefix:
-            out_lines.append(f"{prefix} {joined}".strip())
-        else:
-            out_lines.append(joined)
+    def should_remove(tag: PromptTag) -> bool:
+        if tag in forbidden:
+            return True
+        core = tag.core
+        if remove_self_character and _is_self_character_tag(
+            core, remove_persona_appearance=remove_persona_appearance, rules=rules
+        ):
+            return True
+        return remove_selfie_appearance and _is_selfie_appearance_tag(core, rules)
+
+    if remove_self_character or remove_selfie_appearance or sanitize_sfw:
+        ast.filter_tags(should_remove)
+    if normalize_order:
+        # 视角类标签通常比 1girl/1boy 更“前置有效”，所以输出时把 camera 放在 count 之前
+        # 但保留原始相对顺序（分别在各自组内稳定）
+        ast.reorder_tags(lambda tag: _order_rank(tag, rules), default_rank=_RANK_REST)
+    return ast.serialize()
 
-    return _join_prompt_segments(out_lines, prompt)
+
+def remove_selfie_appearance_tags(prompt: str) -> str:
+    """
+    去掉自拍里常见的“随机外貌标签”（发色/发型/瞳色）。
+
+    只移除明确的外貌 tag，尽量不伤及配饰（如 hair ribbon / hair ornament）。
+    """
+    return postprocess_prompt(prompt, remove_selfie_appearance=True)
 
 
 def user_requests_self_character(user_request: str) -> bool:
@@ -337,134 +392,16 @@ def user_requests_self_character(user_request: str) -> bool:
 
 def remove_self_character_tags(prompt: str, *, remove_persona_appearance: bool = False) -> str:
     """非本人请求时移除 bot 人设 tag，避免覆盖用户指定主体。"""
-    if not prompt or not prompt.strip():
-        return prompt
-
-    banned_exact = {
-        "character:azumase",
-        "character:azumaren",
-        "character:azumaseren",
-        "azuma seren",
-        "azumase",
-        "azumaren",
-        "azumaseren",
-        "东雪莲",
-        "東雪蓮",
-        "银白双马尾",
-        "紫色眼睛",
-    }
-    if remove_persona_appearance:
-        banned_exact.update(
-            {
-                "white hair",
-                "silver hair",
-                "silver white hair",
-                "silver-white hair",
-                "twintails",
-                "twin tails",
-                "purple eyes",
-            }
-        )
-    banned_substrings = (
-        "character:azuma",
-        "azuma_seren",
-        "azuma seren",
+    return postprocess_prompt(
+        prompt,
+        remove_self_character=True,
+        remove_persona_appearance=remove_persona_appearance,
     )
 
-    def should_remove(tag: str) -> bool:
-        core = _strip_wrappers(tag).lower()
-        core = re.sub(r"\s+", " ", core).strip()
-        core = core.strip("_")
-        normalized = core.replace("_", " ")
-        compact = re.sub(r"[^a-z0-9\u4e00-\u9fff]+", "", core)
-        if core in banned_exact or normalized in banned_exact or compact in banned_exact:
-            return True
-        return any(token in core or token in normalized for token in banned_substrings)
-
-    lines = _split_prompt_segments(prompt)
-    out_lines: List[str] = []
-    for line in lines:
-        raw = line.strip()
-        if not raw:
-            continue
-        raw_line = raw
-
-        prefix = ""
-        if raw.startswith("|"):
-            prefix = "|"
-            raw = raw[1:].strip()
-
-        role_prefix = ""
-        role_match = re.match(r"^(char\d+:)\s*(.*)$", raw, re.IGNORECASE)
-        if role_match:
-            role_prefix = role_match.group(1)
-            raw = role_match.group(2)
-
-        tags = [t.strip() for t in raw.split(",") if t.strip()]
-        filtered = [t for t in tags if not should_remove(t)]
-        if not filtered:
-            continue
-
-        joined = _preserve_trailing_comma(", ".join(filtered), raw_line)
-        rebuilt = f"{role_prefix}{joined}" if role_prefix else joined
-        if prefix:
-            out_lines.append(f"{prefix} {rebuilt}".strip())
-        else:
-            out_lines.append(rebuilt)
-
-    return _join_prompt_segments(out_lines, prompt)
-
 
-def sanitize_sfw_prompt(prompt: str) -> str:
+def sanitize_sfw_prompt(prompt: str, *, sfw_matcher: Optional[SfwTagMatcher] = None) -> str:
     """移除 SFW 模式下不应出现的擦边/色情标签。"""
-    if not prompt or not prompt.strip():
-        return prompt
-
-    def is_forbidden(tag: str) -> bool:
-        core = _strip_wrappers(tag).lower()
-        core = re.sub(r"\s+", " ", core).strip()
-        core = re.sub(r"^(?:source|target|mutual)#", "", core).strip()
-        if not core:
-            return False
-
-        if core in _SFW_BANNED_EXACT_TAGS:
-            return True
-
-        return any(token in core for token in _SFW_BANNED_SUBSTRINGS)
-
-    lines = _split_prompt_segments(prompt)
-    out_lines: List[str] = []
-    for line in lines:
-        raw = line.strip()
-        if not raw:
-            continue
-        raw_line = raw
-
-        prefix = ""
-        if raw.startswith("|"):
-            prefix = "|"
-            raw = raw[1:].strip()
-
-        role_prefix = ""
-        role_match = re.match(r"^(char\d+:)\s*(.*)$", raw, re.IGNORECASE)
-        if role_match:
-            role_prefix = role_match.group(1)
-            raw = role_match.group(2)
-
-        tags = [t.strip() for t in raw.split(",") if t.strip()]
-        filtered = [t for t in tags if not is_forbidden(t)]
-        if not filtered:
-            continue
-
-        joined = ", ".join(filtered)
-        joined = _preserve_trailing_comma(joined, raw_line)
-        rebuilt = f"{role_prefix}{joined}" if role_prefix else joined
-        if prefix:
-            out_lines.append(f"{prefix} {rebuilt}".strip())
-        else:
-            out_lines.append(rebuilt)
-
-    return _join_prompt_segments(out_lines, prompt)
+    return postprocess_prompt(prompt, sanitize_sfw=True, sfw_matcher=sfw_matcher)
 
 
 def normalize_prompt_order(prompt: str) -> str:
@@ -474,57 +411,7 @@ def normalize_prompt_order(prompt: str) -> str:
     - 把 POV/自拍/视角等常见镜头词前置
     - 把 year xxxx 放到末尾
     """
-    if not prompt or not prompt.strip():
-        return prompt
-
-    lines = _split_prompt_segments(prompt)
-    out_lines: List[str] = []
-    for line in lines:
-        raw = line.strip()
-        if not raw:
-            continue
-        raw_line = raw
-
-        prefix = ""
-        if raw.startswith("|"):
-            prefix = "|"
-            raw = raw[1:].strip()
-
-        tags = [t.strip() for t in raw.split(",") if t.strip()]
-        if not tags:
-            continue
-
-        nsfw_tags: List[str] = []
-        counts: List[str] = []
-        cameras: List[str] = []
-        years: List[str] = []
-        rest: List[str] = []
-
-        for t in tags:
-            core = _strip_wrappers(t)
-            core_norm = re.sub(r"\s+", " ", core).strip().lower()
-
-            if core_norm == "nsfw":
-                nsfw_tags.append(t)
-            elif _YEAR_RE.match(core_norm):
-                years.append(t)
-            elif _COUNT_RE.match(core_norm):
-                counts.append(t)
-            elif core_norm in _CAMERA_TAGS:
-                cameras.append(t)
-            else:
-                rest.append(t)
-
-        # 视角类标签通常比 1girl/1boy 更“前置有效”，所以输出时把 camera 放在 count 之前
-        # 但保留原始相对顺序（分别在各自组内稳定）
-        new_tags = nsfw_tags + cameras + counts + rest + years
-        joined = _preserve_trailing_comma(", ".join(new_tags).strip(), raw_line)
-        if prefix:
-            out_lines.append(f"{prefix} {joined}".strip())
-        else:
-            out_lines.append(joined)
-
-    return _join_prompt_segments(out_lines, prompt)
+    return postprocess_prompt(prompt, normalize_order=True)
 
 # ==================== 结构化多角色后处理 ====================
 # 这些 wrapper 复用上面的字符串实现，专门服务于 NewAPI `characters[]` 通道。
@@ -606,3 +493,12 @@ def remove_self_character_from_characters(
             remove_persona_appearance=remove_persona_appearance,
         ),
     )
+
+
+def postprocess_characters(
+    global_text: str,
+    characters: List[Dict[str, Any]],
+    **options: Any,
+) -> Tuple[str, List[Dict[str, Any]]]:
+    """对 global 与每个 character 一次性跑完整条后处理链（开关同 postprocess_prompt）。"""
+    return _apply_string_filter_to_characters(global_text, characters, partial(postprocess_prompt, **options))
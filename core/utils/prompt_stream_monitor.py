@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+流式 LLM 输出监视器
+
+边接收 token 边做增量判断，不必等完整回复再校验：
+- JSON 对象开始之前出现拒答/网关错误标记 → 立即判定中止，调用方可马上重试
+  （<think>…</think> 推理段不算前缀，推理里出现 "I can't" 之类不会误判）
+- 顶层对象闭合且确实是结果 JSON（能 json.loads 成 dict，或带 prompt/global/people 字段）→ 判定完成，
+  后续闲聊不必再读；纯文本 tag 回复里的 {{masterpiece}} 之类权重括号闭合时继续读
+
+只做括号深度与字符串转义的增量扫描，已扫描过的字符不会重复处理；
+最终内容仍交给 prompt_output_parser / 校验逻辑处理。
+"""
+
+from __future__ import annotations
+
+import json
+import re
+from typing import Iterable, Optional
+
+STREAM_CONTINUE = "continue"
+STREAM_ABORT = "abort"
+STREAM_COMPLETE = "complete"
+
+_THINK_OPEN = "<think>"
+_THINK_CLOSE = "</think>"
+_PREFIX_TOKEN_RE = re.compile(r"\{|<think>", re.IGNORECASE)
+_THINK_CLOSE_RE = re.compile(r"</think>", re.IGNORECASE)
+# 解析器也接受不严格的 JSON（尾逗号等），带这些字段的对象同样视为结果
+_RESULT_KEY_RE = re.compile(r'"(?:prompt|global|people)"\s*:')
+
+
+def _partial_tag_length(text: str) -> int:
+    """text 末尾可能是被切断的 <think> / </think> 的长度（留到下一块再判断）。"""
+    lower = text[-len(_THINK_CLOSE) + 1 :].lower()
+    for size in range(len(lower), 0, -1):
+        tail = lower[-size:]
+        if _THINK_OPEN.startswith(tail) or _THINK_CLOSE.startswith(tail):
+            return size
+    return 0
+
+
+class PromptStreamMonitor:
+    """增量 JSON 监视器。feed() 返回 continue / abort / complete。"""
+
+    __slots__ = (
+        "_markers",
+        "_lower_markers",
+        "_prefix_limit",
+        "_parts",
+        "_length",
+        "_scanned",
+        "_depth",
+        "_in_string",
+        "_escape",
+        "_object_started",
+        "_object_start",
+        "_in_think",
+        "_carry",
+        "_prefix",
+        "_complete",
+        "reason",
+    )
+
+    def __init__(self, abort_markers: Iterable[str], *, prefix_limit: int = 160) -> None:
+        self._markers = tuple(marker for marker in abort_markers if marker)
+        self._lower_markers = tuple(marker.lower() for marker in self._markers)
+        self._prefix_limit = max(16, int(prefix_limit))
+        self._parts: list[str] = []
+        self._length = 0
+        self._scanned = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._object_started = False
+        self._object_start = 0
+        self._in_think = False
+        self._carry = ""
+        self._prefix = ""
+        self._complete = False
+        self.reason = ""
+
+    @property
+    def text(self) -> str:
+        return "".join(self._parts)
+
+    @property
+    def object_started(self) -> bool:
+        return self._object_started
+
+    def feed(self, chunk: str) -> str:
+        if not chunk:
+            return STREAM_CONTINUE
+        self._parts.append(chunk)
+        self._length += len(chunk)
+
+        if not self._object_started:
+            verdict, brace = self._feed_prefix(chunk)
+            if verdict != STREAM_CONTINUE or brace < 0:
+                return verdict
+            self._object_started = True
+            self._scanned = self._length - len(chunk) + brace
+            chunk = chunk[brace:]
+
+        return self._scan(chunk)
+
+    def _feed_prefix(self, chunk: str) -> tuple[str, int]:
+        """JSON 开始之前：跳过 <think> 推理段，检查其余前缀；返回 (判定, 对象在 chunk 中的起点或 -1)。"""
+        carry = self._carry
+        buffer = carry + chunk
+        self._carry = ""
+        position = 0
+        while position < len(buffer):
+            if self._in_think:
+                close = _THINK_CLOSE_RE.search(buffer, position)
+                if close is None:
+                    keep = len(buffer) - _partial_tag_length(buffer)
+                    self._carry = buffer[max(position, keep) :]
+                    return STREAM_CONTINUE, -1
+                self._in_think = False
+                position = close.end()
+                continue
+            match = _PREFIX_TOKEN_RE.search(buffer, position)
+            if match is None:
+                keep = len(buffer) - _partial_tag_length(buffer)
+                self._prefix += buffer[position:keep]
+                self._carry = buffer[keep:]
+                return self._check_prefix(), -1
+            self._prefix += buffer[position : match.start()]
+            verdict = self._check_prefix()
+            if verdict != STREAM_CONTINUE:
+                return verdict, -1
+            if match.group(0) == "{":
+                # carry 是上一块留下的半个标签，不含 "{"，对象起点换算回本块
+                return STREAM_CONTINUE, match.start() - len(carry)
+            self._in_think = True
+            position = match.end()
+        return STREAM_CONTINUE, -1
+
+    def _check_prefix(self) -> str:
+        """JSON 开始之前的前缀：出现拒答/错误标记即中止。"""
+        # 只看前 prefix_limit 个字符，更长的前缀不再保留
+        prefix = self._prefix = self._prefix[: self._prefix_limit]
+        if not prefix.strip():
+            return STREAM_CONTINUE
+        lower = prefix.lower()
+        for marker, lower_marker in zip(self._markers, self._lower_markers):
+            if marker in prefix or lower_marker in lower:
+                self.reason = prefix.strip()[:160]
+                return STREAM_ABORT
+        return STREAM_CONTINUE
+
+    def _scan(self, chunk: str) -> str:
+        depth = self._depth
+        in_string = self._in_string
+        escape = self._escape
+        base = self._scanned
+        for index, char in enumerate(chunk):
+            if in_string:
+                if escape:
+                    escape = False
+                elif char == "\\":
+                    escape = True
+                elif char == '"':
+                    in_string = False
+                continue
+            if char == '"':
+                in_string = True
+            elif char == "{":
+                if depth == 0:
+                    self._object_start = base + index
+                depth += 1
+            elif char == "}" and depth > 0:
+                depth -= 1
+                if depth == 0 and self._is_result(base + index + 1):
+                    self._scanned = base + index + 1
+                    self._depth, self._in_string, self._escape = depth, in_string, escape
+                    self._complete = True
+                    return STREAM_COMPLETE
+        self._scanned = base + len(chunk)
+        self._depth, self._in_string, self._escape = depth, in_string, escape
+        return STREAM_CONTINUE
+
+    def _is_result(self, end: int) -> bool:
+        """刚闭合的顶层对象是不是结果 JSON（而不是纯文本 tag 里的权重括号）。"""
+        candidate = self.text[self._object_start : end]
+        if _RESULT_KEY_RE.search(candidate):
+            return True
+        try:
+            return isinstance(json.loads(candidate), dict)
+        except ValueError:
+            return False
+
+    def completed_text(self) -> Optional[str]:
+        """结果 JSON 闭合时返回截至闭合处的文本。"""
+        if not self._complete:
+            return None
+        return self.text[: self._scanned]
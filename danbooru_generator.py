@@ -3,32 +3,48 @@
 
 from __future__ import annotations
 
-from dataclasses import dataclass
+from collections import OrderedDict
+from dataclasses import dataclass, replace
 from typing import Any, Optional
 import asyncio
+import copy
+import hashlib
 import re
+import time
 
 from src.common.logger import get_logger
 
+from . import metrics
 from .core.rules.prompt_rules import PROMPT_GENERATOR_JSON_TEMPLATE, SFW_PROMPT_GENERATOR_JSON_TEMPLATE
 from .core.services.tag_candidate_resolver import resolve_tag_candidates
 from .core.utils.prompt_output_parser import (
-    extract_aspect_from_structured_output,
+    ParsedLLMOutput,
+    parse_llm_output,
     parse_prompt_from_structured_output,
     resolve_multi_character_payload,
 )
 from .core.utils.prompt_postprocessor import (
-    normalize_characters_order,
-    normalize_prompt_order,
-    remove_self_character_from_characters,
-    remove_self_character_tags,
-    remove_selfie_appearance_from_characters,
-    remove_selfie_appearance_tags,
-    sanitize_sfw_characters,
-    sanitize_sfw_prompt,
+    PostprocessRules,
+    SfwTagMatcher,
+    get_sfw_matcher,
+    load_postprocess_rules,
+    postprocess_characters,
+    postprocess_prompt,
     user_requests_self_character,
     user_mentions_appearance,
 )
+from .core.utils.prompt_stream_monitor import STREAM_ABORT, STREAM_CONTINUE, PromptStreamMonitor
+from .runtime_config import RuntimeConfig, get_runtime_config
+from .retry_policy import (
+    ERROR_INVALID,
+    ERROR_OTHER,
+    ERROR_OVERLOAD,
+    ERROR_VISION,
+    INVALID_OUTPUT_HINT,
+    RetryPolicy,
+    RetryPolicyConfig,
+    get_retry_policy,
+)
 
 logger = get_logger("MaiBot_LLM2pic")
 
@@ -44,20 +60,89 @@ class PromptGenerationResult:
     error: str = ""
 
 
-def _bool_config(config: dict[str, Any], path: str, default: bool) -> bool:
-    value: Any = config
-    for part in path.split("."):
-        if not isinstance(value, dict) or part not in value:
-            return default
-        value = value[part]
-    if isinstance(value, bool):
-        return value
-    if isinstance(value, str):
-        return value.strip().lower() in {"1", "true", "yes", "on"}
-    return bool(value)
+# ---- 完整 prompt 生成结果缓存（"再来一张"等重复请求直接复用，跳过 LLM）----
+_PROMPT_CACHE: "OrderedDict[str, tuple[PromptGenerationResult, float]]" = OrderedDict()
+
+DEFAULT_USER_REQUEST = "根据聊天内容生成一张合适的图片"
+# 请求本身为空（按聊天内容画）时，缓存 key 只取最近这几行聊天
+_CACHE_CHAT_LINES = 6
+
+# 用户明确要"换一张/不一样"时不走缓存，保证多样性
+_VARIETY_KEYWORDS = (
+    "换一张",
+    "换一个",
+    "换个",
+    "换一种",
+    "不一样",
+    "不同的",
+    "别的",
+    "重新画",
+    "重画",
+    "重新生成",
+    "另一张",
+    "随机",
+    "variety",
+    "different",
+    "another",
+    "reroll",
+)
+
+
+def user_requests_variety(user_request: str) -> bool:
+    """用户是否要求换一张/不一样的图（此时跳过 prompt 缓存）。"""
+    text = str(user_request or "").strip().lower()
+    if not text:
+        return False
+    return any(keyword in text for keyword in _VARIETY_KEYWORDS)
+
+
+def _normalize_for_cache(text: str) -> str:
+    return " ".join(str(text or "").casefold().split())
+
+
+def _prompt_cache_key(model: str, user_request: str, chat_messages: str, *parts: Any) -> str:
+    """按请求本身而不是渲染后的完整 prompt 计算缓存 key。
+
+    完整 prompt 里有最近的聊天记录，重复请求时它总会变；这里只在请求为空、
+    图完全由聊天内容决定时才带上最近几行聊天（规范化后）。
+    """
+    request = _normalize_for_cache(user_request)
+    if request in ("", _normalize_for_cache(DEFAULT_USER_REQUEST)):
+        lines = [_normalize_for_cache(line) for line in str(chat_messages or "").splitlines()]
+        context = "\n".join([line for line in lines if line][-_CACHE_CHAT_LINES:])
+    else:
+        context = ""
+    digest = hashlib.sha256()
+    for part in (model or "", request, context, *parts):
+        digest.update(b"\0")
+        digest.update(str(part).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _prompt_cache_get(key: str, ttl: float) -> Optional[PromptGenerationResult]:
+    entry = _PROMPT_CACHE.get(key)
+    if entry is None:
+        return None
+    result, ts = entry
+    if time.time() - ts > ttl:
+        _PROMPT_CACHE.pop(key, None)
+        return None
+    _PROMPT_CACHE.move_to_end(key)
+    # 返回副本，避免下游改写 characters 污染缓存
+    return replace(result, characters=copy.deepcopy(result.characters))
+
 
+def _prompt_cache_set(key: str, result: PromptGenerationResult, max_entries: int) -> None:
+    _PROMPT_CACHE[key] = (replace(result, characters=copy.deepcopy(result.characters)), time.time())
+    _PROMPT_CACHE.move_to_end(key)
+    while len(_PROMPT_CACHE) > max_entries:
+        _PROMPT_CACHE.popitem(last=False)
 
 
+def reset_prompt_cache() -> None:
+    """清空 prompt 生成结果缓存（插件卸载/热重载时调用）。"""
+    _PROMPT_CACHE.clear()
+
 
 _OPER_ERROR_MARKERS = (
     "负载过高",
@@ -74,6 +159,28 @@ _OPER_ERROR_MARKERS = (
 )
 
 
+# 流式输出在 JSON 开始前出现这些内容即视为拒答，提前中止
+_REFUSAL_MARKERS = (
+    "抱歉",
+    "对不起",
+    "我不能",
+    "我无法",
+    "无法为你",
+    "无法满足",
+    "不能帮",
+    "i'm sorry",
+    "i am sorry",
+    "i can't",
+    "i cannot",
+    "i won't",
+    "as an ai",
+)
+
+# 最近完整流式回复耗时的 EWMA，用来估算提前中止节省的时间
+_STREAM_FULL_SECONDS_EWMA = [0.0]
+_STREAM_EWMA_ALPHA = 0.2
+
+
 def _is_llm_operational_error(text: str) -> bool:
     """LLM/网关返回的说明性错误，不能当作绘图 prompt。"""
     normalized = str(text or "").strip()
@@ -89,13 +196,16 @@ def _is_llm_operational_error(text: str) -> bool:
     return False
 
 
-def _looks_like_danbooru_prompt(text: str) -> bool:
-    """粗判是否为 Danbooru tag 串，过滤中文说明/拒答。"""
+def _looks_like_danbooru_prompt(text: str, *, structured: bool = False) -> bool:
+    """粗判是否为 Danbooru tag 串，过滤中文说明/拒答。
+
+    structured=True 表示 text 已是从结构化 JSON 渲染出的 prompt，不必再尝试解码。
+    """
     normalized = str(text or "").strip()
     if not normalized or _is_llm_operational_error(normalized):
         return False
 
-    if parse_prompt_from_structured_output(normalized):
+    if structured or parse_prompt_from_structured_output(normalized):
         return True
 
     lower = normalized.lower()
@@ -123,23 +233,28 @@ def _looks_like_danbooru_prompt(text: str) -> bool:
     return len(normalized) >= 12
 
 
-def _validate_prompt_llm_response(response_text: str, cleaned_prompt: str) -> tuple[bool, str]:
+def _validate_prompt_llm_response(
+    response_text: str,
+    cleaned_prompt: str,
+    *,
+    structured: bool = False,
+) -> tuple[bool, str]:
     raw = str(response_text or "").strip()
     cleaned = str(cleaned_prompt or "").strip()
     if _is_llm_operational_error(raw) or _is_llm_operational_error(cleaned):
         return False, (raw or cleaned)[:160]
     if not cleaned:
         return False, "LLM返回空提示词"
-    if not _looks_like_danbooru_prompt(cleaned):
+    if not _looks_like_danbooru_prompt(cleaned, structured=structured):
         return False, (raw or cleaned)[:160]
     return True, ""
 
 
-def _cleanup_llm_prompt(prompt: str) -> str:
+def _cleanup_llm_prompt(prompt: str, parsed: Optional[ParsedLLMOutput] = None) -> str:
     if not prompt:
         return ""
 
-    parsed_prompt = parse_prompt_from_structured_output(prompt)
+    parsed_prompt = (parsed or parse_llm_output(prompt)).prompt
     if parsed_prompt:
         return parsed_prompt
 
@@ -174,7 +289,7 @@ def _render_generator_prompt(
         custom_block = custom_block.replace("{persona}", persona).strip() + "\n\n"
     selfie_hint = "用户明确请求自拍/当前状态，请按自拍模式生成。" if selfie_mode else ""
     request_text = f"""## 用户的绘图请求（最高优先级）
-{user_request.strip() or "根据聊天内容生成一张合适的图片"}
+{user_request.strip() or DEFAULT_USER_REQUEST}
 
 ## 最近的聊天记录（只能用于补充场景、氛围、情绪或消歧，不能替换主体）
 {chat_messages.strip() or "（暂无聊天记录）"}
@@ -198,6 +313,32 @@ def _render_generator_prompt(
     return prompt
 
 
+def _postprocess_options(
+    *,
+    user_request: str,
+    selfie_mode: bool,
+    self_character_requested: bool,
+    sfw_mode: bool,
+    enforce_tag_order: bool,
+    selfie_appearance_policy: str,
+    sfw_matcher: Optional[SfwTagMatcher] = None,
+    rules: Optional[PostprocessRules] = None,
+) -> dict[str, Any]:
+    """后处理链开关（postprocess_prompt / postprocess_characters 共用）。"""
+    appearance_mentioned = user_mentions_appearance(user_request)
+    return {
+        "remove_self_character": not self_character_requested,
+        "remove_persona_appearance": not appearance_mentioned,
+        "remove_selfie_appearance": (
+            selfie_mode and not appearance_mentioned and selfie_appearance_policy in {"auto", "never"}
+        ),
+        "normalize_order": enforce_tag_order,
+        "sanitize_sfw": sfw_mode,
+        "sfw_matcher": sfw_matcher,
+        "rules": rules,
+    }
+
+
 def _postprocess_multi_character_payload(
     payload: Optional[dict[str, Any]],
     *,
@@ -207,6 +348,8 @@ def _postprocess_multi_character_payload(
     sfw_mode: bool,
     enforce_tag_order: bool,
     selfie_appearance_policy: str,
+    sfw_matcher: Optional[SfwTagMatcher] = None,
+    rules: Optional[PostprocessRules] = None,
 ) -> Optional[dict[str, Any]]:
     if not payload:
         return None
@@ -220,13 +363,7 @@ def _postprocess_multi_character_payload(
     if len(characters) < 2:
         return None
 
-    if not self_character_requested:
-        global_text, characters = remove_self_character_from_characters(
-            global_text,
-            characters,
-            remove_persona_appearance=not user_mentions_appearance(user_request),
-        )
-    elif "azuma_seren" not in global_text.lower() and "character:azuma" not in global_text.lower():
+    if self_character_requested and "azuma_seren" not in global_text.lower() and "character:azuma" not in global_text.lower():
         # Multi-character: inject azuma_seren + appearance into the matching character entry, not global
         _azuma_anchor = "{{{azuma_seren}}}, silver-white twin tails, purple eyes"
         _injected = False
@@ -241,12 +378,20 @@ def _postprocess_multi_character_payload(
             if characters:
                 _first = characters[0]
                 _first["prompt"] = f"{_azuma_anchor}, " + str(_first.get("prompt", "") or "").strip(", ")
-    if selfie_mode and not user_mentions_appearance(user_request) and selfie_appearance_policy in {"auto", "never"}:
-        global_text, characters = remove_selfie_appearance_from_characters(global_text, characters)
-    if enforce_tag_order:
-        global_text, characters = normalize_characters_order(global_text, characters)
-    if sfw_mode:
-        global_text, characters = sanitize_sfw_characters(global_text, characters)
+    global_text, characters = postprocess_characters(
+        global_text,
+        characters,
+        **_postprocess_options(
+            user_request=user_request,
+            selfie_mode=selfie_mode,
+            self_character_requested=self_character_requested,
+            sfw_mode=sfw_mode,
+            enforce_tag_order=enforce_tag_order,
+            selfie_appearance_policy=selfie_appearance_policy,
+            sfw_matcher=sfw_matcher,
+            rules=rules,
+        ),
+    )
 
     if len(characters) < 2 or not global_text.strip():
         return None
@@ -299,130 +444,447 @@ def _infer_aspect_from_text(
     return "portrait"
 
 
-async def generate_danbooru_prompt(
+@dataclass
+class _PromptAttemptOutcome:
+    ok: bool
+    full_prompt: str
+    response_text: str = ""
+    generated_prompt: str = ""
+    error: str = ""
+    parsed: Optional[ParsedLLMOutput] = None
+
+
+async def _stream_generate(llm: Any, generate_kwargs: dict[str, Any]) -> tuple[dict[str, Any], bool]:
+    """流式调用 LLM，边收边检查；返回 (与 generate 同形的结果, 是否提前中止)。"""
+    monitor = PromptStreamMonitor((*_OPER_ERROR_MARKERS, *_REFUSAL_MARKERS))
+    started = time.monotonic()
+    first_token = True
+    verdict = STREAM_CONTINUE
+    stream = llm.generate_stream(**generate_kwargs)
+    try:
+        async for chunk in stream:
+            if first_token:
+                first_token = False
+                metrics.observe("prompt.stream.ttft", time.monotonic() - started)
+            verdict = monitor.feed(str(chunk))
+            if verdict != STREAM_CONTINUE:
+                break
+    finally:
+        await stream.aclose()
+
+    elapsed = time.monotonic() - started
+    if verdict == STREAM_ABORT:
+        metrics.incr("prompt.stream.aborted")
+        return {"success": False, "error": monitor.reason or "LLM 拒答"}, True
+
+    metrics.observe("prompt.stream.full", elapsed)
+    ewma = _STREAM_FULL_SECONDS_EWMA[0]
+    _STREAM_FULL_SECONDS_EWMA[0] = elapsed if ewma <= 0 else ewma + _STREAM_EWMA_ALPHA * (elapsed - ewma)
+    return {"success": True, "response": monitor.completed_text() or monitor.text}, False
+
+
+async def _run_prompt_attempts(
     *,
-    config: dict[str, Any],
     llm: Any,
     model: str,
-    user_request: str,
+    full_prompt: str,
+    temperature: float,
     chat_messages: str,
-    persona: str,
-    selfie_mode: bool,
-    nsfw_allowed: bool,
-    custom_system_prompt: str = "",
-    reference_tags: str = "",
-    reference_image_base64: str = "",
-) -> PromptGenerationResult:
-    """Generate Danbooru tags using the vendored nai_draw_plugin-style pipeline."""
-    llm_config = config.get("llm", {}) if isinstance(config.get("llm"), dict) else {}
-    sfw_mode = bool(llm_config.get("danbooru_sfw_mode", True)) and not nsfw_allowed
-    template = SFW_PROMPT_GENERATOR_JSON_TEMPLATE if sfw_mode else PROMPT_GENERATOR_JSON_TEMPLATE
-    retriever_config = config.get("tag_retriever")
-    tag_candidates = await resolve_tag_candidates(
-        retriever_config if isinstance(retriever_config, dict) else {},
-        user_request,
-        log_prefix="[DanbooruPrompt]",
-    )
-    full_prompt = _render_generator_prompt(
-        template=template,
-        user_request=user_request,
-        chat_messages=chat_messages,
-        persona=persona,
-        selfie_mode=selfie_mode,
-        custom_system_prompt=custom_system_prompt,
-        tag_candidates=tag_candidates,
-        reference_tags=reference_tags,
-    )
-
-    max_attempts = max(1, min(int(llm_config.get("prompt_retry_attempts", 3) or 3), 5))
-    base_delay = max(0.5, float(llm_config.get("prompt_retry_delay_seconds", 2) or 2))
-    temperature = float(llm_config.get("temperature", 0.2) or 0.2)
+    reference_image_base64: str,
+    max_attempts: int,
+    retry_config: RetryPolicyConfig,
+    label: str = "",
+    streaming: bool = False,
+) -> _PromptAttemptOutcome:
+    """带重试地调用 LLM，直到拿到通过校验的 Danbooru prompt。
+
+    重试节奏按失败类型由 retry_policy 决定：负载报错指数退避，输出无效立即带纠正提示重试，
+    带图失败立即降级为纯文本；全局重试预算耗尽时不再重试。
+    streaming=True 时纯文本调用走流式：前缀出现拒答/网关错误即中止。
+    """
+    policy = get_retry_policy()
+    policy.on_request(retry_config)
     last_error = "LLM生成失败"
     vision_failed = False  # if vision call fails, downgrade subsequent retries to text-only
+    log_prefix = f"[DanbooruPrompt]{label}"
+    request_prompt = full_prompt
 
     result: dict[str, Any] | None = None
     response_text = ""
     generated_prompt = ""
+    parsed: Optional[ParsedLLMOutput] = None
 
     for attempt in range(1, max_attempts + 1):
+        aborted = False
+        attempt_started = time.monotonic()
         try:
             generate_kwargs: dict[str, Any] = {
-                "prompt": full_prompt,
+                "prompt": request_prompt,
                 "model": model,
                 "temperature": temperature,
             }
+            if policy.prefer_fallback(retry_config):
+                generate_kwargs["prefer_fallback"] = True
             if reference_image_base64 and not vision_failed:
                 generate_kwargs["image_base64"] = reference_image_base64
                 generate_kwargs["chat_messages"] = chat_messages
-            result = await llm.generate(**generate_kwargs)
+                result = await llm.generate(**generate_kwargs)
+            elif streaming:
+                result, aborted = await _stream_generate(llm, generate_kwargs)
+            else:
+                result = await llm.generate(**generate_kwargs)
         except Exception as exc:
             last_error = str(exc)
             logger.warning(
-                "[DanbooruPrompt] LLM 调用异常 attempt=%s/%s: %s",
+                "%s LLM 调用异常 attempt=%s/%s: %s",
+                log_prefix,
                 attempt,
                 max_attempts,
                 exc,
             )
             if reference_image_base64 and not vision_failed:
                 vision_failed = True
-                logger.info("[DanbooruPrompt] vision 调用失败，后续 retry 降级为纯文本（用 WD14+VLM tag）")
-            if attempt < max_attempts:
-                await asyncio.sleep(base_delay * attempt)
+                error_class = ERROR_VISION
+                logger.info("%s vision 调用失败，后续 retry 降级为纯文本（用 WD14+VLM tag）", log_prefix)
+            elif _is_llm_operational_error(last_error):
+                error_class = ERROR_OVERLOAD
+            else:
+                error_class = ERROR_OTHER
+            if await _wait_for_retry(policy, retry_config, error_class, attempt, max_attempts, log_prefix):
                 continue
-            logger.error("[DanbooruPrompt] LLM 调用失败: %s", exc, exc_info=True)
-            return PromptGenerationResult(False, error=str(exc))
+            logger.error("%s LLM 调用失败: %s", log_prefix, exc, exc_info=True)
+            return _PromptAttemptOutcome(False, full_prompt, error=str(exc))
 
         if not isinstance(result, dict):
             last_error = f"LLM 返回非 dict: {type(result).__name__}"
+            error_class = ERROR_OTHER
         elif not bool(result.get("success", False)):
             last_error = str(result.get("error") or "LLM生成失败")
+            if aborted:
+                error_class = ERROR_OVERLOAD if _is_llm_operational_error(last_error) else ERROR_INVALID
+            else:
+                error_class = ERROR_OVERLOAD if _is_llm_operational_error(last_error) else ERROR_OTHER
         else:
             response_text = str(result.get("response") or "").strip()
-            generated_prompt = _cleanup_llm_prompt(response_text)
-            ok, reason = _validate_prompt_llm_response(response_text, generated_prompt)
+            parsed = parse_llm_output(response_text)
+            generated_prompt = _cleanup_llm_prompt(response_text, parsed)
+            ok, reason = _validate_prompt_llm_response(
+                response_text,
+                generated_prompt,
+                structured=bool(parsed.prompt),
+            )
             if ok:
+                if parsed.repaired:
+                    metrics.incr("prompt.output.repaired")
+                    logger.info("%s LLM 输出被截断，已补全 JSON 后使用（attempt=%s）", log_prefix, attempt)
                 break
             last_error = f"无效提示词: {reason}"
+            error_class = ERROR_OVERLOAD if _is_llm_operational_error(response_text) else ERROR_INVALID
             logger.warning(
-                "[DanbooruPrompt] 提示词无效 attempt=%s/%s: %s",
+                "%s 提示词无效 attempt=%s/%s: %s",
+                log_prefix,
                 attempt,
                 max_attempts,
                 reason[:120],
             )
 
-        if attempt < max_attempts:
-            await asyncio.sleep(base_delay * attempt)
+        if aborted:
+            saved = max(0.0, _STREAM_FULL_SECONDS_EWMA[0] - (time.monotonic() - attempt_started))
+            metrics.observe("prompt.stream.saved", saved)
+            logger.warning(
+                "%s 流式输出提前中止 attempt=%s/%s（约节省 %.2fs）: %s",
+                log_prefix,
+                attempt,
+                max_attempts,
+                saved,
+                last_error[:120],
+            )
+
+        if error_class == ERROR_INVALID:
+            request_prompt = f"{full_prompt}{INVALID_OUTPUT_HINT}"
+        if await _wait_for_retry(policy, retry_config, error_class, attempt, max_attempts, log_prefix):
             continue
-        return PromptGenerationResult(False, error=last_error[:200])
+        return _PromptAttemptOutcome(False, full_prompt, error=last_error[:200])
 
     if not generated_prompt:
-        return PromptGenerationResult(False, error=last_error[:200])
+        return _PromptAttemptOutcome(False, full_prompt, error=last_error[:200])
+    return _PromptAttemptOutcome(True, full_prompt, response_text, generated_prompt, parsed=parsed)
+
+
+async def _wait_for_retry(
+    policy: RetryPolicy,
+    retry_config: RetryPolicyConfig,
+    error_class: str,
+    attempt: int,
+    max_attempts: int,
+    log_prefix: str,
+) -> bool:
+    """记录失败并按策略等待；返回 False 表示不再重试（次数用尽或预算耗尽）。
+
+    带图失败降级为纯文本的重试不占预算：它换了一种调用方式，而不是把同一个请求再压一遍。
+    """
+    policy.record_failure(error_class, retry_config)
+    if attempt >= max_attempts:
+        return False
+    if error_class != ERROR_VISION and not policy.try_acquire_retry(retry_config):
+        logger.warning("%s 全局重试预算已耗尽，放弃重试（%s）", log_prefix, error_class)
+        return False
+    delay = policy.delay_for(error_class, attempt, retry_config)
+    if delay > 0:
+        await asyncio.sleep(delay)
+    return True
+
+
+def _enrichment_value(task: Optional[asyncio.Future]) -> str:
+    """已完成的富化任务结果；未完成、取消或异常时视为空。"""
+    if task is None or not task.done() or task.cancelled() or task.exception() is not None:
+        return ""
+    return str(task.result() or "")
+
+
+async def _race_speculative(
+    lean_prompt: str,
+    enrichment_tasks: list[asyncio.Future],
+    render_enriched: Any,
+    run_attempts: Any,
+) -> _PromptAttemptOutcome:
+    """推测调用与富化调用竞速，先返回有效结果者胜出，另一路取消。"""
+    started = time.monotonic()
+
+    async def _lean() -> _PromptAttemptOutcome:
+        outcome = await run_attempts(lean_prompt, "[speculative]")
+        metrics.observe("prompt.speculative.lean_latency", time.monotonic() - started)
+        return outcome
+
+    async def _enriched() -> _PromptAttemptOutcome:
+        await asyncio.wait(enrichment_tasks)
+        outcome = await run_attempts(render_enriched(), "[enriched]")
+        metrics.observe("prompt.speculative.enriched_latency", time.monotonic() - started)
+        return outcome
+
+    contenders = {
+        asyncio.ensure_future(_lean()): "lean",
+        asyncio.ensure_future(_enriched()): "enriched",
+    }
+    pending = set(contenders)
+    first_failure: Optional[_PromptAttemptOutcome] = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.cancelled() or task.exception() is not None:
+                    continue
+                outcome = task.result()
+                if outcome.ok:
+                    winner = contenders[task]
+                    metrics.incr(f"prompt.speculative.winner.{winner}")
+                    logger.info(
+                        "[DanbooruPrompt] 推测竞速胜出=%s，用时 %.2fs",
+                        winner,
+                        time.monotonic() - started,
+                    )
+                    return outcome
+                first_failure = first_failure or outcome
+    finally:
+        for task in pending:
+            task.cancel()
+    metrics.incr("prompt.speculative.winner.none")
+    return first_failure or _PromptAttemptOutcome(False, lean_prompt, error="LLM生成失败")
+
+
+async def generate_danbooru_prompt(
+    *,
+    config: dict[str, Any],
+    llm: Any,
+    model: str,
+    user_request: str,
+    chat_messages: str,
+    persona: str,
+    selfie_mode: bool,
+    nsfw_allowed: bool,
+    custom_system_prompt: str = "",
+    reference_tags: str = "",
+    reference_image_base64: str = "",
+    reference_tags_task: Optional[asyncio.Future] = None,
+    runtime: Optional[RuntimeConfig] = None,
+) -> PromptGenerationResult:
+    """Generate Danbooru tags using the vendored nai_draw_plugin-style pipeline.
+
+    ``reference_tags_task`` 为仍在进行的参考图反推（结果拼在 ``reference_tags`` 前）；
+    开启 ``llm.speculative_budget_seconds`` 后，富化阶段超出预算即先用已有信息调用 LLM。
+    ``runtime`` 为调用方已物化的配置快照，缺省时按 ``config`` 取。
+    """
+    runtime = runtime or get_runtime_config(config)
+    llm_config = runtime.llm
+    sfw_mode = llm_config.danbooru_sfw_mode and not nsfw_allowed
+    postprocess_rules = load_postprocess_rules(llm_config.postprocess_rules_file)
+    sfw_matcher = get_sfw_matcher(
+        llm_config.sfw_extra_banned_tags,
+        llm_config.sfw_extra_banned_substrings,
+        rules=postprocess_rules,
+    )
+    template = SFW_PROMPT_GENERATOR_JSON_TEMPLATE if sfw_mode else PROMPT_GENERATOR_JSON_TEMPLATE
+    selfie_appearance_policy = llm_config.selfie_appearance_policy
+    enforce_tag_order = llm_config.enforce_tag_order
+    temperature = llm_config.temperature
+
+    # ── 缓存：key 只看请求本身与影响输出的配置，命中时连富化阶段也跳过 ──
+    cache_ttl = llm_config.prompt_cache_ttl_seconds
+    cache_max_entries = llm_config.prompt_cache_max_entries
+    use_cache = llm_config.prompt_cache_enabled and cache_ttl > 0
+    if use_cache and user_requests_variety(user_request):
+        logger.info("[DanbooruPrompt] 用户要求换一张/不一样，跳过 prompt 缓存")
+        use_cache = False
+    cache_key = ""
+    if use_cache:
+        cache_key = _prompt_cache_key(
+            model,
+            user_request,
+            chat_messages,
+            _normalize_for_cache(persona),
+            _normalize_for_cache(custom_system_prompt),
+            hashlib.sha256(reference_image_base64.encode("ascii", "ignore")).hexdigest() if reference_image_base64 else "",
+            _normalize_for_cache(reference_tags),
+            selfie_mode,
+            sfw_mode,
+            sfw_matcher.signature,
+            postprocess_rules.signature,
+            selfie_appearance_policy,
+            enforce_tag_order,
+            temperature,
+        )
+        cached = _prompt_cache_get(cache_key, cache_ttl)
+        if cached is not None:
+            logger.info("[DanbooruPrompt] prompt 缓存命中，跳过 LLM")
+            metrics.incr("prompt.cache.hit")
+            if reference_tags_task is not None and not reference_tags_task.done():
+                reference_tags_task.cancel()
+            return cached
+        metrics.incr("prompt.cache.miss")
+
+    # ── 富化阶段：tag 候选检索 +（可选）参考图反推，超出预算则推测执行 ──
+    speculative_budget = llm_config.speculative_budget_seconds
+    enrichment_started = time.monotonic()
+    candidates_task = asyncio.ensure_future(
+        resolve_tag_candidates(
+            runtime.tag_retriever,
+            user_request,
+            log_prefix="[DanbooruPrompt]",
+        )
+    )
+    candidates_task.add_done_callback(
+        lambda _: metrics.observe("prompt.enrichment.tag_candidates", time.monotonic() - enrichment_started)
+    )
+    enrichment_tasks: list[asyncio.Future] = [candidates_task]
+    if reference_tags_task is not None:
+        enrichment_tasks.append(reference_tags_task)
+
+    def _cancel_enrichment() -> None:
+        # 缓存命中、推测调用先完成或出错时，仍在跑的富化任务结果已用不上，不留无人等待的任务
+        for task in enrichment_tasks:
+            if not task.done():
+                task.cancel()
+
+    try:
+        await asyncio.wait(enrichment_tasks, timeout=speculative_budget or None)
+    except BaseException:
+        _cancel_enrichment()
+        raise
+    metrics.observe("prompt.enrichment.wait", time.monotonic() - enrichment_started)
+    speculative = not all(task.done() for task in enrichment_tasks)
+
+    def _render() -> str:
+        return _render_generator_prompt(
+            template=template,
+            user_request=user_request,
+            chat_messages=chat_messages,
+            persona=persona,
+            selfie_mode=selfie_mode,
+            custom_system_prompt=custom_system_prompt,
+            tag_candidates=_enrichment_value(candidates_task),
+            reference_tags="\n\n".join(
+                part for part in (_enrichment_value(reference_tags_task).strip(), reference_tags.strip()) if part
+            ),
+        )
+
+    full_prompt = _render()
+
+    max_attempts = llm_config.prompt_retry_attempts
+    retry_config = llm_config.retry
 
-    multi_payload = resolve_multi_character_payload(response_text, generated_prompt)
-    aspect = extract_aspect_from_structured_output(response_text) or _infer_aspect_from_text(
+    supports_streaming = getattr(llm, "supports_streaming", None)
+    streaming = (
+        llm_config.streaming_enabled
+        and callable(supports_streaming)
+        and bool(supports_streaming())
+    )
+
+    async def _attempts(prompt_text: str, label: str = "") -> _PromptAttemptOutcome:
+        return await _run_prompt_attempts(
+            llm=llm,
+            model=model,
+            full_prompt=prompt_text,
+            temperature=temperature,
+            chat_messages=chat_messages,
+            reference_image_base64=reference_image_base64,
+            max_attempts=max_attempts,
+            retry_config=retry_config,
+            label=label,
+            streaming=streaming,
+        )
+
+    try:
+        if speculative:
+            metrics.incr("prompt.speculative.fired")
+            race_enriched = llm_config.speculative_race_enriched
+            logger.info(
+                "[DanbooruPrompt] 富化阶段超出预算 %.2fs（tag 候选=%s, 参考图反推=%s），先用已有信息调用 LLM%s",
+                speculative_budget,
+                "done" if candidates_task.done() else "pending",
+                "-" if reference_tags_task is None else ("done" if reference_tags_task.done() else "pending"),
+                "，并与富化调用竞速" if race_enriched else "",
+            )
+            if race_enriched:
+                outcome = await _race_speculative(full_prompt, enrichment_tasks, _render, _attempts)
+            else:
+                _cancel_enrichment()
+                outcome = await _attempts(full_prompt, "[speculative]")
+        else:
+            outcome = await _attempts(full_prompt)
+    finally:
+        _cancel_enrichment()
+
+    if not outcome.ok:
+        return PromptGenerationResult(False, error=outcome.error)
+    full_prompt = outcome.full_prompt
+    response_text = outcome.response_text
+    generated_prompt = outcome.generated_prompt
+    parsed = outcome.parsed or parse_llm_output(response_text)
+
+    multi_payload = resolve_multi_character_payload(parsed, generated_prompt)
+    aspect = parsed.aspect or _infer_aspect_from_text(
         generated_prompt,
         user_request=user_request,
         selfie_mode=selfie_mode,
         has_characters=bool(multi_payload),
     )
-    selfie_appearance_policy = str(llm_config.get("selfie_appearance_policy", "auto") or "auto").strip().lower()
-    enforce_tag_order = _bool_config(config, "llm.enforce_tag_order", True)
     self_character_requested = user_requests_self_character(user_request)
-    if not self_character_requested:
-        generated_prompt = remove_self_character_tags(
-            generated_prompt,
-            remove_persona_appearance=not user_mentions_appearance(user_request),
-        )
-    elif "azuma_seren" not in generated_prompt.lower() and "character:azuma" not in generated_prompt.lower():
+    if self_character_requested and "azuma_seren" not in generated_prompt.lower() and "character:azuma" not in generated_prompt.lower():
         # LLM 未输出角色 tag，强制注入（与 Hermes nai-draw 标准一致）
         generated_prompt = "{{{azuma_seren}}}, silver-white twin tails, purple eyes, " + generated_prompt
-    if selfie_mode and not user_mentions_appearance(user_request):
-        if selfie_appearance_policy in {"auto", "never"}:
-            generated_prompt = remove_selfie_appearance_tags(generated_prompt)
-    if enforce_tag_order:
-        generated_prompt = normalize_prompt_order(generated_prompt)
-    if sfw_mode:
-        generated_prompt = sanitize_sfw_prompt(generated_prompt)
+    generated_prompt = postprocess_prompt(
+        generated_prompt,
+        **_postprocess_options(
+            user_request=user_request,
+            selfie_mode=selfie_mode,
+            self_character_requested=self_character_requested,
+            sfw_mode=sfw_mode,
+            enforce_tag_order=enforce_tag_order,
+            selfie_appearance_policy=selfie_appearance_policy,
+            sfw_matcher=sfw_matcher,
+            rules=postprocess_rules,
+        ),
+    )
     multi_payload = _postprocess_multi_character_payload(
         multi_payload,
         user_request=user_request,
@@ -431,6 +893,8 @@ async def generate_danbooru_prompt(
         sfw_mode=sfw_mode,
         enforce_tag_order=enforce_tag_order,
         selfie_appearance_policy=selfie_appearance_policy,
+        sfw_matcher=sfw_matcher,
+        rules=postprocess_rules,
     )
 
     logger.info(
@@ -441,7 +905,7 @@ async def generate_danbooru_prompt(
         f"aspect={aspect or '-'} {generated_prompt[:500]}",
     )
 
-    return PromptGenerationResult(
+    generation_result = PromptGenerationResult(
         success=True,
         prompt=generated_prompt,
         style="anime",
@@ -449,3 +913,6 @@ async def generate_danbooru_prompt(
         characters=multi_payload.get("characters") if multi_payload else None,
         aspect=aspect,
     )
+    if use_cache:
+        _prompt_cache_set(cache_key, generation_result, cache_max_entries)
+    return generation_result
@@ -0,0 +1,237 @@
+"""
+出图端点负载均衡。
+
+同一风格可以配置多个 NewAPI 端点（多个 key / 镜像，各带权重），每次出图按策略挑一个：
+- least_outstanding：(进行中请求数 + 1) / 权重 最小者，EWMA 延迟作平手裁决
+- ewma：EWMA 延迟 × (进行中请求数 + 1) / 权重 最小者（尚无样本的端点视为 0，先被探测）
+
+连续失败达到阈值的端点被摘除，冷却期过后放行一个探测请求：成功即恢复，失败则重新冷却。
+全部端点都被摘除时不拒绝请求，而是选最早结束冷却的那个（宁可试一次也不直接报错）。
+
+端点状态按 (base_url, api_key) 进程内共享，插件卸载或配置更新时由 reset_endpoint_balancer() 清空。
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Iterable, Optional
+from urllib.parse import urlsplit
+
+from src.common.logger import get_logger
+
+from . import metrics
+
+logger = get_logger("MaiBot_LLM2pic")
+
+STRATEGY_LEAST_OUTSTANDING = "least_outstanding"
+STRATEGY_EWMA = "ewma"
+
+# EWMA 平滑系数：越大越跟随最近一次延迟
+_EWMA_ALPHA = 0.3
+
+
+@dataclass(frozen=True, slots=True)
+class EndpointSpec:
+    """一个可用端点：地址 + 密钥 + 权重。"""
+
+    base_url: str
+    api_key: str
+    weight: float = 1.0
+
+    @property
+    def key(self) -> tuple[str, str]:
+        return self.base_url, self.api_key
+
+    @property
+    def label(self) -> str:
+        """日志/指标用的名字：主机名 + 密钥末 4 位，不暴露完整密钥。"""
+        host = urlsplit(self.base_url).netloc or self.base_url
+        return f"{host}~{self.api_key[-4:]}" if self.api_key else host
+
+
+@dataclass(frozen=True, slots=True)
+class BalancePolicy:
+    strategy: str = STRATEGY_LEAST_OUTSTANDING
+    eject_after_failures: int = 3
+    eject_cooldown_seconds: float = 60.0
+
+
+def parse_endpoints(model_config: Optional[dict[str, Any]]) -> tuple[EndpointSpec, ...]:
+    """从风格路由给出的 model_config 里取端点列表（主端点在前，镜像在后）。"""
+    mc = model_config or {}
+    raw = mc.get("endpoints")
+    if not isinstance(raw, (list, tuple)) or not raw:
+        raw = [{"base_url": mc.get("base_url", ""), "api_key": mc.get("api_key", ""), "weight": 1.0}]
+    specs: list[EndpointSpec] = []
+    seen: set[tuple[str, str]] = set()
+    for item in raw:
+        if isinstance(item, EndpointSpec):
+            spec = item
+        elif isinstance(item, dict):
+            try:
+                weight = float(item.get("weight", 1.0) or 0.0)
+            except (TypeError, ValueError):
+                weight = 1.0
+            spec = EndpointSpec(
+                base_url=str(item.get("base_url", "") or "").strip().rstrip("/"),
+                api_key=str(item.get("api_key", "") or "").strip(),
+                weight=weight,
+            )
+        else:
+            continue
+        if not spec.base_url or not spec.api_key or spec.weight <= 0 or spec.key in seen:
+            continue
+        seen.add(spec.key)
+        specs.append(spec)
+    return tuple(specs)
+
+
+def parse_balance_policy(model_config: Optional[dict[str, Any]]) -> BalancePolicy:
+    mc = model_config or {}
+    strategy = str(mc.get("balance_strategy", STRATEGY_LEAST_OUTSTANDING) or "").strip().lower()
+    if strategy not in (STRATEGY_LEAST_OUTSTANDING, STRATEGY_EWMA):
+        strategy = STRATEGY_LEAST_OUTSTANDING
+    return BalancePolicy(
+        strategy=strategy,
+        eject_after_failures=max(1, int(mc.get("eject_after_failures", 3) or 3)),
+        eject_cooldown_seconds=max(1.0, float(mc.get("eject_cooldown_seconds", 60) or 60)),
+    )
+
+
+class _EndpointState:
+    __slots__ = ("outstanding", "ewma", "consecutive_failures", "ejected_until", "probing")
+
+    def __init__(self) -> None:
+        self.outstanding = 0
+        self.ewma = 0.0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.probing = False
+
+
+class EndpointLease:
+    """一次端点占用。请求结束后必须调用 release()，重复调用无副作用。"""
+
+    __slots__ = ("spec", "_balancer", "_policy", "_started", "_released")
+
+    def __init__(self, balancer: "EndpointBalancer", spec: EndpointSpec, policy: BalancePolicy) -> None:
+        self.spec = spec
+        self._balancer = balancer
+        self._policy = policy
+        self._started = time.monotonic()
+        self._released = False
+
+    def release(self, success: bool) -> None:
+        if self._released:
+            return
+        self._released = True
+        self._balancer._finish(self.spec, self._policy, success, time.monotonic() - self._started)
+
+
+class EndpointBalancer:
+    """进程内共享的端点健康与负载状态。"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._states: dict[tuple[str, str], _EndpointState] = {}
+
+    def acquire(self, endpoints: Iterable[EndpointSpec], policy: BalancePolicy) -> Optional[EndpointLease]:
+        """按策略选一个端点并登记为进行中；没有可用端点时返回 None。"""
+        specs = tuple(endpoints)
+        if not specs:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            chosen = self._choose(specs, policy, now)
+            state = self._state(chosen)
+            if state.ejected_until and now >= state.ejected_until:
+                state.probing = True
+            state.outstanding += 1
+        if len(specs) > 1:
+            metrics.incr(f"image.endpoint.{chosen.label}.requests")
+        return EndpointLease(self, chosen, policy)
+
+    def _state(self, spec: EndpointSpec) -> _EndpointState:
+        state = self._states.get(spec.key)
+        if state is None:
+            state = self._states[spec.key] = _EndpointState()
+        return state
+
+    def _choose(self, specs: tuple[EndpointSpec, ...], policy: BalancePolicy, now: float) -> EndpointSpec:
+        admitted: list[EndpointSpec] = []
+        for spec in specs:
+            state = self._state(spec)
+            if not state.ejected_until:
+                admitted.append(spec)
+            elif now >= state.ejected_until and not state.probing:
+                admitted.append(spec)  # 冷却结束，放行一个探测请求
+        if not admitted:
+            return min(specs, key=lambda spec: self._states[spec.key].ejected_until)
+        if len(admitted) == 1:
+            return admitted[0]
+
+        def score(spec: EndpointSpec) -> tuple[float, float]:
+            state = self._states[spec.key]
+            load = (state.outstanding + 1) / spec.weight
+            if policy.strategy == STRATEGY_EWMA:
+                return state.ewma * load, load
+            return load, state.ewma
+
+        return min(admitted, key=score)
+
+    def _finish(self, spec: EndpointSpec, policy: BalancePolicy, success: bool, elapsed: float) -> None:
+        label = spec.label
+        ejected = False
+        with self._lock:
+            state = self._state(spec)
+            state.outstanding = max(0, state.outstanding - 1)
+            state.ewma = elapsed if state.ewma <= 0 else state.ewma + _EWMA_ALPHA * (elapsed - state.ewma)
+            was_probing = state.probing
+            state.probing = False
+            if success:
+                state.consecutive_failures = 0
+                state.ejected_until = 0.0
+            else:
+                state.consecutive_failures += 1
+                if was_probing or state.consecutive_failures >= policy.eject_after_failures:
+                    ejected = not state.ejected_until or was_probing
+                    state.ejected_until = time.monotonic() + policy.eject_cooldown_seconds
+        metrics.observe(f"image.endpoint.{label}.latency", elapsed)
+        if not success:
+            metrics.incr(f"image.endpoint.{label}.errors")
+        if ejected:
+            metrics.incr(f"image.endpoint.{label}.ejected")
+            logger.warning(f"[EndpointBalancer] 端点 {label} 连续失败，摘除 {policy.eject_cooldown_seconds:.0f}s")
+        elif success and was_probing:
+            logger.info(f"[EndpointBalancer] 端点 {label} 探测成功，恢复")
+
+    def snapshot(self) -> dict[str, dict[str, Any]]:
+        """各端点当前状态（调试/日志用）。"""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                EndpointSpec(base_url, api_key).label: {
+                    "outstanding": state.outstanding,
+                    "ewma_seconds": round(state.ewma, 3),
+                    "consecutive_failures": state.consecutive_failures,
+                    "ejected_for": round(max(0.0, state.ejected_until - now), 1),
+                }
+                for (base_url, api_key), state in self._states.items()
+            }
+
+
+_balancer: Optional[EndpointBalancer] = None
+
+
+def get_endpoint_balancer() -> EndpointBalancer:
+    global _balancer
+    if _balancer is None:
+        _balancer = EndpointBalancer()
+    return _balancer
+
+
+def reset_endpoint_balancer() -> None:
+    global _balancer
+    _balancer = None
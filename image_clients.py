@@ -16,13 +16,21 @@ import zipfile
 
 from src.common.logger import get_logger
 
+from . import metrics
 from .github_uploader import upload_image_to_github
+from .image_probe import probe_image
+from .image_processing import get_image_processor
+from .rate_limiter import get_rate_limiter, parse_retry_after
+from .runtime_config import GenerationRuntimeConfig, get_runtime_config
 from .utils import (
     _compress_image_if_needed,
+    _deadline_passed,
+    _encode_image_for_send,
     _looks_like_image_bytes,
     _looks_like_image_url,
     _normalize_url_for_request,
     _probe_url_is_image,
+    _timeout_until,
     download_image_to_base64,
     get_image_mime_type,
 )
@@ -63,6 +71,10 @@ class ImageClientMixin:
     def get_config(self, path: str, default: object = None) -> object:
         return default
 
+    def _generation_settings(self) -> GenerationRuntimeConfig:
+        """[generation] 段的配置快照；代理对象携带 plugin_config 时按该配置取。"""
+        return get_runtime_config(getattr(self, "plugin_config", None)).generation
+
     async def send_text(self, text: str) -> bool:
         del text
         return False
@@ -137,7 +149,7 @@ class ImageClientMixin:
         if model_config and model_config.get("custom_prompt_add"):
             custom_prompt_add = str(model_config.get("custom_prompt_add") or "")
         else:
-            custom_prompt_add = str(self.get_config("generation.custom_prompt_add", "") or "")
+            custom_prompt_add = self._generation_settings().custom_prompt_add
 
         parts = [part.strip().strip(",") for part in (custom_prompt_add, generated_prompt) if part and part.strip()]
         merged = self._remove_duplicate_keywords(", ".join(parts))
@@ -166,18 +178,11 @@ class ImageClientMixin:
     async def _handle_image_result(self, result: str, *, prompt: str = "") -> Tuple[bool, str]:
         """发送 base64 图片或下载 URL 后发送，并上传原始 PNG 到 GitHub（保留 tag 元数据）。"""
         if result.startswith(("iVBORw", "/9j/", "UklGR", "R0lGOD")):
-            crop_enabled = bool(self.get_config("generation.crop_enabled", False))
-            if crop_enabled:
-                try:
-                    image_bytes = base64.b64decode(result)
-                    image_bytes = self._crop_image(image_bytes)
-                    result = base64.b64encode(image_bytes).decode("utf-8")
-                except Exception as exc:
-                    logger.error(f"{self.log_prefix} Base64 图片裁切失败: {exc}")
+            result = await self._crop_image_base64(result)
 
-            # 上传原始图片到 GitHub（保留 PNG tag 元数据），不压缩直接发送
+            # 上传原始图片到 GitHub（保留 PNG tag 元数据），发送的是按配置转码后的版本
             self._schedule_github_upload(result, prompt=prompt)
-            if await self.send_image(result):
+            if await self.send_image(await self._encode_for_send(result)):
                 logger.info(f"{self.log_prefix} 图片已发送")
                 return True, "图片已发送"
             logger.error(f"{self.log_prefix} 图片生成成功但发送失败")
@@ -195,14 +200,45 @@ class ImageClientMixin:
         if not encode_success:
             logger.error(f"{self.log_prefix} 下载图片失败: {encode_result}")
             return False, f"图片下载失败: {encode_result}"
-        # 上传原始图片到 GitHub，不压缩直接发送
+        encode_result = await self._crop_image_base64(encode_result)
+        # 上传原始图片到 GitHub，发送的是按配置转码后的版本
         self._schedule_github_upload(encode_result, prompt=prompt)
-        if await self.send_image(encode_result):
+        if await self.send_image(await self._encode_for_send(encode_result)):
             logger.info(f"{self.log_prefix} 图片已发送")
             return True, "图片已发送"
         logger.error(f"{self.log_prefix} 图片下载成功但发送失败")
         return False, "图片发送失败"
 
+    async def _encode_for_send(self, image_base64: str) -> str:
+        """按 [generation].output_format 把待发送图片转成 JPEG/WebP（在图片进程池中执行），失败时发原图。"""
+        settings = self._generation_settings()
+        if settings.output_format not in ("jpeg", "webp"):
+            return image_base64
+        started = time.monotonic()
+        try:
+            encoded, quality = await get_image_processor().run(
+                _encode_image_for_send,
+                image_base64,
+                settings.output_format,
+                settings.output_target_kb * 1024,
+                settings.output_quality,
+                op="encode",
+            )
+        except Exception as exc:
+            logger.warning(f"{self.log_prefix} 发送前转码失败，发送原图: {exc!r}")
+            return image_base64
+        elapsed_ms = (time.monotonic() - started) * 1000
+        if not quality:
+            logger.info(f"{self.log_prefix} 发送前转码跳过（原图已足够小），{elapsed_ms:.0f}ms")
+            return image_base64
+        before, after = len(image_base64) * 3 // 4, len(encoded) * 3 // 4
+        metrics.incr("image.encode.bytes_saved", before - after)
+        logger.info(
+            f"{self.log_prefix} 发送前转码 {settings.output_format.upper()} q={quality}: "
+            f"{before // 1024}KB -> {after // 1024}KB (-{(before - after) * 100 // max(before, 1)}%), {elapsed_ms:.0f}ms"
+        )
+        return encoded
+
     def _download_and_encode_base64(self, image_url: str) -> Tuple[bool, str]:
         try:
             req = urllib.request.Request(image_url, headers={"User-Agent": "Mozilla/5.0"})
@@ -217,57 +253,31 @@ class ImageClientMixin:
 
             if not image_bytes:
                 return False, "下载的图片数据为空"
-            if bool(self.get_config("generation.crop_enabled", False)):
-                image_bytes = self._crop_image(image_bytes)
             return True, base64.b64encode(image_bytes).decode("utf-8")
         except Exception as exc:
             logger.error(f"{self.log_prefix} 下载图片错误: {exc!r}", exc_info=True)
             return False, str(exc)
 
-    def _crop_image(self, image_bytes: bytes) -> bytes:
+    async def _crop_image_base64(self, image_base64: str) -> str:
+        """按配置裁切图片边缘（在图片进程池中执行），失败时返回原图。"""
+        settings = self._generation_settings()
+        if not settings.crop_enabled:
+            return image_base64
         try:
-            from PIL import Image
-
-            crop_position = str(self.get_config("generation.crop_position", "bottom") or "bottom")
-            crop_pixels = int(self.get_config("generation.crop_pixels", 40) or 40)
-
-            img = Image.open(BytesIO(image_bytes))
-            width, height = img.size
-            if crop_position == "bottom":
-                if crop_pixels >= height:
-                    return image_bytes
-                crop_box = (0, 0, width, height - crop_pixels)
-            elif crop_position == "top":
-                if crop_pixels >= height:
-                    return image_bytes
-                crop_box = (0, crop_pixels, width, height)
-            elif crop_position == "left":
-                if crop_pixels >= width:
-                    return image_bytes
-                crop_box = (crop_pixels, 0, width, height)
-            elif crop_position == "right":
-                if crop_pixels >= width:
-                    return image_bytes
-                crop_box = (0, 0, width - crop_pixels, height)
-            else:
-                return image_bytes
-
-            cropped_img = img.crop(crop_box)
-            output = BytesIO()
-            cropped_img.save(output, format=img.format or "PNG")
-            logger.info(f"{self.log_prefix} 已裁切图片{crop_position} {crop_pixels} 像素")
-            return output.getvalue()
-        except ImportError:
-            return image_bytes
+            cropped = await get_image_processor().crop(image_base64, settings.crop_position, settings.crop_pixels)
         except Exception as exc:
             logger.error(f"{self.log_prefix} 图片裁切失败: {exc}", exc_info=True)
-            return image_bytes
+            return image_base64
+        if cropped != image_base64:
+            logger.info(f"{self.log_prefix} 已裁切图片{settings.crop_position} {settings.crop_pixels} 像素")
+        return cropped
 
     def _make_gradio_image_request(
         self,
         prompt: str,
         base_url: Optional[str] = None,
         gradio_params: Optional[dict] = None,
+        deadline: Optional[float] = None,
     ) -> Tuple[bool, str]:
         if base_url is None:
             base_url = str(self.get_config("api.base_url", "") or "")
@@ -291,7 +301,7 @@ class ImageClientMixin:
         req = urllib.request.Request(endpoint, data=data, headers=headers, method="POST")
 
         try:
-            with urllib.request.urlopen(req, timeout=30) as response:
+            with urllib.request.urlopen(req, timeout=_timeout_until(deadline, 30)) as response:
                 response_body = response.read().decode("utf-8")
                 if not 200 <= response.status < 300:
                     return False, f"POST 请求失败 (状态码 {response.status})"
@@ -302,10 +312,10 @@ class ImageClientMixin:
 
             result_endpoint = f"{base_url.rstrip('/')}/gradio_api/call/generate/{event_id}"
             start_time = time.time()
-            while time.time() - start_time < int(timeout):
+            while time.time() - start_time < int(timeout) and not _deadline_passed(deadline):
                 try:
                     result_req = urllib.request.Request(result_endpoint, method="GET")
-                    with urllib.request.urlopen(result_req, timeout=30) as result_response:
+                    with urllib.request.urlopen(result_req, timeout=_timeout_until(deadline, 30)) as result_response:
                         result_body = result_response.read().decode("utf-8")
                     for line in result_body.split("\n"):
                         if not line.startswith("data: "):
@@ -338,6 +348,7 @@ class ImageClientMixin:
         base_url: str,
         api_key: str,
         sd_params: Optional[dict] = None,
+        deadline: Optional[float] = None,
     ) -> Tuple[bool, str]:
         endpoint = f"{base_url.rstrip('/')}/api/v1/generate_image"
         payload: dict[str, object] = {"prompt": prompt}
@@ -362,7 +373,7 @@ class ImageClientMixin:
         req = urllib.request.Request(endpoint, data=data, headers=headers, method="POST")
 
         try:
-            with urllib.request.urlopen(req, timeout=180) as response:
+            with urllib.request.urlopen(req, timeout=_timeout_until(deadline, 180)) as response:
                 response_body = response.read().decode("utf-8")
                 if not 200 <= response.status < 300:
                     return False, f"SD API 请求失败 (状态码 {response.status})"
@@ -401,7 +412,9 @@ class ImageClientMixin:
             return candidate if isinstance(candidate, str) else None
         return data_obj if isinstance(data_obj, str) else None
 
-    def _make_regex_url_request(self, prompt: str, url_template: str) -> Tuple[bool, str]:
+    def _make_regex_url_request(
+        self, prompt: str, url_template: str, deadline: Optional[float] = None
+    ) -> Tuple[bool, str]:
         if not url_template or not url_template.strip():
             return False, "regex_url 未配置 URL 模板"
 
@@ -419,7 +432,7 @@ class ImageClientMixin:
         req = urllib.request.Request(endpoint, headers=headers, method="GET")
 
         try:
-            with urllib.request.urlopen(req, timeout=180) as response:
+            with urllib.request.urlopen(req, timeout=_timeout_until(deadline, 180)) as response:
                 content_type = (response.headers.get("Content-Type") or "").lower()
                 try:
                     response_body = response.read()
@@ -466,6 +479,7 @@ class ImageClientMixin:
         prompt: str,
         api_key: str,
         novelai_params: Optional[dict] = None,
+        deadline: Optional[float] = None,
     ) -> Tuple[bool, str]:
         params = novelai_params or {}
         endpoint = "https://image.novelai.net/ai/generate-image"
@@ -506,7 +520,9 @@ class ImageClientMixin:
         req = urllib.request.Request(endpoint, data=data, headers=headers, method="POST")
 
         try:
-            with urllib.request.urlopen(req, timeout=int(params.get("timeout", 120))) as response:
+            with urllib.request.urlopen(
+                req, timeout=_timeout_until(deadline, int(params.get("timeout", 120)))
+            ) as response:
                 response_data = response.read()
                 content_type = response.headers.get("Content-Type", "")
                 if not 200 <= response.status < 300:
@@ -690,7 +706,7 @@ class ImageClientMixin:
         lowered = str(model or "").lower()
         return any(keyword in lowered for keyword in _NEWAPI_NAI_MULTI_CHARACTER_MODEL_KEYWORDS)
 
-    def _newapi_nai_urlopen(self, req: urllib.request.Request, *, timeout: int, proxy_mode: str) -> object:
+    def _newapi_nai_urlopen(self, req: urllib.request.Request, *, timeout: float, proxy_mode: str) -> object:
         if proxy_mode == "inherit":
             return urllib.request.urlopen(req, timeout=timeout)
         if proxy_mode == "direct":
@@ -726,10 +742,11 @@ class ImageClientMixin:
 
         image_base64 = cls._extract_data_uri_image(content)
         if image_base64:
-            try:
-                base64.b64decode(image_base64, validate=False)
-            except Exception:
-                return False, "NewAPI 返回的 base64 数据无法解码"
+            probe = probe_image(image_base64)
+            if probe is None:
+                return False, "NewAPI 返回的 base64 数据不是可识别的图片"
+            if probe.truncated:
+                return False, f"NewAPI 返回的图片数据不完整（{probe.format}, {probe.size} bytes）"
             return True, image_base64
 
         text_error = ""
@@ -747,8 +764,9 @@ class ImageClientMixin:
         model: str,
         params: Optional[dict] = None,
         characters: Optional[list[dict[str, Any]]] = None,
+        deadline: Optional[float] = None,
     ) -> Tuple[bool, str]:
-        """调用 NewAPI chat/completions 形式的 NAI 绘图渠道。"""
+        """调用 NewAPI chat/completions 形式的 NAI 绘图渠道；deadline 为 time.monotonic() 截止时间点。"""
         options = params or {}
         draw_payload: dict[str, object] = {
             "model": model,
@@ -812,15 +830,30 @@ class ImageClientMixin:
         timeout = int(options.get("timeout", 180) or 180)
         retry_attempts = max(1, min(int(options.get("retry_attempts", 3) or 3), 5))
         proxy_mode = self._normalize_newapi_nai_proxy_mode(options.get("proxy_mode", "auto"))
+        # 首次请求的令牌由异步调用方获取（generation_service），这里只管重试前的排队与 429 反馈
+        limiter = get_rate_limiter(
+            base_url,
+            api_key,
+            float(options.get("rate_limit_per_minute", 0) or 0),
+            int(options.get("rate_limit_burst", 2) or 2),
+        )
 
         for attempt in range(1, retry_attempts + 1):
+            if attempt > 1:
+                if _deadline_passed(deadline):
+                    return False, "NewAPI 请求超过时间预算"
+                if limiter.wait_blocking(deadline) is None:
+                    return False, "NewAPI 限流排队超过时间预算"
             try:
-                with self._newapi_nai_urlopen(req, timeout=timeout, proxy_mode=proxy_mode) as response:
+                with self._newapi_nai_urlopen(
+                    req, timeout=_timeout_until(deadline, timeout), proxy_mode=proxy_mode
+                ) as response:
                     response_body = response.read().decode("utf-8")
                     if not 200 <= response.status < 300:
                         return False, f"NewAPI 请求失败 (状态码 {response.status})"
                     response_data = json.loads(response_body)
 
+                limiter.on_success()
                 return self._parse_newapi_nai_response(response_data)
             except urllib.error.HTTPError as exc:
                 error_body = ""
@@ -828,10 +861,16 @@ class ImageClientMixin:
                     error_body = exc.read().decode("utf-8")[:300]
                 except Exception:
                     pass
-                if exc.code in _NEWAPI_NAI_RETRYABLE_STATUS_CODES and attempt < retry_attempts:
-                    sleep_seconds = 6.0 if exc.code == 429 else 1.5 * attempt
+                if exc.code == 429:
+                    retry_after = parse_retry_after(exc.headers.get("Retry-After") if exc.headers else None)
+                    wait_seconds = limiter.on_throttled(retry_after)
+                    if attempt < retry_attempts:
+                        logger.warning(f"{self.log_prefix} NewAPI HTTP 429，限流排队约 {wait_seconds:.1f}s 后重试")
+                        continue
+                elif exc.code in _NEWAPI_NAI_RETRYABLE_STATUS_CODES and attempt < retry_attempts:
+                    sleep_seconds = 1.5 * attempt
                     logger.warning(f"{self.log_prefix} NewAPI HTTP {exc.code}，{sleep_seconds:.1f}s 后重试")
-                    time.sleep(sleep_seconds)
+                    time.sleep(_timeout_until(deadline, sleep_seconds))
                     continue
                 logger.error(f"{self.log_prefix} NewAPI HTTP 错误: {exc.code} - {error_body}")
                 return False, f"NewAPI HTTP 错误 {exc.code}: {error_body}"
@@ -839,7 +878,7 @@ class ImageClientMixin:
                 if self._is_newapi_nai_retryable_error(exc) and attempt < retry_attempts:
                     sleep_seconds = 1.5 * attempt
                     logger.warning(f"{self.log_prefix} NewAPI 网络错误，{sleep_seconds:.1f}s 后重试: {exc}")
-                    time.sleep(sleep_seconds)
+                    time.sleep(_timeout_until(deadline, sleep_seconds))
                     continue
                 logger.error(f"{self.log_prefix} NewAPI 连接错误: {exc}")
                 return False, f"NewAPI 连接错误: {getattr(exc, 'reason', exc)}"
@@ -859,6 +898,7 @@ class ImageClientMixin:
         base_url: Optional[str] = None,
         api_key: Optional[str] = None,
         input_image_base64: Optional[str] = None,
+        deadline: Optional[float] = None,
     ) -> Tuple[bool, str]:
         del size
         if base_url is None:
@@ -889,7 +929,7 @@ class ImageClientMixin:
         req = urllib.request.Request(endpoint, data=data, headers=headers, method="POST")
 
         try:
-            with urllib.request.urlopen(req, timeout=180) as response:
+            with urllib.request.urlopen(req, timeout=_timeout_until(deadline, 180)) as response:
                 response_body = response.read().decode("utf-8")
                 if not 200 <= response.status < 300:
                     return False, f"API 请求失败 (状态码 {response.status})"
@@ -0,0 +1,178 @@
+"""
+只读文件头的图片探测。
+
+校验“是不是图片、多大、有没有被截断”不需要解码整张图：PNG/GIF/WebP 的尺寸在前几十字节，
+JPEG 的 SOF 段通常在前几 KB（跳过 EXIF 等 APPn 段时按段长直接跳读），截断与否看文件尾标记。
+base64 输入按需只解码用到的那几段（base64 每 4 个字符对应 3 个字节，可随机访问），
+一张 2MB 的出图校验只需几微秒，完整解码留给真正需要像素的变换。
+"""
+
+from __future__ import annotations
+
+import binascii
+import struct
+from dataclasses import dataclass
+from typing import Optional, Union
+
+FORMAT_PNG = "png"
+FORMAT_JPEG = "jpeg"
+FORMAT_WEBP = "webp"
+FORMAT_GIF = "gif"
+
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+_PNG_IEND = b"\x00\x00\x00\x00IEND\xaeB`\x82"
+# 不带尺寸信息的 SOFn 以外的标记：DHT、JPG、DAC
+_JPEG_NON_SOF = (0xC4, 0xC8, 0xCC)
+# JPEG 头部最多跳读的段数（防止畸形数据死循环）
+_JPEG_MAX_SEGMENTS = 64
+
+
+@dataclass(frozen=True, slots=True)
+class ImageProbe:
+    format: str
+    width: int
+    height: int
+    size: int  # 字节数
+    truncated: bool  # 缺少文件尾标记（PNG IEND / JPEG EOI / GIF trailer）或短于 RIFF 声明长度
+
+    @property
+    def min_side(self) -> int:
+        return min(self.width, self.height)
+
+    @property
+    def valid(self) -> bool:
+        return self.width > 0 and self.height > 0 and not self.truncated
+
+
+class _BytesSource:
+    __slots__ = ("data", "size")
+
+    def __init__(self, data: bytes) -> None:
+        self.data = data
+        self.size = len(data)
+
+    def read(self, offset: int, length: int) -> bytes:
+        return self.data[offset : offset + length]
+
+
+class _Base64Source:
+    """按字节偏移随机读取 base64 字符串，只解码覆盖所需区间的那几组字符。
+
+    start 为 base64 正文在 text 中的起点（跳过 data URI 前缀时不复制整个字符串）。
+    """
+
+    __slots__ = ("text", "start", "size")
+
+    def __init__(self, text: str, start: int = 0) -> None:
+        self.text = text
+        self.start = start
+        padding = 2 if text.endswith("==") else 1 if text.endswith("=") else 0
+        self.size = (len(text) - start) // 4 * 3 - padding
+
+    def read(self, offset: int, length: int) -> bytes:
+        if offset < 0 or length <= 0 or offset >= self.size:
+            return b""
+        start_group = offset // 3
+        end_group = (min(offset + length, self.size) + 2) // 3
+        chunk = binascii.a2b_base64(self.text[self.start + start_group * 4 : self.start + end_group * 4])
+        skip = offset - start_group * 3
+        return chunk[skip : skip + length]
+
+
+def probe_image(data: Union[bytes, str]) -> Optional[ImageProbe]:
+    """探测图片格式、尺寸与是否截断。data 为原始字节或 base64 字符串（可带 data URI 前缀）。
+
+    无法识别（非 PNG/JPEG/WebP/GIF、头部损坏、base64 非法）时返回 None。
+    """
+    try:
+        return _probe(_source(data))
+    except (binascii.Error, struct.error, ValueError):
+        return None
+
+
+def _source(data: Union[bytes, str]) -> Union[_BytesSource, _Base64Source]:
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return _BytesSource(bytes(data))
+    text = data
+    if text[:1].isspace() or text[-1:].isspace():
+        text = text.strip()
+    start = text.find(",", 0, 256) + 1 if text.startswith("data:") else 0
+    if (len(text) - start) % 4 or any(ch.isspace() for ch in text[start : start + 64]):
+        # 带换行或长度不规整的 base64 不能按 4 字符分组随机访问，退回整段解码
+        return _BytesSource(binascii.a2b_base64(text[start:]))
+    return _Base64Source(text, start)
+
+
+def _probe(source: Union[_BytesSource, _Base64Source]) -> Optional[ImageProbe]:
+    head = source.read(0, 32)
+    if head.startswith(_PNG_SIGNATURE):
+        return _probe_png(source, head)
+    if head.startswith(b"\xff\xd8\xff"):
+        return _probe_jpeg(source)
+    if head.startswith(b"RIFF") and head[8:12] == b"WEBP":
+        return _probe_webp(source, head)
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return _probe_gif(source, head)
+    return None
+
+
+def _probe_png(source: Union[_BytesSource, _Base64Source], head: bytes) -> Optional[ImageProbe]:
+    if head[12:16] != b"IHDR":
+        return None
+    width, height = struct.unpack(">II", head[16:24])
+    truncated = source.read(source.size - len(_PNG_IEND), len(_PNG_IEND)) != _PNG_IEND
+    return ImageProbe(FORMAT_PNG, width, height, source.size, truncated)
+
+
+def _probe_gif(source: Union[_BytesSource, _Base64Source], head: bytes) -> Optional[ImageProbe]:
+    width, height = struct.unpack("<HH", head[6:10])
+    truncated = source.read(source.size - 1, 1) != b"\x3b"
+    return ImageProbe(FORMAT_GIF, width, height, source.size, truncated)
+
+
+def _probe_webp(source: Union[_BytesSource, _Base64Source], head: bytes) -> Optional[ImageProbe]:
+    riff_size = struct.unpack("<I", head[4:8])[0]
+    chunk = head[12:16]
+    if chunk == b"VP8 ":
+        body = source.read(26, 4)
+        width, height = struct.unpack("<HH", body)
+        width, height = width & 0x3FFF, height & 0x3FFF
+    elif chunk == b"VP8L":
+        b0, b1, b2, b3 = source.read(21, 4)
+        width = 1 + (((b1 & 0x3F) << 8) | b0)
+        height = 1 + (((b3 & 0x0F) << 10) | (b2 << 2) | ((b1 & 0xC0) >> 6))
+    elif chunk == b"VP8X":
+        body = source.read(24, 6)
+        width = 1 + int.from_bytes(body[0:3], "little")
+        height = 1 + int.from_bytes(body[3:6], "little")
+    else:
+        return None
+    return ImageProbe(FORMAT_WEBP, width, height, source.size, source.size < riff_size + 8)
+
+
+def _probe_jpeg(source: Union[_BytesSource, _Base64Source]) -> Optional[ImageProbe]:
+    offset = 2
+    for _ in range(_JPEG_MAX_SEGMENTS):
+        header = source.read(offset, 9)
+        if len(header) < 4 or header[0] != 0xFF:
+            return None
+        marker = header[1]
+        if marker == 0xFF:  # 填充字节
+            offset += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:  # 无长度的独立标记
+            offset += 2
+            continue
+        if marker in (0xD9, 0xDA):  # EOI / SOS 之前还没遇到 SOF
+            return None
+        if 0xC0 <= marker <= 0xCF and marker not in _JPEG_NON_SOF:
+            if len(header) < 9:
+                return None
+            height, width = struct.unpack(">HH", header[5:9])
+            tail = source.read(max(0, source.size - 32), 32).rstrip(b"\x00")
+            return ImageProbe(FORMAT_JPEG, width, height, source.size, not tail.endswith(b"\xff\xd9"))
+        segment_length = struct.unpack(">H", header[2:4])[0]
+        if segment_length < 2:
+            return None
+        offset += 2 + segment_length
+    return None
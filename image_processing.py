@@ -0,0 +1,169 @@
+"""
+图片处理执行器。
+
+Pillow 的解码、缩放、编码都是 CPU 密集型操作，在事件循环里直接做会卡住所有会话
+（一张 4K 附图的 LANCZOS 缩放 + 重编码就要上百毫秒）。这里统一把它们提交到执行器：
+- 默认用线程池：Pillow 的解码/缩放/编码大多释放 GIL，足以让事件循环不被阻塞
+- [generation].image_process_pool = "process" 时改用 forkserver 进程池；宿主进程是多线程的，
+  不用 fork（子进程会继承别的线程持有的日志/指标/sqlite 锁而死锁）。forkserver 要求任务函数
+  能在子进程里按模块名导入，插件包不可导入时子进程起不来，进程池随之损坏
+- 进程池不可用、崩溃、函数无法序列化或单个任务超时时，永久退回线程池；超时的任务结束子进程后在线程里重做
+- 提交前用信号量限制同时在途的任务数，避免一批大图把内存堆满
+- 每种操作记录耗时 image.process.<op>，退回线程池记 image.process.fallback，超时记 image.process.timeout
+
+worker 数由 [generation].image_process_workers 决定，0 表示始终用单线程处理。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import multiprocessing
+import pickle
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Optional, TypeVar
+
+from src.common.logger import get_logger
+
+from . import metrics
+from .utils import _crop_image_base64
+
+logger = get_logger("MaiBot_LLM2pic")
+
+T = TypeVar("T")
+
+DEFAULT_WORKERS = 2
+DEFAULT_TIMEOUT_SECONDS = 30.0
+POOL_THREAD = "thread"
+POOL_PROCESS = "process"
+
+
+def _normalize_settings(workers: int, pool: str, timeout_seconds: float) -> tuple[int, str, float]:
+    return max(0, int(workers)), POOL_PROCESS if pool == POOL_PROCESS else POOL_THREAD, max(0.0, float(timeout_seconds))
+
+
+class ImageProcessor:
+    """进程内共享的图片处理执行器。"""
+
+    def __init__(
+        self,
+        workers: int = DEFAULT_WORKERS,
+        pool: str = POOL_THREAD,
+        timeout_seconds: float = DEFAULT_TIMEOUT_SECONDS,
+    ) -> None:
+        self.workers, self.pool, self.timeout_seconds = _normalize_settings(workers, pool, timeout_seconds)
+        self._lock = threading.Lock()
+        self._executor: Optional[Executor] = None
+        self._use_processes = (
+            self.pool == POOL_PROCESS
+            and self.workers > 0
+            and "forkserver" in multiprocessing.get_all_start_methods()
+        )
+        # 在途任务上限：每个 worker 留一个排队名额
+        self._semaphore = asyncio.Semaphore(max(1, self.workers) * 2)
+
+    @property
+    def uses_processes(self) -> bool:
+        return self._use_processes
+
+    def _get_executor(self) -> Executor:
+        with self._lock:
+            if self._executor is None:
+                if self._use_processes:
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context("forkserver"),
+                    )
+                else:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=max(1, self.workers), thread_name_prefix="llm2pic-image"
+                    )
+            return self._executor
+
+    def _fallback_to_threads(self, reason: BaseException) -> None:
+        with self._lock:
+            if not self._use_processes:
+                return
+            self._use_processes = False
+            broken, self._executor = self._executor, None
+        metrics.incr("image.process.fallback")
+        logger.warning(f"[ImageProcessor] 进程池不可用，改用线程池处理图片: {reason!r}")
+        if broken is not None:
+            # 卡住的子进程不会因 shutdown 退出，直接结束掉；同批在途任务会收到 BrokenProcessPool 并在线程里重做
+            processes = list((getattr(broken, "_processes", None) or {}).values())
+            broken.shutdown(wait=False, cancel_futures=True)
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+
+    async def run(self, fn: Callable[..., T], *args: Any, op: str = "") -> T:
+        """在执行器中运行 fn(*args)；fn 必须是模块级函数，进程池下参数与返回值必须可序列化。"""
+        name = op or fn.__name__.lstrip("_")
+        if self._use_processes:
+            try:
+                pickle.dumps(fn)
+            except (pickle.PicklingError, AttributeError, TypeError) as exc:
+                self._fallback_to_threads(exc)
+        loop = asyncio.get_running_loop()
+        async with self._semaphore:
+            started = time.monotonic()
+            executor = self._get_executor()
+            try:
+                future = loop.run_in_executor(executor, fn, *args)
+                if isinstance(executor, ProcessPoolExecutor) and self.timeout_seconds > 0:
+                    result = await asyncio.wait_for(future, timeout=self.timeout_seconds)
+                else:
+                    result = await future
+            except asyncio.TimeoutError as exc:
+                metrics.incr("image.process.timeout")
+                self._fallback_to_threads(exc)
+                result = await loop.run_in_executor(self._get_executor(), fn, *args)
+            except BrokenProcessPool as exc:
+                self._fallback_to_threads(exc)
+                result = await loop.run_in_executor(self._get_executor(), fn, *args)
+            metrics.observe(f"image.process.{name}", time.monotonic() - started)
+        return result
+
+    async def crop(self, image_base64: str, crop_position: str, crop_pixels: int) -> str:
+        return await self.run(_crop_image_base64, image_base64, crop_position, crop_pixels, op="crop")
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+_processor: Optional[ImageProcessor] = None
+
+
+def get_image_processor(
+    workers: Optional[int] = None,
+    pool: Optional[str] = None,
+    timeout_seconds: Optional[float] = None,
+) -> ImageProcessor:
+    """取共享的图片处理器；传入的设置与现有实例不同时重建，未传的沿用现有实例（或默认值）。"""
+    global _processor
+    current = _processor
+    if workers is None:
+        workers = current.workers if current else DEFAULT_WORKERS
+    if pool is None:
+        pool = current.pool if current else POOL_THREAD
+    if timeout_seconds is None:
+        timeout_seconds = current.timeout_seconds if current else DEFAULT_TIMEOUT_SECONDS
+    settings = _normalize_settings(workers, pool, timeout_seconds)
+    if current is not None and (current.workers, current.pool, current.timeout_seconds) == settings:
+        return current
+    if current is not None:
+        current.shutdown()
+    _processor = ImageProcessor(*settings)
+    return _processor
+
+
+def reset_image_processor() -> None:
+    global _processor
+    if _processor is not None:
+        _processor.shutdown()
+    _processor = None
@@ -0,0 +1,121 @@
+"""
+轻量运行时指标。
+
+进程内的计数器、瞬时值与延迟直方图，供各阶段打点（推测执行、缓存命中等），
+通过 snapshot() 导出，format_report() 渲染成文本供日志或基准脚本查看，不依赖外部监控组件。
+"""
+
+from __future__ import annotations
+
+import bisect
+import threading
+from typing import Any
+
+# 延迟直方图桶上界（秒），最后一个桶为 +Inf
+_LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 1.5, 2.0, 3.0, 5.0, 8.0, 13.0, 21.0, 34.0, 60.0)
+
+_lock = threading.Lock()
+_counters: dict[str, float] = {}
+_gauges: dict[str, float] = {}
+_histograms: dict[str, "_Histogram"] = {}
+
+
+class _Histogram:
+    """固定桶延迟直方图，分位数按桶上界近似。"""
+
+    __slots__ = ("buckets", "count", "total", "max")
+
+    def __init__(self) -> None:
+        self.buckets = [0] * (len(_LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.buckets[bisect.bisect_left(_LATENCY_BUCKETS, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.buckets):
+            seen += bucket_count
+            if seen >= rank:
+                return _LATENCY_BUCKETS[index] if index < len(_LATENCY_BUCKETS) else self.max
+        return self.max
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "count": self.count,
+            "avg": round(self.total / self.count, 4) if self.count else 0.0,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "max": round(self.max, 4),
+            "buckets": dict(zip([*map(str, _LATENCY_BUCKETS), "+Inf"], self.buckets)),
+        }
+
+
+def incr(name: str, value: float = 1.0) -> None:
+    """计数器累加。"""
+    with _lock:
+        _counters[name] = _counters.get(name, 0.0) + value
+
+
+def gauge(name: str, value: float) -> None:
+    """设置瞬时值（如当前限流速率），后写覆盖先写。"""
+    with _lock:
+        _gauges[name] = float(value)
+
+
+def observe(name: str, seconds: float) -> None:
+    """记录一次耗时（秒）。"""
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = _Histogram()
+        histogram.observe(max(0.0, float(seconds)))
+
+
+def snapshot() -> dict[str, Any]:
+    """导出当前全部计数器与直方图。"""
+    with _lock:
+        return {
+            "counters": dict(_counters),
+            "gauges": dict(_gauges),
+            "histograms": {name: histogram.to_dict() for name, histogram in _histograms.items()},
+        }
+
+
+def format_report(prefix: str = "") -> str:
+    """把当前指标渲染成简短文本（每项一行，按名称排序）；prefix 非空时只列该前缀下的指标。"""
+    data = snapshot()
+    lines: list[str] = []
+    counters = sorted((k, v) for k, v in data["counters"].items() if k.startswith(prefix))
+    if counters:
+        lines.append("[计数]")
+        lines.extend(f"{name} = {value:g}" for name, value in counters)
+    gauges = sorted((k, v) for k, v in data["gauges"].items() if k.startswith(prefix))
+    if gauges:
+        lines.append("[瞬时值]")
+        lines.extend(f"{name} = {value:.2f}" for name, value in gauges)
+    histograms = sorted((k, v) for k, v in data["histograms"].items() if k.startswith(prefix))
+    if histograms:
+        lines.append("[耗时 秒]")
+        lines.extend(
+            f"{name}: n={h['count']} avg={h['avg']:.3f} p50≤{h['p50']:g} p95≤{h['p95']:g} max={h['max']:.3f}"
+            for name, h in histograms
+        )
+    return "\n".join(lines)
+
+
+def reset_metrics() -> None:
+    """清空全部指标（插件卸载时调用）。"""
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _histograms.clear()
@@ -9,22 +9,28 @@ Draw pipeline 编排器。
 
 from __future__ import annotations
 
-import base64
-import io
+import asyncio
+import time
 from dataclasses import dataclass, field
 from typing import Any, Optional
 
 from src.common.logger import get_logger
 
-from .clients.base import GenerationContext, calc_max_tokens
+from . import metrics
+from .clients.base import GenerationContext, GenerationResult, calc_max_tokens
 from .clients.newapi_nai import NewApiNaiClient
-from .style_router import StyleRouter
+from .danbooru_generator import DEFAULT_USER_REQUEST
+from .endpoint_balancer import get_endpoint_balancer
+from .image_processing import get_image_processor
+from .renditions import get_rendition_engine, jpeg_rendition, nai_rendition
+from .runtime_config import RuntimeConfig, Wd14RuntimeConfig, get_runtime_config
+from .style_router import ImageApiParams, get_style_router
 from .generation_service import (
     generate_image,
     ImageGenerationRequest,
     _normalize_aspect,
 )
-from .utils import _normalize_bool, _resize_image_for_wd14
+from .utils import _normalize_bool
 from .vibe_cache import VibeCache
 
 logger = get_logger("MaiBot_LLM2pic")
@@ -34,6 +40,10 @@ _SIZE_MAP = {
     "landscape": (1216, 832),
     "square": (1024, 1024),
 }
+# 参考图母版的短边：不小于任何出图比例的最长边，任意比例精确缩放都不需要放大
+_NAI_MAX_EDGE = max(max(size) for size in _SIZE_MAP.values())
+# LLM 识图用的长边，与 WD14 的 max_image_size 配置无关
+_VISION_MAX_EDGE = 1024
 
 
 @dataclass
@@ -50,37 +60,13 @@ class DrawPipelineContext:
     ref_mode: str = ""  # "" | "i2i" | "char_ref" | "vibe"
     custom_system_prompt: str = ""
     config: dict = field(default_factory=dict)
+    runtime: Optional[RuntimeConfig] = None  # config 的快照，缺省时按 config 取
     stream_id: str = ""
     proxy: Any = None       # _ToolRuntimeProxy 或 _CommandRuntimeProxy
     plugin: Any = None      # LLM2PicPlugin 引用（用于 _ctx_extract_image_from_recent）
     session_message: Any = None
 
 
-def _resize_image_for_nai(image_base64: str, target_size: tuple[int, int]) -> str:
-    """将图片 resize 到 NAI 要求的精确尺寸，返回 data URI。
-
-    Returns:
-        data URI 字符串，或空字符串（图片太小/损坏时）。
-    """
-    try:
-        from PIL import Image
-        img = Image.open(io.BytesIO(base64.b64decode(image_base64)))
-    except Exception:
-        return ""
-
-    min_side = min(img.width, img.height)
-    if min_side < 256:
-        return ""
-
-    w, h = target_size
-    img = img.resize((w, h), Image.LANCZOS)
-
-    buf = io.BytesIO()
-    img.save(buf, format="PNG")
-    b64 = base64.b64encode(buf.getvalue()).decode("ascii")
-    return f"data:image/png;base64,{b64}"
-
-
 async def _extract_attachment(ctx: DrawPipelineContext) -> Optional[str]:
     """从当前消息或引用消息中提取附图 base64。"""
     try:
@@ -99,9 +85,62 @@ async def _extract_attachment(ctx: DrawPipelineContext) -> Optional[str]:
     return None
 
 
+async def _reverse_tag_reference(image_base64: str, wd14_config: Wd14RuntimeConfig) -> str:
+    """WD14 反推参考图，返回给 LLM 的 tag 文本；失败时返回空串。"""
+    started = time.monotonic()
+    try:
+        from .wd14_client import RemoteWd14Backend, reverse_tag_image, DEFAULT_ENDPOINT as WD14_DEFAULT
+        from .wd14_cache import get_wd14_cache
+
+        remote = RemoteWd14Backend(wd14_config.endpoint or WD14_DEFAULT, transport=wd14_config.transport)
+        backend = None
+        if wd14_config.backend == "local":
+            from .wd14_local import get_local_tagger
+
+            backend = get_local_tagger(
+                model_dir=wd14_config.local_model_dir,
+                threads=wd14_config.local_threads,
+                batch_size=wd14_config.local_batch_size,
+                character_threshold=wd14_config.local_character_threshold,
+            )
+
+        cache = get_wd14_cache(
+            memory_entries=wd14_config.cache_memory_entries,
+            ttl_seconds=wd14_config.cache_ttl_hours * 3600,
+            disk_enabled=wd14_config.cache_disk_enabled,
+            disk_max_bytes=wd14_config.cache_disk_max_mb * 1024 * 1024,
+            negative_ttl_seconds=wd14_config.negative_cache_ttl_seconds,
+        )
+        wd14_result = await reverse_tag_image(
+            image_base64,
+            endpoint=wd14_config.endpoint or WD14_DEFAULT,
+            threshold=wd14_config.threshold,
+            timeout=wd14_config.timeout,
+            cache=cache,
+            backend=backend or remote,
+            # 本地模型加载失败（如 model.onnx 损坏）时退回远程 endpoint
+            fallback=remote if backend is not None else None,
+        )
+        if wd14_result and wd14_result.success:
+            reference_tags = wd14_result.format_for_llm()
+            logger.info("[Pipeline] WD14 反推成功: %s...", reference_tags[:120])
+            return reference_tags
+    except asyncio.CancelledError:
+        raise
+    except Exception as exc:
+        logger.warning("[Pipeline] WD14 反推异常: %s", exc, exc_info=True)
+    finally:
+        metrics.observe("prompt.enrichment.wd14", time.monotonic() - started)
+    return ""
+
+
 async def run_draw_pipeline(ctx: DrawPipelineContext) -> bool:
     """Draw pipeline 主入口。返回 True 表示成功。"""
 
+    if ctx.runtime is None:
+        ctx.runtime = get_runtime_config(ctx.config)
+    runtime = ctx.runtime
+
     try:
         # ── 1. 附图检测 ──
         attachment_b64 = None
@@ -116,41 +155,49 @@ async def run_draw_pipeline(ctx: DrawPipelineContext) -> bool:
             attachment_b64 = await _extract_attachment(ctx)
 
         # ── 2. WD14 反推（有附图时都做）──
-        reference_tags = ""
+        # 开启推测执行时反推作为后台任务，与 prompt 生成的富化阶段并行
+        reference_tags_task: Optional[asyncio.Future] = None
         reference_image_for_llm = ""
+        # 附图只解码一次：WD14 / LLM 识图的 JPEG 在这里一起生成，参考图模式下顺带保留母版供第 6 步缩放
+        get_image_processor(  # 按配置准备图片处理执行器
+            runtime.generation.image_process_workers,
+            runtime.generation.image_process_pool,
+            runtime.generation.image_process_timeout_seconds,
+        )
+        renditions = get_rendition_engine().session(attachment_b64 or "", runtime.generation.rendition_cache_ttl_seconds)
+        master_min_edge = _NAI_MAX_EDGE if ctx.ref_mode else 0
         if attachment_b64:
-            wd14_config = ctx.config.get("wd14", {})
-            if _normalize_bool(wd14_config.get("enabled", True)):
+            wd14_config = runtime.wd14
+            if wd14_config.enabled:
                 try:
-                    max_size = int(wd14_config.get("max_image_size", 1024) or 1024)
-                    reference_image_for_llm = _resize_image_for_wd14(attachment_b64, max_size)
-                    from .wd14_client import reverse_tag_image, DEFAULT_ENDPOINT as WD14_DEFAULT
-                    endpoint = str(wd14_config.get("endpoint", WD14_DEFAULT) or WD14_DEFAULT)
-                    threshold = float(wd14_config.get("threshold", 0.35) or 0.35)
-                    timeout = float(wd14_config.get("timeout", 60.0) or 60.0)
-                    wd14_result = await reverse_tag_image(
-                        reference_image_for_llm,
-                        endpoint=endpoint,
-                        threshold=threshold,
-                        timeout=timeout,
+                    wd14_spec = jpeg_rendition(wd14_config.max_image_size, mode=wd14_config.resize_mode)
+                    vision_spec = jpeg_rendition(_VISION_MAX_EDGE, mode=wd14_config.resize_mode)
+                    rendered = await renditions.render((wd14_spec, vision_spec), master_min_edge=master_min_edge)
+                    reference_image_for_llm = rendered.get(vision_spec) or attachment_b64
+                    reference_tags_task = asyncio.ensure_future(
+                        _reverse_tag_reference(rendered.get(wd14_spec) or attachment_b64, wd14_config)
                     )
-                    if wd14_result and wd14_result.success:
-                        reference_tags = wd14_result.format_for_llm()
-                        logger.info("[Pipeline] WD14 反推成功: %s...", reference_tags[:120])
+                    if not runtime.llm.speculative_budget_seconds > 0:
+                        await reference_tags_task
                 except Exception as exc:
                     logger.warning("[Pipeline] WD14 反推异常: %s", exc, exc_info=True)
 
         # ── 3. Prompt 生成 ──
-        prompt_result = await ctx.proxy._generate_prompt_with_style(
-            user_request=ctx.user_request or "根据聊天内容生成一张合适的图片",
-            chat_messages=ctx.chat_messages,
-            persona=ctx.persona,
-            selfie_mode=ctx.selfie_mode,
-            nsfw_allowed=ctx.nsfw_allowed,
-            custom_system_prompt=ctx.custom_system_prompt,
-            reference_tags=reference_tags,
-            reference_image_base64=reference_image_for_llm,
-        )
+        try:
+            prompt_result = await ctx.proxy._generate_prompt_with_style(
+                user_request=ctx.user_request or DEFAULT_USER_REQUEST,
+                chat_messages=ctx.chat_messages,
+                persona=ctx.persona,
+                selfie_mode=ctx.selfie_mode,
+                nsfw_allowed=ctx.nsfw_allowed,
+                custom_system_prompt=ctx.custom_system_prompt,
+                reference_image_base64=reference_image_for_llm,
+                reference_tags_task=reference_tags_task,
+            )
+        finally:
+            # prompt 缓存命中、推测调用先完成或走非 danbooru 模式时，反推结果已用不上
+            if reference_tags_task is not None and not reference_tags_task.done():
+                reference_tags_task.cancel()
         if not prompt_result.success:
             await _safe_send(ctx, f"提示词生成失败: {prompt_result.error[:80]}")
             return False
@@ -158,7 +205,7 @@ async def run_draw_pipeline(ctx: DrawPipelineContext) -> bool:
         await _safe_send(ctx, "prompt 生成完成，正在出图...")
 
         # ── 4. 风格路由 ──
-        style_router = StyleRouter(ctx.config)
+        style_router = get_style_router(ctx.config)
         selected_style, model_config, route_reason = style_router.route(
             selfie_mode=ctx.selfie_mode,
             manual_style=ctx.manual_style,
@@ -174,7 +221,9 @@ async def run_draw_pipeline(ctx: DrawPipelineContext) -> bool:
         # ── 6. 参考图 resize ──
         ref_image_data_uri = ""
         if ctx.ref_mode and attachment_b64:
-            ref_image_data_uri = _resize_image_for_nai(attachment_b64, target_size)
+            ref_image_data_uri = await renditions.render_one(
+                nai_rendition(target_size, runtime.generation.resize_mode), master_min_edge=master_min_edge
+            )
             if not ref_image_data_uri:
                 await _safe_send(ctx, "附图质量不足（太小或损坏），跳过参考图模式")
                 ctx.ref_mode = ""
@@ -182,7 +231,7 @@ async def run_draw_pipeline(ctx: DrawPipelineContext) -> bool:
         # ── 7. 出图 ──
         if api_type in ("newapi_nai", "newapi-nai"):
             success = await _generate_with_newapi_nai(
-                ctx, prompt_result, model_config, target_size, ref_image_data_uri
+                ctx, prompt_result, selected_style, model_config, target_size, ref_image_data_uri
             )
         else:
             success = await _generate_with_legacy(ctx, prompt_result, model_config)
@@ -198,6 +247,7 @@ async def run_draw_pipeline(ctx: DrawPipelineContext) -> bool:
 async def _generate_with_newapi_nai(
     ctx: DrawPipelineContext,
     prompt_result: Any,
+    style: str,
     model_config: Optional[dict],
     target_size: tuple[int, int],
     ref_image_data_uri: str,
@@ -230,6 +280,8 @@ async def _generate_with_newapi_nai(
         timeout=int(mc.get("newapi_nai_timeout", 180) or 180),
         retry_attempts=int(mc.get("newapi_nai_retry_attempts", 3) or 3),
         proxy_mode=str(mc.get("newapi_nai_proxy_mode", "auto") or "auto"),
+        rate_limit_per_minute=float(mc.get("newapi_nai_rate_limit_per_minute", 0) or 0),
+        rate_limit_burst=int(mc.get("newapi_nai_rate_limit_burst", 2) or 2),
         quality_toggle=_normalize_bool(mc.get("newapi_nai_quality_toggle", True)),
         auto_smea=_normalize_bool(mc.get("newapi_nai_auto_smea", False)),
         variety_boost=_normalize_bool(mc.get("newapi_nai_variety_boost", False)),
@@ -237,20 +289,20 @@ async def _generate_with_newapi_nai(
     )
 
     # 参考图字段
-    ref_cfg = ctx.config.get("generation", {}).get("ref_image", {})
+    ref_cfg = (ctx.runtime or get_runtime_config(ctx.config)).generation.ref_image
     if ctx.ref_mode == "i2i" and ref_image_data_uri:
         gen_ctx.i2i_image = ref_image_data_uri
-        gen_ctx.i2i_strength = float(ref_cfg.get("i2i_strength", 0.7) or 0.7)
-        gen_ctx.i2i_noise = float(ref_cfg.get("i2i_noise", 0.0) or 0.0)
+        gen_ctx.i2i_strength = ref_cfg.i2i_strength
+        gen_ctx.i2i_noise = ref_cfg.i2i_noise
     elif ctx.ref_mode == "char_ref" and ref_image_data_uri:
         gen_ctx.char_ref_image = ref_image_data_uri
-        gen_ctx.char_ref_type = str(ref_cfg.get("char_ref_type", "character") or "character")
-        gen_ctx.char_ref_fidelity = float(ref_cfg.get("char_ref_fidelity", 1.0) or 1.0)
-        gen_ctx.char_ref_strength = float(ref_cfg.get("char_ref_strength", 1.0) or 1.0)
+        gen_ctx.char_ref_type = ref_cfg.char_ref_type
+        gen_ctx.char_ref_fidelity = ref_cfg.char_ref_fidelity
+        gen_ctx.char_ref_strength = ref_cfg.char_ref_strength
     elif ctx.ref_mode == "vibe" and ref_image_data_uri:
-        info_ext = float(ref_cfg.get("vibe_info_extracted", 0.4) or 0.4)
-        strength = float(ref_cfg.get("vibe_strength", 0.3) or 0.3)
-        gen_ctx.vibe_global_strength = float(ref_cfg.get("vibe_global_strength", 1.0) or 1.0)
+        info_ext = ref_cfg.vibe_info_extracted
+        strength = ref_cfg.vibe_strength
+        gen_ctx.vibe_global_strength = ref_cfg.vibe_global_strength
         # Check vibe cache_id first
         _vibe_cache = VibeCache()
         _cached_id = _vibe_cache.lookup(ref_image_data_uri, gen_ctx.model, info_ext)
@@ -260,26 +312,34 @@ async def _generate_with_newapi_nai(
         else:
             gen_ctx.vibe_images = [{"image": ref_image_data_uri, "info_extracted": info_ext, "strength": strength}]
 
-    # 客户端
-    base_url = str(mc.get("base_url", "") or "")
-    api_key = str(mc.get("api_key", "") or "")
-    if not base_url or not api_key:
+    # 端点（多 key / 镜像时按负载均衡选择）
+    style_router = get_style_router(ctx.config)
+    api_params = style_router.api_params(style, model_config)
+    failover = style_router.failover_chain(style)
+    hop_timeout = style_router.failover_hop_timeout(style) if failover else 0.0
+    if not api_params.endpoints and not failover:
         await _safe_send(ctx, "画图的 base_url 或 API 密钥没配置")
         return False
 
-    client = NewApiNaiClient(base_url=base_url, api_key=api_key, log_prefix=f"[{ctx.source}]")
-
     # 调用
-    result = await client.generate(gen_ctx)
+    result = GenerationResult(success=False, error="画图的 base_url 或 API 密钥没配置")
+    if api_params.endpoints:
+        result = await _generate_on_endpoint(ctx, api_params, gen_ctx, hop_timeout)
 
     # 降级：参考图失败 → 退回 txt2img
-    if not result.success and ctx.ref_mode and ctx.ref_mode != "none":
+    if api_params.endpoints and not result.success and ctx.ref_mode and ctx.ref_mode != "none":
         await _safe_send(ctx, f"{ctx.ref_mode} 出图失败，尝试普通文生图...")
         gen_ctx.ref_mode = "none"
         gen_ctx.i2i_image = None
         gen_ctx.char_ref_image = None
         gen_ctx.vibe_images = None
-        result = await client.generate(gen_ctx)
+        result = await _generate_on_endpoint(ctx, api_params, gen_ctx, hop_timeout)
+
+    # 故障转移：主通道失败后改走备用后端，复用已生成的 prompt
+    if not result.success and failover:
+        logger.warning(f"[Pipeline] newapi_nai 出图失败（{result.error[:80]}），切换故障转移链")
+        await _safe_send(ctx, "主通道出图失败，切换备用通道...")
+        return await _generate_with_legacy(ctx, prompt_result, model_config, skip_primary=True)
 
     if not result.success:
         await _safe_send(ctx, f"出图失败: {result.error[:80]}")
@@ -288,7 +348,7 @@ async def _generate_with_newapi_nai(
     # Store vibe cache_ids if present
     if result.success and result.vibe_cache_ids and ctx.ref_mode == "vibe" and ref_image_data_uri:
         _vc = VibeCache()
-        info_ext = float(ref_cfg.get("vibe_info_extracted", 0.4) or 0.4)
+        info_ext = ref_cfg.vibe_info_extracted
         for entry in result.vibe_cache_ids:
             idx = entry.get("index", 0)
             cid = entry.get("cache_id", "")
@@ -304,19 +364,55 @@ async def _generate_with_newapi_nai(
     return success
 
 
+async def _generate_on_endpoint(
+    ctx: DrawPipelineContext,
+    api_params: ImageApiParams,
+    gen_ctx: GenerationContext,
+    timeout: float = 0.0,
+) -> GenerationResult:
+    """由负载均衡器选一个端点发出请求，并把结果与耗时回报给均衡器。
+
+    timeout>0 时作为截止时间交给客户端，由它收紧每次 HTTP 请求与重试；
+    不在外面 wait_for，否则线程里的请求取消不掉，租约会在请求还在跑时就被释放。
+    """
+    lease = get_endpoint_balancer().acquire(api_params.endpoints, api_params.balance)
+    if lease is None:
+        return GenerationResult(success=False, error="没有可用的出图端点")
+    success = False
+    try:
+        if len(api_params.endpoints) > 1:
+            logger.info(f"[Pipeline] 出图端点: {lease.spec.label}")
+        client = NewApiNaiClient(
+            base_url=lease.spec.base_url, api_key=lease.spec.api_key, log_prefix=f"[{ctx.source}]"
+        )
+        gen_ctx.deadline = time.monotonic() + timeout if timeout > 0 else None
+        result = await client.generate(gen_ctx)
+        if not result.success and gen_ctx.deadline is not None and time.monotonic() >= gen_ctx.deadline:
+            logger.warning(f"[Pipeline] 端点 {lease.spec.label} 超过 {timeout:g}s 预算")
+            result = GenerationResult(success=False, error=f"出图超时（{timeout:g}s）")
+        success = result.success
+        return result
+    finally:
+        lease.release(success)
+
+
 async def _generate_with_legacy(
     ctx: DrawPipelineContext,
     prompt_result: Any,
     model_config: Optional[dict],
+    *,
+    skip_primary: bool = False,
 ) -> bool:
-    """非 newapi_nai 端点的旧路径回退。"""
+    """非 newapi_nai 端点的旧路径回退；skip_primary 时只走故障转移链。"""
     request = ImageGenerationRequest(
         prompt=prompt_result.prompt,
         selfie_mode=ctx.selfie_mode,
+        manual_style=ctx.manual_style,
         llm_style=prompt_result.style,
         global_prompt=prompt_result.global_prompt,
         characters=prompt_result.characters,
         aspect=prompt_result.aspect,
+        skip_primary=skip_primary,
     )
     generation_result = await generate_image(
         plugin_config=ctx.config,
@@ -37,8 +37,14 @@ from maibot_sdk.types import ToolParameterInfo, ToolParamType
 
 from src.common.logger import get_logger
 
-from .utils import _normalize_bool, _resize_image_for_edit, _resize_image_for_wd14
-from .style_router import StyleRouter
+from .utils import _normalize_bool, _resize_image_for_wd14
+from .endpoint_balancer import reset_endpoint_balancer
+from .image_processing import get_image_processor, reset_image_processor
+from .renditions import edit_rendition, get_rendition_engine, reset_rendition_engine
+from .wd14_cache import reset_wd14_cache
+from .rate_limiter import reset_rate_limiters
+from .runtime_config import RuntimeConfig, get_runtime_config, reset_runtime_config
+from .style_router import get_style_router, reset_style_router_cache
 from .actions import DrawPictureToolMetadata
 from .commands import DirectPicCommand
 from .bridge import _RuntimeBridgeMixin, _ToolRuntimeProxy, _CommandRuntimeProxy
@@ -415,35 +421,64 @@ class LLM2PicPlugin(MaiBotPlugin, _RuntimeBridgeMixin):
         return config_data
 
     async def on_load(self) -> None:
+        self._materialize_runtime_config()
         self.ctx.logger.info("MaiBot_LLM2pic 原生适配插件已加载")
 
     async def on_unload(self) -> None:
         try:
             from .core.services.danbooru_online_retriever import reset_online_retriever
             from .core.services.tag_retriever import reset_tag_retriever
+            from .danbooru_generator import reset_prompt_cache
+            from .metrics import reset_metrics
+            from .retry_policy import reset_retry_policy
+            from .wd14_client import reset_transport_negotiation
+            from .wd14_local import reset_local_tagger
 
             reset_online_retriever()
             reset_tag_retriever()
+            reset_prompt_cache()
+            reset_metrics()
+            reset_retry_policy()
+            reset_style_router_cache()
+            reset_runtime_config()
+            reset_endpoint_balancer()
+            reset_rate_limiters()
+            reset_image_processor()
+            reset_rendition_engine()
+            reset_wd14_cache()
+            reset_local_tagger()
+            reset_transport_negotiation()
         except Exception:
             pass
         self.ctx.logger.info("MaiBot_LLM2pic 原生适配插件已卸载")
 
     async def on_config_update(self, scope: str, config_data: dict[str, Any], version: str) -> None:
         del config_data
+        reset_style_router_cache()
+        reset_runtime_config()
+        reset_endpoint_balancer()
+        self._materialize_runtime_config()
         self.ctx.logger.info("MaiBot_LLM2pic 配置更新: scope=%s version=%s", scope, version)
 
+    def _materialize_runtime_config(self) -> None:
+        """预先把当前配置解析成快照，首个请求不必再现场解析。"""
+        try:
+            self._runtime_config()
+        except Exception as exc:
+            logger.warning("[LLM2pic] 配置快照解析失败，将在请求时重试: %s", exc)
+
     @staticmethod
     def _generation_stream_key(stream_id: str) -> str:
         return stream_id or "__default__"
 
-    def _try_acquire_generation_lock(self, plugin_config: dict[str, Any], stream_id: str) -> bool:
-        guard_config = plugin_config.get("generation_guard", {})
-        if not _normalize_bool(guard_config.get("pending_lock_enabled", True)):
+    def _try_acquire_generation_lock(self, runtime: RuntimeConfig, stream_id: str) -> bool:
+        guard_config = runtime.guard
+        if not guard_config.pending_lock_enabled:
             return True
         key = self._generation_stream_key(stream_id)
         now = time.time()
         # Expire stale locks (e.g. background task crashed without release)
-        lock_timeout = float(guard_config.get("lock_timeout_seconds", 300.0) or 300.0)
+        lock_timeout = guard_config.lock_timeout_seconds
         existing = self._pending_generation_streams.get(key)
         if existing is not None:
             if now - existing < lock_timeout:
@@ -474,19 +509,19 @@ class LLM2PicPlugin(MaiBotPlugin, _RuntimeBridgeMixin):
     def _assess_draw_guard(
         self,
         *,
-        plugin_config: dict[str, Any],
+        runtime: RuntimeConfig,
         stream_id: str,
         description: str,
         chat_messages: str,
         selfie_mode: bool,
     ) -> tuple[bool, str, str]:
-        guard_config = plugin_config.get("generation_guard", {})
-        if not _normalize_bool(guard_config.get("enabled", True)):
+        guard_config = runtime.guard
+        if not guard_config.enabled:
             return True, "guard_disabled", ""
 
         last_chat_line = self._last_chat_line(chat_messages)
         signal_text = f"{description}\n{last_chat_line}".lower()
-        if _normalize_bool(guard_config.get("negative_intent_block_enabled", True)):
+        if guard_config.negative_intent_block_enabled:
             if any(keyword in signal_text for keyword in self._NEGATIVE_DRAW_INTENT_KEYWORDS):
                 return False, "blocked", "检测到用户明确表示不需要生成图片"
 
@@ -500,12 +535,11 @@ class LLM2PicPlugin(MaiBotPlugin, _RuntimeBridgeMixin):
         if not explicit_request:
             return False, "blocked", "未检测到用户明确要求生成图片"
         category = "explicit" if explicit_request else "proactive"
-        interval_key = (
-            "explicit_request_min_interval_seconds"
+        min_interval = (
+            guard_config.explicit_request_min_interval_seconds
             if explicit_request
-            else "proactive_min_interval_seconds"
+            else guard_config.proactive_min_interval_seconds
         )
-        min_interval = int(guard_config.get(interval_key, 30 if explicit_request else 240) or 0)
         if min_interval <= 0:
             return True, category, ""
 
@@ -535,11 +569,12 @@ class LLM2PicPlugin(MaiBotPlugin, _RuntimeBridgeMixin):
         stream_id: str = "",
         **kwargs: Any,
     ) -> dict[str, Any]:
-        plugin_config = self.get_plugin_config_data()
-        if not _normalize_bool(self._config_get("components.enable_image_generation", True)):
+        runtime = self._runtime_config()
+        plugin_config = runtime.raw
+        if not runtime.components.enable_image_generation:
             return {"success": False, "error": "图片生成功能未启用"}
 
-        if not self._try_acquire_generation_lock(plugin_config, stream_id):
+        if not self._try_acquire_generation_lock(runtime, stream_id):
             return {"success": False, "error": "同一聊天流已有图片生成任务正在进行"}
 
         task_started = False
@@ -568,7 +603,7 @@ class LLM2PicPlugin(MaiBotPlugin, _RuntimeBridgeMixin):
 
             chat_messages_str = await proxy._get_recent_chat_messages()
             allowed, guard_category, guard_error = self._assess_draw_guard(
-                plugin_config=plugin_config,
+                runtime=runtime,
                 stream_id=stream_id,
                 description=original_description,
                 chat_messages=chat_messages_str,
@@ -618,6 +653,7 @@ class LLM2PicPlugin(MaiBotPlugin, _RuntimeBridgeMixin):
         """后台异步完成画图（P2 重构：走 pipeline）。"""
         try:
             ref_mode = reference_mode if _normalize_bool(use_reference_image) else ""
+            runtime = get_runtime_config(plugin_config)
             ctx = DrawPipelineContext(
                 source="draw_picture",
                 user_request=original_description,
@@ -626,8 +662,9 @@ class LLM2PicPlugin(MaiBotPlugin, _RuntimeBridgeMixin):
                 selfie_mode=selfie_mode_bool,
                 nsfw_allowed=nsfw_allowed_bool,
                 ref_mode=ref_mode,
-                custom_system_prompt=str(proxy.get_config("llm.system_prompt", "") or ""),
+                custom_system_prompt=runtime.llm.system_prompt,
                 config=plugin_config,
+                runtime=runtime,
                 stream_id=stream_id,
                 proxy=proxy,
                 plugin=self,
@@ -779,14 +816,15 @@ B) 写实文生图：用户明确说出"写实"/"真实"/"照片级"/"realistic"
         stream_id: str = "",
         **kwargs: Any,
     ) -> dict[str, Any]:
-        plugin_config = self.get_plugin_config_data()
+        runtime = self._runtime_config()
+        plugin_config = runtime.raw
 
         # 检查 edit 模型是否配置
-        style_router = StyleRouter(plugin_config)
+        style_router = get_style_router(plugin_config)
         if not style_router.is_style_available("edit"):
             return {"success": False, "error": "图片编辑功能未配置 edit 模型"}
 
-        if not self._try_acquire_generation_lock(plugin_config, stream_id):
+        if not self._try_acquire_generation_lock(runtime, stream_id):
             return {"success": False, "error": "同一聊天流已有图片生成任务正在进行"}
 
         try:
@@ -841,10 +879,17 @@ B) 写实文生图：用户明确说出"写实"/"真实"/"照片级"/"realistic"
 
         # 1.5 预处理图片：缩放到合理大小，避免 API 拒绝
         if input_image_base64:
-            input_image_base64 = _resize_image_for_edit(input_image_base64)
+            generation = get_runtime_config(plugin_config).generation
+            get_image_processor(
+                generation.image_process_workers,
+                generation.image_process_pool,
+                generation.image_process_timeout_seconds,
+            )
+            renditions = get_rendition_engine().session(input_image_base64, generation.rendition_cache_ttl_seconds)
+            input_image_base64 = await renditions.render_one(edit_rendition(mode=generation.resize_mode)) or input_image_base64
 
         # 2. 获取 edit 模型配置
-        style_router = StyleRouter(plugin_config)
+        style_router = get_style_router(plugin_config)
         _, model_config, _ = style_router.route(
             selfie_mode=False,
             manual_style="edit",
@@ -888,8 +933,9 @@ B) 写实文生图：用户明确说出"写实"/"真实"/"照片级"/"realistic"
         matched_groups: dict[str, Any] | None = None,
         **kwargs: Any,
     ) -> tuple[bool, Optional[str], bool]:
-        plugin_config = self.get_plugin_config_data()
-        if not _normalize_bool(self._config_get("components.enable_direct_pic_command", True)):
+        runtime = self._runtime_config()
+        plugin_config = runtime.raw
+        if not runtime.components.enable_direct_pic_command:
             return True, "图片命令未启用", True
 
         raw_prompt = (matched_groups or {}).get("prompt", "").strip()
@@ -900,7 +946,7 @@ B) 写实文生图：用户明确说出"写实"/"真实"/"照片级"/"realistic"
         if not raw_prompt:
             return True, "用法: /pic <prompt> | /pic i2i <prompt> | /pic char-ref <prompt> | /pic vibe <prompt> | /pic nsfw <prompt>", True
 
-        if not self._try_acquire_generation_lock(plugin_config, stream_id):
+        if not self._try_acquire_generation_lock(runtime, stream_id):
             return True, "同一聊天流已有图片生成任务正在进行", True
 
         try:
@@ -941,6 +987,7 @@ B) 写实文生图：用户明确说出"写实"/"真实"/"照片级"/"realistic"
                 stream_id=stream_id,
                 session_message=session_message,
             )
+            runtime = get_runtime_config(plugin_config)
             ctx = DrawPipelineContext(
                 source="direct_pic",
                 user_request=raw_prompt,
@@ -948,8 +995,9 @@ B) 写实文生图：用户明确说出"写实"/"真实"/"照片级"/"realistic"
                 nsfw_allowed=nsfw_allowed,
                 manual_style=manual_style,
                 ref_mode=ref_mode,
-                custom_system_prompt=str(proxy.get_config("llm.system_prompt", "") or ""),
+                custom_system_prompt=runtime.llm.system_prompt,
                 config=plugin_config,
+                runtime=runtime,
                 stream_id=stream_id,
                 proxy=proxy,
                 plugin=self,
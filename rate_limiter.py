@@ -0,0 +1,263 @@
+"""
+出图请求的自适应限流。
+
+每个 (base_url, api_key) 一个令牌桶，进程内共享，多个会话同时出图时在本地排队，
+而不是一起打到网关、一起收 429、一起按固定间隔重试：
+- 令牌可以预支：每次预约把下一个令牌的发放时间推后 1/速率，先到先得，天然排成队列
+- 429：速率乘性减半（AIMD），并按 Retry-After（缺省时按当前速率）把队列整体顺延
+- 成功：速率加性恢复，直到配置的上限；未配置上限时恢复到足够高后视为不限速
+
+首个请求由异步调用方 await acquire() 获取令牌，同步 urllib 重试循环在工作线程里用 wait_blocking()；
+两者都接受 deadline，令牌要在 deadline 之后才发放时立即返回 None，不预约也不等待。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import email.utils
+import threading
+import time
+from collections import deque
+from typing import Any, Optional
+
+from src.common.logger import get_logger
+
+from . import metrics
+from .endpoint_balancer import EndpointSpec
+
+logger = get_logger("MaiBot_LLM2pic")
+
+# 未配置上限时的速率（次/秒）：高于此值视为不限速
+_UNLIMITED_RATE = 10.0
+_MIN_RATE = 1.0 / 60.0
+# 首次收到 429 时的起始速率下限（与旧版固定 6s 重试间隔一致）
+_FIRST_THROTTLE_RATE = 1.0 / 6.0
+_DECREASE_FACTOR = 0.5
+# 每次成功恢复的速率占上限的比例（无上限时按当前速率的比例）
+_INCREASE_RATIO = 0.1
+_RETRY_AFTER_CAP = 300.0
+# 推算“429 之前实际在跑的速率”所用的窗口
+_DEMAND_WINDOW_SECONDS = 60.0
+
+
+def parse_retry_after(value: Any) -> Optional[float]:
+    """解析 Retry-After 头：秒数或 HTTP 日期，无效时返回 None。"""
+    text = str(value or "").strip()
+    if not text:
+        return None
+    try:
+        seconds = float(text)
+    except ValueError:
+        try:
+            parsed = email.utils.parsedate_to_datetime(text)
+        except (TypeError, ValueError):
+            return None
+        if parsed is None:
+            return None
+        seconds = parsed.timestamp() - time.time()
+    return max(0.0, min(seconds, _RETRY_AFTER_CAP))
+
+
+class AdaptiveRateLimiter:
+    """单个端点 + 密钥的令牌桶（按 GCRA 理论到达时间实现），速率随 429 反馈自适应。
+
+    每次预约把理论到达时间推后 1/rate，等待时间在预约时就确定，调用方按到达顺序排队；
+    速率变化只影响之后的预约，已排好的间隔不会被压缩。
+    """
+
+    def __init__(self, label: str, per_minute: float = 0.0, burst: int = 2) -> None:
+        self.label = label
+        self._lock = threading.Lock()
+        self._ceiling = per_minute / 60.0 if per_minute > 0 else 0.0
+        self._rate = self._ceiling or _UNLIMITED_RATE
+        self._max_burst = max(1, int(burst))
+        self._burst = self._max_burst
+        self._tat = 0.0  # 理论到达时间：下一个令牌“应当”发放的时刻
+        self._epoch = 0  # 每次 429 递增，排队中的预约据此判断是否需要重新排队
+        self._hold_until = 0.0  # 本轮拥塞的顺延截止时间，期间再收到 429 不重复降速
+        self._recent: deque[float] = deque()
+
+    @property
+    def limited(self) -> bool:
+        return self._rate < _UNLIMITED_RATE
+
+    def configure(self, per_minute: float, burst: int) -> None:
+        ceiling = per_minute / 60.0 if per_minute > 0 else 0.0
+        with self._lock:
+            changed = ceiling != self._ceiling
+            if changed:
+                self._ceiling = ceiling
+                self._rate = min(self._rate, ceiling) if ceiling else self._rate
+            self._max_burst = max(1, int(burst))
+            self._burst = min(self._burst, self._max_burst) if self.limited else self._max_burst
+        if changed:
+            self._publish_rate()
+
+    def _reserve(self, deadline: Optional[float] = None) -> Optional[tuple[float, int]]:
+        """预约一个令牌，返回 (需要等待的秒数, 预约时的 epoch)。
+
+        给了 deadline（time.monotonic() 时间点）而令牌要在那之后才发放时不预约、返回 None，
+        免得占住队列位置又用不上。
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self.limited:
+                interval = 1.0 / self._rate
+                slot = max(now, self._tat - (self._burst - 1) * interval)
+                if deadline is not None and slot > deadline:
+                    return None
+            self._recent.append(now)
+            while self._recent and self._recent[0] < now - _DEMAND_WINDOW_SECONDS:
+                self._recent.popleft()
+            if not self.limited:
+                return 0.0, self._epoch
+            self._tat = max(self._tat, now) + interval
+            return slot - now, self._epoch
+
+    def _still_valid(self, epoch: int) -> bool:
+        with self._lock:
+            return self._epoch == epoch
+
+    async def acquire(self, deadline: Optional[float] = None) -> Optional[float]:
+        """异步排队取令牌，返回总等待秒数；deadline 前拿不到令牌时不等待，直接返回 None。"""
+        waited = 0.0
+        while True:
+            reserved = self._reserve(deadline)
+            if reserved is None:
+                return self._give_up(waited)
+            wait, epoch = reserved
+            if wait <= 0:
+                break
+            await asyncio.sleep(wait)
+            waited += wait
+            if self._still_valid(epoch):
+                break
+        self._record_wait(waited)
+        return waited
+
+    def wait_blocking(self, deadline: Optional[float] = None) -> Optional[float]:
+        """同步排队取令牌（仅在工作线程中调用），返回总等待秒数；deadline 前拿不到令牌时返回 None。
+
+        429 之后 Retry-After 可能把队列顺延数分钟，不带 deadline 会让工作线程一直睡过单跳的时间预算。
+        """
+        waited = 0.0
+        while True:
+            reserved = self._reserve(deadline)
+            if reserved is None:
+                return self._give_up(waited)
+            wait, epoch = reserved
+            if wait <= 0:
+                break
+            time.sleep(wait)
+            waited += wait
+            if self._still_valid(epoch):
+                break
+        self._record_wait(waited)
+        return waited
+
+    def _give_up(self, waited: float) -> None:
+        metrics.incr(f"image.ratelimit.{self.label}.deadline")
+        self._record_wait(waited)
+        return None
+
+    def on_success(self) -> None:
+        with self._lock:
+            if not self.limited:
+                return
+            step = (self._ceiling or self._rate) * _INCREASE_RATIO
+            rate = self._rate + step
+            if self._ceiling:
+                rate = min(rate, self._ceiling)
+            self._rate = rate
+            if rate >= (self._ceiling or _UNLIMITED_RATE):
+                self._burst = self._max_burst
+        self._publish_rate()
+
+    def on_throttled(self, retry_after: Optional[float] = None) -> float:
+        """收到 429：降速并把后续请求顺延，返回下一次可用前的预计等待秒数。
+
+        同一波并发请求撞上的多个 429 只算一次拥塞（只降一次速），否则速率会被一次突发直接打到底。
+        """
+        with self._lock:
+            now = time.monotonic()
+            if now >= self._hold_until:
+                if self.limited:
+                    rate = self._rate * _DECREASE_FACTOR
+                else:
+                    # 首次被限：Retry-After 直接给出下一个可用时隙，没有时按窗口内实际请求频率估计
+                    demand = len(self._recent) / _DEMAND_WINDOW_SECONDS
+                    hinted = 1.0 / retry_after if retry_after else _FIRST_THROTTLE_RATE
+                    rate = max(demand * _DECREASE_FACTOR, hinted)
+                self._rate = max(_MIN_RATE, min(rate, self._ceiling or _UNLIMITED_RATE * _DECREASE_FACTOR))
+                # 网关不接受突发：恢复到上限前只允许逐个放行
+                self._burst = 1
+            penalty = retry_after if retry_after is not None else 1.0 / self._rate
+            self._hold_until = max(self._hold_until, now + penalty)
+            # 清掉排队中的预约（它们会按 epoch 重新排队），整体顺延到 penalty 之后
+            self._tat = now + penalty
+            self._epoch += 1
+            wait = penalty
+        metrics.incr(f"image.ratelimit.{self.label}.throttled")
+        self._publish_rate()
+        logger.warning(
+            f"[RateLimiter] {self.label} 收到 429（Retry-After={retry_after}），"
+            f"速率降为 {self._rate * 60:.1f}/min，后续请求顺延约 {wait:.1f}s"
+        )
+        return wait
+
+    def _record_wait(self, waited: float) -> None:
+        if waited > 0:
+            metrics.observe(f"image.ratelimit.{self.label}.wait", waited)
+
+    def _publish_rate(self) -> None:
+        metrics.gauge(f"image.ratelimit.{self.label}.rate_per_minute", self._rate * 60 if self.limited else 0.0)
+
+    def snapshot(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "rate_per_minute": round(self._rate * 60, 2) if self.limited else None,
+                "ceiling_per_minute": round(self._ceiling * 60, 2) if self._ceiling else None,
+                "queued_seconds": round(max(0.0, self._tat - time.monotonic()), 2),
+            }
+
+
+class RateLimiterRegistry:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._limiters: dict[tuple[str, str], AdaptiveRateLimiter] = {}
+
+    def get(self, base_url: str, api_key: str, per_minute: float = 0.0, burst: int = 2) -> AdaptiveRateLimiter:
+        key = (str(base_url or "").rstrip("/"), str(api_key or ""))
+        with self._lock:
+            limiter = self._limiters.get(key)
+            created = limiter is None
+            if created:
+                limiter = self._limiters[key] = AdaptiveRateLimiter(EndpointSpec(*key).label, per_minute, burst)
+        if not created:
+            limiter.configure(per_minute, burst)
+        return limiter
+
+    def snapshot(self) -> dict[str, dict[str, Any]]:
+        with self._lock:
+            limiters = list(self._limiters.values())
+        return {limiter.label: limiter.snapshot() for limiter in limiters}
+
+
+_registry: Optional[RateLimiterRegistry] = None
+
+
+def get_rate_limiter(base_url: str, api_key: str, per_minute: float = 0.0, burst: int = 2) -> AdaptiveRateLimiter:
+    """取 (base_url, api_key) 对应的共享限流器。"""
+    global _registry
+    if _registry is None:
+        _registry = RateLimiterRegistry()
+    return _registry.get(base_url, api_key, per_minute, burst)
+
+
+def rate_limiter_snapshot() -> dict[str, dict[str, Any]]:
+    return _registry.snapshot() if _registry is not None else {}
+
+
+def reset_rate_limiters() -> None:
+    global _registry
+    _registry = None
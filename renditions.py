@@ -0,0 +1,273 @@
+"""
+附图多变体渲染。
+
+同一张附图在一次出图里要用好几次：WD14 反推的 JPEG、LLM 识图的 JPEG、NAI 参考图的 PNG data URI，
+图片编辑走的是另一份 JPEG。以前每种用途各自完整解码一遍原图，这里改成：
+- 一次解码产出本次需要的所有变体（draft 尺寸取所有变体要求的最大值）
+- 解码后顺带保留一份“母版”（缩到 NAI 最大边长附近的原始像素），之后按出图比例再要 NAI 参考图时
+  直接从母版缩放，不再解码原 JPEG
+- 结果按原图摘要缓存：同一请求内重复取直接命中，短 TTL 内其他请求引用同一张图也能复用
+
+解码与编码在图片进程池中执行（见 image_processing），这里只负责组织任务与缓存。
+"""
+
+from __future__ import annotations
+
+import base64
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from io import BytesIO
+from typing import Any, Iterable, Optional
+
+from src.common.logger import get_logger
+
+from . import metrics
+from .image_probe import ImageProbe, probe_image
+from .image_processing import get_image_processor
+from .utils import RESIZE_EXACT, RESIZE_FAST, RESIZE_QUALITY, _DRAFT_HEADROOM, _downscale, _open_for_downscale
+
+logger = get_logger("MaiBot_LLM2pic")
+
+FORMAT_JPEG = "jpeg"
+FORMAT_PNG_DATA_URI = "png_data_uri"
+
+DEFAULT_TTL_SECONDS = 120.0
+_MAX_ENTRIES = 8
+
+
+@dataclass(frozen=True, slots=True)
+class RenditionSpec:
+    """一种变体的规格。参数相同的规格视为同一变体（如 WD14 与 LLM 识图同尺寸时只编码一次）。"""
+
+    format: str = FORMAT_JPEG
+    max_edge: int = 0  # 长边上限（只缩不放）
+    max_pixels: int = 0  # 总像素上限（只缩不放）
+    size: tuple[int, int] = (0, 0)  # 精确尺寸（NAI 参考图）
+    quality: int = 88
+    mode: str = RESIZE_FAST
+    min_side: int = 0  # 原图最短边低于此值时返回空串
+
+    def target(self, width: int, height: int) -> Optional[tuple[int, int]]:
+        """原图 width x height 对应的目标尺寸；不需要缩放时返回 None。"""
+        if self.size[0] > 0 and self.size[1] > 0:
+            return self.size
+        if self.max_edge > 0 and max(width, height) > self.max_edge:
+            scale = self.max_edge / float(max(width, height))
+            return max(1, int(width * scale)), max(1, int(height * scale))
+        if self.max_pixels > 0 and width * height > self.max_pixels:
+            scale = (self.max_pixels / (width * height)) ** 0.5
+            return int(width * scale), int(height * scale)
+        return None
+
+
+def jpeg_rendition(max_edge: int = 1024, quality: int = 88, mode: str = RESIZE_FAST) -> RenditionSpec:
+    """WD14 反推 / LLM 识图用：长边不超过 max_edge 的 JPEG（base64）。"""
+    try:
+        max_edge = max(256, min(int(max_edge or 1024), 4096))
+    except (TypeError, ValueError):
+        max_edge = 1024
+    return RenditionSpec(FORMAT_JPEG, max_edge=max_edge, quality=quality, mode=mode)
+
+
+def edit_rendition(max_pixels: int = 4_000_000, mode: str = RESIZE_QUALITY) -> RenditionSpec:
+    """图片编辑用：总像素不超过 max_pixels 的 JPEG（base64）。"""
+    return RenditionSpec(FORMAT_JPEG, max_pixels=max_pixels, quality=90, mode=mode)
+
+
+def nai_rendition(size: tuple[int, int], mode: str = RESIZE_QUALITY, min_side: int = 256) -> RenditionSpec:
+    """NAI 参考图用：精确缩放到 size 的 PNG data URI，原图太小时为空串。"""
+    return RenditionSpec(FORMAT_PNG_DATA_URI, size=(int(size[0]), int(size[1])), mode=mode, min_side=min_side)
+
+
+@dataclass(frozen=True, slots=True)
+class _Master:
+    """解码后保留的母版像素（可跨进程传递）。"""
+
+    mode: str
+    size: tuple[int, int]
+    data: bytes
+    original_size: tuple[int, int]
+
+    def image(self) -> Any:
+        from PIL import Image
+
+        return Image.frombytes(self.mode, self.size, self.data)
+
+
+def _master_target(width: int, height: int, min_edge: int) -> Optional[tuple[int, int]]:
+    """母版尺寸：短边缩到 min_edge（任意比例的精确缩放都不需要放大），原图更小时不缩。"""
+    scale = min_edge / float(min(width, height))
+    if scale >= 1.0:
+        return None
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _encode(img: Any, spec: RenditionSpec, original_size: tuple[int, int]) -> str:
+    if spec.min_side and min(original_size) < spec.min_side:
+        return ""
+    target = spec.target(*original_size)
+    if target is not None:
+        img = _downscale(img, target, spec.mode)
+    buf = BytesIO()
+    if spec.format == FORMAT_PNG_DATA_URI:
+        img.save(buf, format="PNG")
+        return f"data:image/png;base64,{base64.b64encode(buf.getvalue()).decode('ascii')}"
+    if img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    img.save(buf, format="JPEG", quality=spec.quality)
+    return base64.b64encode(buf.getvalue()).decode("utf-8")
+
+
+def render_renditions(
+    source: Any, specs: tuple[RenditionSpec, ...], master_min_edge: int = 0
+) -> tuple[dict[RenditionSpec, str], Optional[_Master]]:
+    """进程池 worker：source 为 base64 原图或母版，解码一次产出所有变体，按需返回母版。"""
+    if isinstance(source, _Master):
+        img, original_size = source.image(), source.original_size
+    else:
+
+        def draft_target(width: int, height: int) -> Optional[tuple[int, int]]:
+            # 所有变体（含母版）都能满足的最小解码尺寸；任一变体要原尺寸或 exact 模式时完整解码
+            targets = [(spec.target(width, height), spec.mode) for spec in specs]
+            if master_min_edge:
+                targets.append((_master_target(width, height, master_min_edge), RESIZE_FAST))
+            need_w = need_h = 0
+            for target, mode in targets:
+                if target is None or mode == RESIZE_EXACT:
+                    return None
+                headroom = _DRAFT_HEADROOM.get(mode, 1.0)
+                need_w = max(need_w, int(target[0] * headroom))
+                need_h = max(need_h, int(target[1] * headroom))
+            return need_w, need_h
+
+        img = _open_for_downscale(base64.b64decode(source), draft_target, RESIZE_FAST)
+        original_size = img.info["original_size"]
+
+    results = {spec: _encode(img, spec, original_size) for spec in specs}
+
+    master = None
+    if master_min_edge and not isinstance(source, _Master):
+        target = _master_target(*original_size, master_min_edge)
+        master_img = _downscale(img, target, RESIZE_FAST) if target else img
+        if master_img.mode not in ("RGB", "RGBA", "L", "LA"):
+            master_img = master_img.convert("RGBA" if "transparency" in master_img.info else "RGB")
+        master = _Master(master_img.mode, master_img.size, master_img.tobytes(), original_size)
+    return results, master
+
+
+class _Entry:
+    __slots__ = ("created", "renditions", "master")
+
+    def __init__(self) -> None:
+        self.created = time.monotonic()
+        self.renditions: dict[RenditionSpec, str] = {}
+        self.master: Optional[_Master] = None
+
+
+class RenditionSession:
+    """一次请求内对同一张附图的变体访问。持有缓存条目，TTL 为 0（不跨请求缓存）时请求内也能复用。"""
+
+    __slots__ = ("_image_base64", "_entry", "_probe")
+
+    def __init__(self, image_base64: str, entry: _Entry) -> None:
+        self._image_base64 = image_base64
+        self._entry = entry
+        self._probe: Optional[ImageProbe] = None
+
+    def probe(self) -> Optional[ImageProbe]:
+        """原图的文件头信息（只读头尾几十字节，不解码）。"""
+        if self._probe is None and self._image_base64:
+            self._probe = probe_image(self._image_base64)
+        return self._probe
+
+    async def render(self, specs: Iterable[RenditionSpec], *, master_min_edge: int = 0) -> dict[RenditionSpec, str]:
+        """返回 specs 中每个变体（失败的变体不在结果里）。
+
+        master_min_edge > 0 时保留短边为该值的母版，之后再要的变体从母版缩放，不再解码原图。
+        """
+        wanted = tuple(dict.fromkeys(specs))
+        if not self._image_base64 or not wanted:
+            return {}
+        entry = self._entry
+        probe = self.probe()
+        if probe is not None:
+            # 原图最短边不达标的变体直接判空，不必为它解码
+            for spec in wanted:
+                if spec.min_side and probe.min_side < spec.min_side:
+                    entry.renditions.setdefault(spec, "")
+        missing = tuple(spec for spec in wanted if spec not in entry.renditions)
+        if len(missing) < len(wanted):
+            metrics.incr("image.rendition.hit", len(wanted) - len(missing))
+        if missing:
+            metrics.incr("image.rendition.miss", len(missing))
+            from_master = entry.master is not None
+            if not from_master:
+                metrics.incr("image.rendition.decode")
+            started = time.monotonic()
+            try:
+                rendered, master = await get_image_processor().run(
+                    render_renditions,
+                    entry.master if from_master else self._image_base64,
+                    missing,
+                    0 if from_master else master_min_edge,
+                    op="rendition",
+                )
+            except Exception as exc:
+                logger.warning(f"[Rendition] 附图变体生成失败: {exc!r}")
+                rendered, master = {}, None
+            entry.renditions.update(rendered)
+            if master is not None:
+                entry.master = master
+            if rendered:
+                logger.info(
+                    f"[Rendition] 从{'母版' if from_master else '原图'}生成 {len(rendered)} 个变体，"
+                    f"耗时 {(time.monotonic() - started) * 1000:.0f}ms"
+                )
+        return {spec: entry.renditions[spec] for spec in wanted if spec in entry.renditions}
+
+    async def render_one(self, spec: RenditionSpec, *, master_min_edge: int = 0) -> str:
+        return (await self.render((spec,), master_min_edge=master_min_edge)).get(spec, "")
+
+
+class RenditionEngine:
+    """按原图摘要缓存变体与母版（短 TTL，跨请求复用），缺的变体一次性提交到图片进程池。"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+
+    def session(self, image_base64: str, ttl: float = DEFAULT_TTL_SECONDS) -> RenditionSession:
+        """取附图的变体会话；ttl 为跨请求复用的有效期，0 表示只在本会话内复用。"""
+        if ttl <= 0 or not image_base64:
+            return RenditionSession(image_base64, _Entry())
+        digest = hashlib.sha256(image_base64.encode("ascii", "ignore")).hexdigest()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None and now - entry.created > ttl:
+                entry = None
+            if entry is None:
+                entry = self._entries[digest] = _Entry()
+                while len(self._entries) > _MAX_ENTRIES:
+                    self._entries.popitem(last=False)
+            else:
+                self._entries.move_to_end(digest)
+        return RenditionSession(image_base64, entry)
+
+
+_engine: Optional[RenditionEngine] = None
+
+
+def get_rendition_engine() -> RenditionEngine:
+    global _engine
+    if _engine is None:
+        _engine = RenditionEngine()
+    return _engine
+
+
+def reset_rendition_engine() -> None:
+    global _engine
+    _engine = None
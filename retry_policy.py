@@ -0,0 +1,139 @@
+"""
+LLM prompt 生成的自适应重试策略。
+
+按失败类型决定下一次重试：
+- overload：网关/模型负载报错，指数退避 + 全抖动，避免多个请求同时打回去
+- invalid：输出不是合法 prompt（拒答、说明文字），立即重试并附加纠正提示
+- vision：带图调用失败，立即降级为纯文本重试
+- error：其他异常，温和的指数退避
+
+滑动窗口内 overload 次数达到阈值后建议切到回退模型；全局重试预算（令牌桶）
+限制重试总量，故障期间不会因为重试把已经过载的服务商压得更死。预算按新请求和时间两路补充，
+一阵故障后即使没有新请求，过一段时间也会恢复；带图失败降级为纯文本的那次重试不占预算。
+"""
+
+from __future__ import annotations
+
+import random
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from . import metrics
+
+ERROR_OVERLOAD = "overload"
+ERROR_INVALID = "invalid"
+ERROR_VISION = "vision"
+ERROR_OTHER = "error"
+
+# 输出无效时追加到下一次请求末尾的纠正提示
+INVALID_OUTPUT_HINT = (
+    "\n\n## 注意\n上一次输出不是有效的 Danbooru tag（可能是拒答、解释或空内容）。"
+    "这次只输出要求的 JSON，不要任何说明文字。"
+)
+
+
+@dataclass(frozen=True)
+class RetryPolicyConfig:
+    base_delay: float = 2.0
+    max_delay: float = 20.0
+    fallback_after_overloads: int = 3
+    overload_window_seconds: float = 120.0
+    budget_capacity: float = 10.0
+    budget_ratio: float = 0.2
+    budget_refill_per_minute: float = 1.0
+
+    @classmethod
+    def from_llm_config(cls, llm_config: dict[str, Any]) -> "RetryPolicyConfig":
+        return cls(
+            base_delay=max(0.5, float(llm_config.get("prompt_retry_delay_seconds", 2) or 2)),
+            max_delay=max(0.5, float(llm_config.get("retry_max_delay_seconds", 20) or 20)),
+            fallback_after_overloads=max(0, int(llm_config.get("fallback_after_overloads", 3) or 0)),
+            overload_window_seconds=max(1.0, float(llm_config.get("overload_window_seconds", 120) or 120)),
+            budget_capacity=max(1.0, float(llm_config.get("retry_budget_capacity", 10) or 10)),
+            budget_ratio=max(0.0, float(llm_config.get("retry_budget_ratio", 0.2) or 0.0)),
+            budget_refill_per_minute=max(0.0, float(llm_config.get("retry_budget_refill_per_minute", 1) or 0.0)),
+        )
+
+
+class RetryPolicy:
+    """进程内共享的重试状态：overload 滑动窗口 + 重试令牌桶。"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._overloads: deque[float] = deque()
+        self._tokens: Optional[float] = None
+        self._refilled_at = 0.0
+
+    def _refill(self, config: RetryPolicyConfig) -> float:
+        """按时间补充令牌（调用方持锁），返回当前令牌数。"""
+        now = time.monotonic()
+        if self._tokens is None:
+            self._tokens = config.budget_capacity
+        else:
+            elapsed = now - self._refilled_at
+            self._tokens = min(config.budget_capacity, self._tokens + elapsed * config.budget_refill_per_minute / 60.0)
+        self._refilled_at = now
+        return self._tokens
+
+    def on_request(self, config: RetryPolicyConfig) -> None:
+        """每个新请求（非重试）向预算存入 budget_ratio 个令牌。"""
+        with self._lock:
+            self._tokens = min(config.budget_capacity, self._refill(config) + config.budget_ratio)
+
+    def try_acquire_retry(self, config: RetryPolicyConfig) -> bool:
+        """消耗一个重试令牌；预算耗尽时返回 False，调用方应放弃重试。"""
+        with self._lock:
+            if self._refill(config) < 1.0:
+                metrics.incr("prompt.retry.budget_exhausted")
+                return False
+            self._tokens -= 1.0
+            return True
+
+    def record_failure(self, error_class: str, config: RetryPolicyConfig) -> None:
+        metrics.incr(f"prompt.retry.{error_class}")
+        if error_class != ERROR_OVERLOAD:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._overloads.append(now)
+            self._trim(now, config)
+
+    def prefer_fallback(self, config: RetryPolicyConfig) -> bool:
+        """窗口内 overload 次数达到阈值时建议跳过首选模型，直接走回退。"""
+        if config.fallback_after_overloads <= 0:
+            return False
+        with self._lock:
+            self._trim(time.monotonic(), config)
+            return len(self._overloads) >= config.fallback_after_overloads
+
+    def delay_for(self, error_class: str, attempt: int, config: RetryPolicyConfig) -> float:
+        """第 attempt 次失败后到下一次重试的等待秒数。"""
+        if error_class in (ERROR_INVALID, ERROR_VISION):
+            return 0.0
+        ceiling = min(config.max_delay, config.base_delay * (2 ** max(0, attempt - 1)))
+        if error_class == ERROR_OVERLOAD:
+            return random.uniform(0.0, ceiling)
+        return random.uniform(ceiling / 2, ceiling)
+
+    def _trim(self, now: float, config: RetryPolicyConfig) -> None:
+        cutoff = now - config.overload_window_seconds
+        while self._overloads and self._overloads[0] < cutoff:
+            self._overloads.popleft()
+
+
+_policy: Optional[RetryPolicy] = None
+
+
+def get_retry_policy() -> RetryPolicy:
+    global _policy
+    if _policy is None:
+        _policy = RetryPolicy()
+    return _policy
+
+
+def reset_retry_policy() -> None:
+    global _policy
+    _policy = None
@@ -0,0 +1,295 @@
+"""
+运行时配置快照。
+
+把插件配置字典一次性解析成不可变、带 __slots__ 的快照对象：热路径直接读属性，
+不再每次请求都按点分路径逐层取值、再做 _normalize_bool / int(... or default) 之类的转换。
+
+快照与生成它的配置字典一一对应（raw 保存原字典），get_runtime_config() 按对象身份复用；
+配置更新时插件调用 reset_runtime_config() 并重新物化，新旧快照整体替换，不会读到半新半旧的值。
+"""
+
+from __future__ import annotations
+
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+from .retry_policy import RetryPolicyConfig
+from .utils import RESIZE_MODES, _normalize_bool
+
+
+def _section(config: Any, name: str) -> dict[str, Any]:
+    value = config.get(name) if isinstance(config, dict) else None
+    return value if isinstance(value, dict) else {}
+
+
+def _str_tuple(value: Any) -> tuple[str, ...]:
+    if isinstance(value, str):
+        value = [value]
+    if not isinstance(value, (list, tuple)):
+        return ()
+    return tuple(str(item) for item in value if str(item or "").strip())
+
+
+def _float(section: dict[str, Any], key: str, default: float) -> float:
+    return float(section.get(key, default) or default)
+
+
+def _int(section: dict[str, Any], key: str, default: int) -> int:
+    return int(section.get(key, default) or default)
+
+
+def _resize_mode(section: dict[str, Any], default: str) -> str:
+    mode = str(section.get("resize_mode", default) or default).strip().lower()
+    return mode if mode in RESIZE_MODES else default
+
+
+def _wd14_transport(section: dict[str, Any]) -> str:
+    transport = str(section.get("transport", "json") or "json").strip().lower()
+    return transport if transport in ("auto", "json", "octet-stream", "multipart") else "json"
+
+
+@dataclass(frozen=True, slots=True)
+class LlmRuntimeConfig:
+    model_name: str = ""
+    prompt_mode: str = "danbooru"
+    context_message_limit: int = 20
+    context_time_minutes: int = 30
+    temperature: float = 0.2
+    danbooru_sfw_mode: bool = True
+    sfw_extra_banned_tags: tuple[str, ...] = ()
+    sfw_extra_banned_substrings: tuple[str, ...] = ()
+    postprocess_rules_file: str = ""
+    enforce_tag_order: bool = True
+    selfie_appearance_policy: str = "auto"
+    prompt_cache_enabled: bool = True
+    prompt_cache_ttl_seconds: float = 600.0
+    prompt_cache_max_entries: int = 64
+    prompt_retry_attempts: int = 3
+    speculative_budget_seconds: float = 0.0
+    speculative_race_enriched: bool = False
+    streaming_enabled: bool = False
+    race_enabled: bool = False
+    race_model_names: tuple[str, ...] = ()
+    system_prompt: str = ""
+    retry: RetryPolicyConfig = field(default_factory=RetryPolicyConfig)
+
+    @classmethod
+    def from_dict(cls, section: dict[str, Any]) -> "LlmRuntimeConfig":
+        return cls(
+            model_name=str(section.get("model_name", "") or "").strip(),
+            prompt_mode=str(section.get("prompt_mode", "danbooru") or "danbooru").strip().lower(),
+            context_message_limit=_int(section, "context_message_limit", 20),
+            context_time_minutes=_int(section, "context_time_minutes", 30),
+            temperature=_float(section, "temperature", 0.2),
+            danbooru_sfw_mode=_normalize_bool(section.get("danbooru_sfw_mode", True)),
+            sfw_extra_banned_tags=_str_tuple(section.get("sfw_extra_banned_tags")),
+            sfw_extra_banned_substrings=_str_tuple(section.get("sfw_extra_banned_substrings")),
+            postprocess_rules_file=str(section.get("postprocess_rules_file", "") or ""),
+            enforce_tag_order=_normalize_bool(section.get("enforce_tag_order", True)),
+            selfie_appearance_policy=str(section.get("selfie_appearance_policy", "auto") or "auto").strip().lower(),
+            prompt_cache_enabled=_normalize_bool(section.get("prompt_cache_enabled", True)),
+            prompt_cache_ttl_seconds=max(0.0, float(section.get("prompt_cache_ttl_seconds", 600) or 0)),
+            prompt_cache_max_entries=max(1, _int(section, "prompt_cache_max_entries", 64)),
+            prompt_retry_attempts=max(1, min(_int(section, "prompt_retry_attempts", 3), 5)),
+            speculative_budget_seconds=max(0.0, float(section.get("speculative_budget_seconds", 0) or 0)),
+            speculative_race_enriched=_normalize_bool(section.get("speculative_race_enriched", False)),
+            streaming_enabled=_normalize_bool(section.get("streaming_enabled", False)),
+            race_enabled=_normalize_bool(section.get("race_enabled", False)),
+            race_model_names=tuple(name.strip() for name in _str_tuple(section.get("race_model_names"))),
+            system_prompt=str(section.get("system_prompt", "") or ""),
+            retry=RetryPolicyConfig.from_llm_config(section),
+        )
+
+
+@dataclass(frozen=True, slots=True)
+class Wd14RuntimeConfig:
+    enabled: bool = True
+    backend: str = "remote"
+    endpoint: str = ""
+    transport: str = "json"
+    local_model_dir: str = ""
+    local_threads: int = 2
+    local_batch_size: int = 4
+    local_character_threshold: float = 0.85
+    threshold: float = 0.35
+    timeout: float = 60.0
+    max_image_size: int = 1024
+    resize_mode: str = "fast"
+    cache_memory_entries: int = 64
+    cache_disk_enabled: bool = True
+    cache_disk_max_mb: int = 32
+    cache_ttl_hours: float = 168.0
+    negative_cache_ttl_seconds: float = 300.0
+
+    @classmethod
+    def from_dict(cls, section: dict[str, Any]) -> "Wd14RuntimeConfig":
+        return cls(
+            enabled=_normalize_bool(section.get("enabled", True)),
+            backend="local" if str(section.get("backend", "") or "").strip().lower() == "local" else "remote",
+            endpoint=str(section.get("endpoint", "") or ""),
+            transport=_wd14_transport(section),
+            local_model_dir=str(section.get("local_model_dir", "") or "").strip(),
+            local_threads=max(1, _int(section, "local_threads", 2)),
+            local_batch_size=max(1, _int(section, "local_batch_size", 4)),
+            local_character_threshold=_float(section, "local_character_threshold", 0.85),
+            threshold=_float(section, "threshold", 0.35),
+            timeout=_float(section, "timeout", 60.0),
+            max_image_size=_int(section, "max_image_size", 1024),
+            resize_mode=_resize_mode(section, "fast"),
+            cache_memory_entries=max(1, _int(section, "cache_memory_entries", 64)),
+            cache_disk_enabled=_normalize_bool(section.get("cache_disk_enabled", True)),
+            cache_disk_max_mb=max(1, _int(section, "cache_disk_max_mb", 32)),
+            cache_ttl_hours=max(0.1, _float(section, "cache_ttl_hours", 168.0)),
+            negative_cache_ttl_seconds=max(0.0, _float(section, "negative_cache_ttl_seconds", 300.0)),
+        )
+
+
+@dataclass(frozen=True, slots=True)
+class RefImageRuntimeConfig:
+    i2i_strength: float = 0.7
+    i2i_noise: float = 0.0
+    char_ref_type: str = "character"
+    char_ref_fidelity: float = 1.0
+    char_ref_strength: float = 1.0
+    vibe_info_extracted: float = 0.4
+    vibe_strength: float = 0.3
+    vibe_global_strength: float = 1.0
+
+    @classmethod
+    def from_dict(cls, section: dict[str, Any]) -> "RefImageRuntimeConfig":
+        return cls(
+            i2i_strength=_float(section, "i2i_strength", 0.7),
+            i2i_noise=float(section.get("i2i_noise", 0.0) or 0.0),
+            char_ref_type=str(section.get("char_ref_type", "character") or "character"),
+            char_ref_fidelity=_float(section, "char_ref_fidelity", 1.0),
+            char_ref_strength=_float(section, "char_ref_strength", 1.0),
+            vibe_info_extracted=_float(section, "vibe_info_extracted", 0.4),
+            vibe_strength=_float(section, "vibe_strength", 0.3),
+            vibe_global_strength=_float(section, "vibe_global_strength", 1.0),
+        )
+
+
+@dataclass(frozen=True, slots=True)
+class GenerationRuntimeConfig:
+    custom_prompt_add: str = ""
+    crop_enabled: bool = False
+    crop_position: str = "bottom"
+    crop_pixels: int = 40
+    output_format: str = "png"
+    output_target_kb: int = 0
+    output_quality: int = 90
+    resize_mode: str = "quality"
+    rendition_cache_ttl_seconds: float = 120.0
+    image_process_workers: int = 2
+    image_process_pool: str = "thread"
+    image_process_timeout_seconds: float = 30.0
+    ref_image: RefImageRuntimeConfig = field(default_factory=RefImageRuntimeConfig)
+
+    @classmethod
+    def from_dict(cls, section: dict[str, Any]) -> "GenerationRuntimeConfig":
+        return cls(
+            custom_prompt_add=str(section.get("custom_prompt_add", "") or ""),
+            crop_enabled=_normalize_bool(section.get("crop_enabled", False)),
+            crop_position=str(section.get("crop_position", "bottom") or "bottom"),
+            crop_pixels=_int(section, "crop_pixels", 40),
+            output_format=str(section.get("output_format", "png") or "png").strip().lower(),
+            output_target_kb=max(0, int(section.get("output_target_kb", 0) or 0)),
+            output_quality=max(1, min(_int(section, "output_quality", 90), 100)),
+            resize_mode=_resize_mode(section, "quality"),
+            rendition_cache_ttl_seconds=max(0.0, float(section.get("rendition_cache_ttl_seconds", 120) or 0)),
+            image_process_workers=max(0, int(section.get("image_process_workers", 2) or 0)),
+            image_process_pool="process" if str(section.get("image_process_pool", "") or "").strip().lower() == "process" else "thread",
+            image_process_timeout_seconds=max(0.0, float(section.get("image_process_timeout_seconds", 30) or 0)),
+            ref_image=RefImageRuntimeConfig.from_dict(_section(section, "ref_image")),
+        )
+
+
+@dataclass(frozen=True, slots=True)
+class GuardRuntimeConfig:
+    enabled: bool = True
+    pending_lock_enabled: bool = True
+    lock_timeout_seconds: float = 300.0
+    negative_intent_block_enabled: bool = True
+    explicit_request_min_interval_seconds: int = 30
+    proactive_min_interval_seconds: int = 240
+
+    @classmethod
+    def from_dict(cls, section: dict[str, Any]) -> "GuardRuntimeConfig":
+        return cls(
+            enabled=_normalize_bool(section.get("enabled", True)),
+            pending_lock_enabled=_normalize_bool(section.get("pending_lock_enabled", True)),
+            lock_timeout_seconds=_float(section, "lock_timeout_seconds", 300.0),
+            negative_intent_block_enabled=_normalize_bool(section.get("negative_intent_block_enabled", True)),
+            explicit_request_min_interval_seconds=int(section.get("explicit_request_min_interval_seconds", 30) or 0),
+            proactive_min_interval_seconds=int(section.get("proactive_min_interval_seconds", 240) or 0),
+        )
+
+
+@dataclass(frozen=True, slots=True)
+class ComponentsRuntimeConfig:
+    enable_image_generation: bool = True
+    enable_direct_pic_command: bool = True
+
+    @classmethod
+    def from_dict(cls, section: dict[str, Any]) -> "ComponentsRuntimeConfig":
+        return cls(
+            enable_image_generation=_normalize_bool(section.get("enable_image_generation", True)),
+            enable_direct_pic_command=_normalize_bool(section.get("enable_direct_pic_command", True)),
+        )
+
+
+@dataclass(frozen=True, slots=True)
+class RuntimeConfig:
+    """一份配置字典对应的完整快照。raw 为原字典，供仍按字典读取的下游（风格路由、tag 检索）使用。"""
+
+    raw: dict[str, Any]
+    llm: LlmRuntimeConfig
+    wd14: Wd14RuntimeConfig
+    generation: GenerationRuntimeConfig
+    guard: GuardRuntimeConfig
+    components: ComponentsRuntimeConfig
+    tag_retriever: dict[str, Any]
+
+    @classmethod
+    def from_dict(cls, config: dict[str, Any]) -> "RuntimeConfig":
+        return cls(
+            raw=config,
+            llm=LlmRuntimeConfig.from_dict(_section(config, "llm")),
+            wd14=Wd14RuntimeConfig.from_dict(_section(config, "wd14")),
+            generation=GenerationRuntimeConfig.from_dict(_section(config, "generation")),
+            guard=GuardRuntimeConfig.from_dict(_section(config, "generation_guard")),
+            components=ComponentsRuntimeConfig.from_dict(_section(config, "components")),
+            tag_retriever=_section(config, "tag_retriever"),
+        )
+
+
+_EMPTY_CONFIG: dict[str, Any] = {}
+_current: Optional[RuntimeConfig] = None
+_lock = threading.Lock()
+
+
+def get_runtime_config(config: Optional[dict[str, Any]]) -> RuntimeConfig:
+    """返回 config 对应的快照；同一配置对象只解析一次，换了配置对象则整体替换。"""
+    if config is None:
+        config = _EMPTY_CONFIG
+    current = _current
+    if current is not None and current.raw is config:
+        return current
+    return _swap(config)
+
+
+def _swap(config: dict[str, Any]) -> RuntimeConfig:
+    global _current
+    with _lock:
+        if _current is not None and _current.raw is config:
+            return _current
+        snapshot = RuntimeConfig.from_dict(config)
+        _current = snapshot
+        return snapshot
+
+
+def reset_runtime_config() -> None:
+    global _current
+    with _lock:
+        _current = None
@@ -1,12 +1,20 @@
 """
 风格路由器和 LLM 输出解析器
+
+StyleRouter 在构造时一次性解析各风格的端点配置与出图参数（ImageApiParams），
+get_style_router() 按配置对象缓存路由器，配置更新时由插件调用 reset_style_router_cache() 失效。
 """
 
 import json
-from typing import List, Optional, Tuple
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, List, Optional, Tuple
 
 from src.common.logger import get_logger
 
+from .endpoint_balancer import BalancePolicy, EndpointSpec, parse_balance_policy, parse_endpoints
+
 logger = get_logger("MaiBot_LLM2pic")
 
 
@@ -72,6 +80,160 @@ def _endpoint_value(style_config: dict, endpoint_config: dict, key: str, default
     return style_config.get(key, default)
 
 
+def _endpoint_list(style_config: dict, endpoint_config: dict) -> list[dict]:
+    """主端点 + mirrors 镜像，供多端点负载均衡使用；镜像缺省的 base_url/api_key 沿用主端点。"""
+    base_url = str(_endpoint_value(style_config, endpoint_config, "base_url", "") or "")
+    api_key = str(_endpoint_value(style_config, endpoint_config, "api_key", "") or "")
+    endpoints = [{"base_url": base_url, "api_key": api_key, "weight": endpoint_config.get("weight", 1.0)}]
+    mirrors = endpoint_config.get("mirrors")
+    for mirror in mirrors if isinstance(mirrors, list) else []:
+        if not isinstance(mirror, dict):
+            continue
+        endpoints.append({
+            "base_url": mirror.get("base_url") or base_url,
+            "api_key": mirror.get("api_key") or api_key,
+            "weight": mirror.get("weight", 1.0),
+        })
+    return endpoints
+
+
+_FAILOVER_API_TYPES = frozenset({"newapi_nai", "novelai", "sd_api", "gradio", "openai", "regex_url"})
+
+
+def _config_value(config: dict, path: str, default: Any = None) -> Any:
+    current: Any = config
+    for part in path.split("."):
+        if not isinstance(current, dict) or part not in current:
+            return default
+        current = current[part]
+    return current
+
+
+@dataclass(frozen=True)
+class ImageApiParams:
+    """某个风格（或未配置风格时的全局 api.*）解析好的出图参数。
+
+    各 *_params 字典在同一配置版本内被所有请求共享，调用方需要改动时先复制。
+    endpoints 为负载均衡候选端点（主端点在前、mirrors 在后），balance 为选择/摘除策略。
+    """
+
+    api_type: str
+    base_url: str
+    api_key: str
+    model: str
+    size: str
+    gradio_params: Optional[dict]
+    sd_params: Optional[dict]
+    novelai_params: Optional[dict]
+    newapi_nai_params: Optional[dict]
+    endpoints: tuple[EndpointSpec, ...] = ()
+    balance: BalancePolicy = field(default_factory=BalancePolicy)
+
+    def missing_setting(self) -> str:
+        """缺少的必填项（"base_url" / "api_key"），齐全时返回空串。"""
+        api_type = self.api_type.lower()
+        if api_type != "novelai" and not self.base_url:
+            return "base_url"
+        if api_type not in ("gradio", "regex_url") and not self.api_key.strip():
+            return "api_key"
+        return ""
+
+
+def _build_default_api_params(config: dict) -> ImageApiParams:
+    """未启用 anime/edit 时，按旧版全局 api.* / generation.* 配置出图。"""
+    generation = config.get("generation", {})
+    if not isinstance(generation, dict):
+        generation = {}
+    return ImageApiParams(
+        api_type=str(_config_value(config, "api.api_type", "openai") or "openai"),
+        base_url=str(_config_value(config, "api.base_url", "") or ""),
+        api_key=str(_config_value(config, "api.api_key", "") or ""),
+        model=str(generation.get("default_model", "gpt-image-1") or "gpt-image-1"),
+        size=str(_config_value(config, "api.size", "") or generation.get("default_size", "") or ""),
+        gradio_params=None,
+        sd_params=None,
+        novelai_params=None,
+        newapi_nai_params={
+            "negative_prompt": str(generation.get("newapi_nai_negative_prompt", "") or ""),
+            "size": generation.get("newapi_nai_size", "portrait"),
+            "steps": generation.get("newapi_nai_steps", 23),
+            "scale": generation.get("newapi_nai_scale", 5),
+            "sampler": generation.get("newapi_nai_sampler", "k_euler_ancestral"),
+            "seed": generation.get("newapi_nai_seed", -1),
+            "image_format": generation.get("newapi_nai_image_format", "png"),
+            "max_tokens": generation.get("newapi_nai_max_tokens", 100000),
+            "timeout": generation.get("newapi_nai_timeout", 180),
+            "retry_attempts": generation.get("newapi_nai_retry_attempts", 3),
+            "proxy_mode": generation.get("newapi_nai_proxy_mode", "auto"),
+            "quality_toggle": generation.get("newapi_nai_quality_toggle", True),
+            "auto_smea": generation.get("newapi_nai_auto_smea", False),
+            "variety_boost": generation.get("newapi_nai_variety_boost", False),
+            "extra_params": generation.get("newapi_nai_extra_params", {}),
+        },
+        endpoints=parse_endpoints({
+            "base_url": _config_value(config, "api.base_url", ""),
+            "api_key": _config_value(config, "api.api_key", ""),
+        }),
+    )
+
+
+def _build_model_api_params(config: dict, model_config: dict) -> ImageApiParams:
+    return ImageApiParams(
+        api_type=str(model_config.get("api_type", "openai") or "openai"),
+        base_url=str(model_config.get("base_url", "") or ""),
+        api_key=str(model_config.get("api_key", "") or ""),
+        model=str(model_config.get("model_name", "") or ""),
+        size=str(model_config.get("size", "") or _config_value(config, "generation.default_size", "") or ""),
+        gradio_params={
+            "resolution": model_config.get("gradio_resolution", "1024x1024 ( 1:1 )"),
+            "steps": model_config.get("gradio_steps", 8),
+            "shift": model_config.get("gradio_shift", 3),
+            "timeout": model_config.get("gradio_timeout", 120),
+        },
+        sd_params={
+            "negative_prompt": model_config.get("sd_negative_prompt", ""),
+            "width": model_config.get("sd_width", 512),
+            "height": model_config.get("sd_height", 512),
+            "steps": model_config.get("sd_steps", 20),
+            "cfg": model_config.get("sd_cfg", 7.0),
+            "model_index": model_config.get("sd_model_index", 0),
+            "seed": model_config.get("sd_seed", -1),
+        },
+        novelai_params={
+            "model": model_config.get("novelai_model", "nai-diffusion-4-5-full"),
+            "width": model_config.get("novelai_width", 832),
+            "height": model_config.get("novelai_height", 1216),
+            "steps": model_config.get("novelai_steps", 28),
+            "scale": model_config.get("novelai_scale", 5.0),
+            "sampler": model_config.get("novelai_sampler", "k_euler"),
+            "negative_prompt": model_config.get("novelai_negative_prompt", ""),
+            "seed": model_config.get("novelai_seed", -1),
+            "timeout": model_config.get("novelai_timeout", 120),
+        },
+        newapi_nai_params={
+            "negative_prompt": model_config.get("newapi_nai_negative_prompt", ""),
+            "size": model_config.get("newapi_nai_size", "portrait"),
+            "steps": model_config.get("newapi_nai_steps", 23),
+            "scale": model_config.get("newapi_nai_scale", 5),
+            "sampler": model_config.get("newapi_nai_sampler", "k_euler_ancestral"),
+            "seed": model_config.get("newapi_nai_seed", -1),
+            "image_format": model_config.get("newapi_nai_image_format", "png"),
+            "max_tokens": model_config.get("newapi_nai_max_tokens", 100000),
+            "timeout": model_config.get("newapi_nai_timeout", 180),
+            "retry_attempts": model_config.get("newapi_nai_retry_attempts", 3),
+            "proxy_mode": model_config.get("newapi_nai_proxy_mode", "auto"),
+            "quality_toggle": model_config.get("newapi_nai_quality_toggle", True),
+            "auto_smea": model_config.get("newapi_nai_auto_smea", False),
+            "variety_boost": model_config.get("newapi_nai_variety_boost", False),
+            "extra_params": model_config.get("newapi_nai_extra_params", {}),
+            "rate_limit_per_minute": model_config.get("newapi_nai_rate_limit_per_minute", 0),
+            "rate_limit_burst": model_config.get("newapi_nai_rate_limit_burst", 2),
+        },
+        endpoints=parse_endpoints(model_config),
+        balance=parse_balance_policy(model_config),
+    )
+
+
 class StyleRouter:
     """风格路由器，根据各种条件决定使用哪个模型"""
 
@@ -88,17 +250,25 @@ class StyleRouter:
         self.default_style = config.get("generation", {}).get("default_style", "anime")
         self.anime_config = self._extract_model_config("anime")
         self.edit_config = self._extract_model_config("edit")
+        self._default_api_params = _build_default_api_params(config)
+        self._api_params = {
+            style: _build_model_api_params(config, model_config)
+            for style, model_config in (("anime", self.anime_config), ("edit", self.edit_config))
+            if model_config is not None
+        }
+        self._failover = {style: self._build_failover_chain(style) for style in self._api_params}
 
         logger.debug(f"[StyleRouter] 初始化完成: default_style={self.default_style}, "
                     f"anime_enabled={self.anime_config is not None}, "
                     f"edit_enabled={self.edit_config is not None}")
 
-    def _extract_model_config(self, style: str) -> Optional[dict]:
+    def _extract_model_config(self, style: str, api_type: Optional[str] = None) -> Optional[dict]:
         """
         提取指定风格的模型配置
 
         Args:
             style: 风格名称 ("anime" 或 "edit")
+            api_type: 指定后端（故障转移链使用），默认取风格配置的 api_type
 
         Returns:
             Optional[dict]: 模型配置字典，如果未启用则返回 None
@@ -109,15 +279,22 @@ class StyleRouter:
         if not style_config.get("enabled", False):
             return None
 
-        api_type = str(style_config.get("api_type", "openai") or "openai").lower().replace("-", "_")
-        endpoint_config = _get_endpoint_config(style_config, api_type)
+        if api_type is None:
+            api_type = style_config.get("api_type", "openai")
+        normalized_api_type = str(api_type or "openai").lower().replace("-", "_")
+        endpoint_config = _get_endpoint_config(style_config, normalized_api_type)
         return {
-            "api_type": style_config.get("api_type", "openai"),
+            "api_type": api_type,
             "base_url": _endpoint_value(style_config, endpoint_config, "base_url", ""),
             "api_key": _endpoint_value(style_config, endpoint_config, "api_key", ""),
             "model_name": _endpoint_value(style_config, endpoint_config, "model_name", ""),
             "size": _endpoint_value(style_config, endpoint_config, "size", style_config.get("size", "")),
             "custom_prompt_add": _endpoint_value(style_config, endpoint_config, "custom_prompt_add", ""),
+            # 多端点负载均衡
+            "endpoints": _endpoint_list(style_config, endpoint_config),
+            "balance_strategy": endpoint_config.get("balance_strategy", "least_outstanding"),
+            "eject_after_failures": endpoint_config.get("eject_after_failures", 3),
+            "eject_cooldown_seconds": endpoint_config.get("eject_cooldown_seconds", 60),
             # Gradio 参数
             "gradio_resolution": _endpoint_value(style_config, endpoint_config, "resolution", style_config.get("gradio_resolution", "1024x1024 ( 1:1 )")),
             "gradio_steps": _endpoint_value(style_config, endpoint_config, "steps", style_config.get("gradio_steps", 8)),
@@ -157,6 +334,8 @@ class StyleRouter:
             "newapi_nai_auto_smea": _endpoint_value(style_config, endpoint_config, "auto_smea", style_config.get("newapi_nai_auto_smea", False)),
             "newapi_nai_variety_boost": _endpoint_value(style_config, endpoint_config, "variety_boost", style_config.get("newapi_nai_variety_boost", False)),
             "newapi_nai_extra_params": _endpoint_value(style_config, endpoint_config, "extra_params", style_config.get("newapi_nai_extra_params", {})),
+            "newapi_nai_rate_limit_per_minute": _endpoint_value(style_config, endpoint_config, "rate_limit_per_minute", 0),
+            "newapi_nai_rate_limit_burst": _endpoint_value(style_config, endpoint_config, "rate_limit_burst", 2),
         }
 
     def route(
@@ -238,6 +417,51 @@ class StyleRouter:
         logger.warning(f"[StyleRouter] 默认风格 {self.default_style} 未配置，回退到 {fallback_style}")
         return fallback_style, fallback_config, "default_style_fallback"
 
+    def _build_failover_chain(self, style: str) -> tuple[tuple[dict, ImageApiParams], ...]:
+        """按 [style].failover 顺序解析备用后端；与主后端重复或未配置端点的跳过。"""
+        style_config = self.config.get(style, {})
+        chain = style_config.get("failover")
+        if isinstance(chain, str):
+            chain = [chain]
+        if not isinstance(chain, list):
+            return ()
+        primary = str(style_config.get("api_type", "openai") or "openai").lower().replace("-", "_")
+        seen = {primary}
+        hops: list[tuple[dict, ImageApiParams]] = []
+        for item in chain:
+            api_type = str(item or "").strip().lower().replace("-", "_")
+            if api_type not in _FAILOVER_API_TYPES or api_type in seen:
+                continue
+            seen.add(api_type)
+            model_config = self._extract_model_config(style, api_type)
+            if model_config is None:
+                continue
+            params = _build_model_api_params(self.config, model_config)
+            missing = params.missing_setting()
+            if missing:
+                logger.warning(f"[StyleRouter] {style} 故障转移后端 {api_type} 缺少 {missing}，已跳过")
+                continue
+            hops.append((model_config, params))
+        return tuple(hops)
+
+    def failover_chain(self, style: str) -> tuple[tuple[dict, ImageApiParams], ...]:
+        """主后端失败后依次尝试的 (model_config, 出图参数)，不含主后端本身。"""
+        return self._failover.get(style, ())
+
+    def failover_hop_timeout(self, style: str) -> float:
+        """配置了故障转移时每一跳的超时预算（秒），0 表示不限。"""
+        style_config = self.config.get(style, {})
+        try:
+            return max(0.0, float(style_config.get("failover_hop_timeout_seconds", 150) or 0))
+        except (TypeError, ValueError):
+            return 150.0
+
+    def api_params(self, style: str, model_config: Optional[dict]) -> ImageApiParams:
+        """route() 结果对应的出图参数（构造时已解析好）。model_config 为 None 时走全局 api.*。"""
+        if model_config is None:
+            return self._default_api_params
+        return self._api_params[style]
+
     def is_style_available(self, style: str) -> bool:
         """检查指定风格是否可用"""
         if style == "anime":
@@ -256,6 +480,37 @@ class StyleRouter:
         return styles
 
 
+_ROUTER_CACHE_SIZE = 4
+_router_cache: "OrderedDict[int, tuple[dict, StyleRouter]]" = OrderedDict()
+_router_lock = threading.Lock()
+
+
+def get_style_router(config: dict) -> StyleRouter:
+    """按配置对象复用 StyleRouter；同一份配置只解析一次。
+
+    缓存持有配置对象本身并以 ``is`` 校验，不会因 id 复用命中旧配置；
+    配置原地更新时需调用 reset_style_router_cache()。
+    """
+    key = id(config)
+    with _router_lock:
+        entry = _router_cache.get(key)
+        if entry is not None and entry[0] is config:
+            _router_cache.move_to_end(key)
+            return entry[1]
+    router = StyleRouter(config)
+    with _router_lock:
+        _router_cache[key] = (config, router)
+        _router_cache.move_to_end(key)
+        while len(_router_cache) > _ROUTER_CACHE_SIZE:
+            _router_cache.popitem(last=False)
+    return router
+
+
+def reset_style_router_cache() -> None:
+    with _router_lock:
+        _router_cache.clear()
+
+
 class LLMOutputParser:
     """LLM 输出解析器，用于解析 JSON 格式的 LLM 输出"""
 
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+import importlib
+import sys
+from pathlib import Path
+
+import pytest
+
+# 插件以包的形式被 MaiBot 加载；测试里直接把插件根目录放进 sys.path，按 core.* 导入纯逻辑模块
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+# 这些依赖只在 MaiBot 运行环境里有，缺失时跳过相关测试而不是报错
+_HOST_MODULES = ("src", "httpx", "maibot_sdk")
+
+
+@pytest.fixture
+def plugin_module():
+    """按包导入插件根目录下的模块（它们使用相对导入并依赖 MaiBot 的 src.*），如 plugin_module("rate_limiter")。"""
+    root = Path(__file__).resolve().parent.parent
+    if str(root.parent) not in sys.path:
+        sys.path.insert(0, str(root.parent))
+
+    def _load(name: str):
+        try:
+            return importlib.import_module(f"{root.name}.{name}")
+        except ModuleNotFoundError as exc:
+            if (exc.name or "").split(".")[0] in _HOST_MODULES:
+                pytest.skip(f"需要 MaiBot 运行环境: {exc.name}")
+            raise
+
+    return _load
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""prompt_ast 的往返 / 过滤性质测试（需要 hypothesis；后处理链相关用例需要 MaiBot 运行环境）。"""
+
+import pytest
+
+hypothesis = pytest.importorskip("hypothesis")
+from hypothesis import given, settings, strategies as st  # noqa: E402
+
+from core.utils.prompt_ast import _CLOSE_TOKEN_RE, _OPEN_TOKEN_RE, _closes, parse_prompt, tag_core  # noqa: E402
+
+WORDS = [
+    "1girl", "solo", "smile", "blue hair", "long hair", "purple eyes", "twintails", "bikini", "hat",
+    "year 2024", "pov", "looking at viewer", "azuma seren (vtuber)", "lingerie (sheer)", "outdoors",
+    "cat ears", "hair ribbon",
+]
+OPENERS = ["{", "[", "(", "1.2::", "-1::", "0.5::"]
+CLOSER_FOR = {"{": "}", "[": "]", "(": ")"}
+
+
+@st.composite
+def segments(draw):
+    """一段平衡的 tag 序列，分组可以跨多个 tag。"""
+    count = draw(st.integers(1, 10))
+    parts, stack = [], []
+    for index in range(count):
+        lead = ""
+        for _ in range(draw(st.integers(0, 2))):
+            opener = draw(st.sampled_from(OPENERS))
+            lead += opener
+            stack.append(opener)
+        body = draw(st.sampled_from(WORDS))
+        closing = draw(st.integers(0, len(stack))) if index < count - 1 else len(stack)
+        trail = "".join(CLOSER_FOR.get(stack.pop(), "::") for _ in range(closing))
+        parts.append(f"{lead}{body}{trail}")
+    return ", ".join(parts)
+
+
+@st.composite
+def prompts(draw):
+    parts = draw(st.lists(segments(), min_size=1, max_size=3))
+    style = draw(st.sampled_from(["single", "newline", "bar"]))
+    if style == "single" or len(parts) == 1:
+        return parts[0]
+    if style == "bar":
+        return " | ".join(parts)
+    return "\n".join([parts[0]] + [f"| char{index}: {part}" for index, part in enumerate(parts[1:], 1)])
+
+
+def weight_stacks(ast):
+    """每个 tag 的 (core, 外层分组记号栈)，同时断言分组是平衡的。"""
+    result = []
+    for segment in ast.segments:
+        stack = []
+        for tag in segment.tags:
+            stack.extend(_OPEN_TOKEN_RE.findall(tag.lead))
+            result.append((tag.core, tuple(stack)))
+            for close in _CLOSE_TOKEN_RE.findall(tag.trail):
+                assert stack and _closes(stack[-1], close), segment.render()
+                stack.pop()
+        assert not stack, segment.render()
+    return result
+
+
+@settings(max_examples=500, deadline=None)
+@given(prompts())
+def test_roundtrip_is_lossless(prompt):
+    assert parse_prompt(prompt).serialize() == prompt
+
+
+@settings(max_examples=500, deadline=None)
+@given(prompts(), st.sets(st.sampled_from([tag_core(word) for word in WORDS])))
+def test_filter_keeps_enclosing_weights(prompt, removed):
+    expected = [item for item in weight_stacks(parse_prompt(prompt)) if item[0] not in removed]
+    ast = parse_prompt(prompt)
+    ast.filter_tags(lambda tag: tag.core in removed)
+    assert weight_stacks(parse_prompt(ast.serialize())) == expected
+
+
+@settings(max_examples=500, deadline=None)
+@given(prompts())
+def test_reorder_keeps_enclosing_weights(prompt):
+    expected = sorted(weight_stacks(parse_prompt(prompt)))
+    ast = parse_prompt(prompt)
+    ast.reorder_tags(lambda tag: len(tag.core))
+    assert sorted(weight_stacks(parse_prompt(ast.serialize()))) == expected
+
+
+@pytest.mark.parametrize(
+    ("tag", "core"),
+    [
+        ("azuma seren (vtuber)", "azuma seren (vtuber)"),
+        ("{lingerie (sheer)}", "lingerie (sheer)"),
+        ("(masterpiece)", "masterpiece"),
+        ("({solo})", "solo"),
+        ("(a) (b)", "(a) (b)"),
+        ("1.2::blue hair", "blue hair"),
+        ("long hair::", "long hair"),
+    ],
+)
+def test_tag_core(tag, core):
+    assert tag_core(tag) == core
+
+
+def test_qualifier_parens_are_not_weight_groups():
+    ast = parse_prompt("1girl, azuma seren (vtuber), smile")
+    ast.filter_tags(lambda tag: tag.core == "azuma seren (vtuber)")
+    assert ast.serialize() == "1girl, smile"
+
+
+def test_parens_spanning_tags_still_move():
+    ast = parse_prompt("x, (lingerie (sheer), b)")
+    ast.filter_tags(lambda tag: tag.core == "lingerie (sheer)")
+    assert ast.serialize() == "x, (b)"
+
+
+def test_postprocess_chain_on_qualified_tags():
+    pytest.importorskip("src.common.logger")
+    from core.utils import prompt_postprocessor
+
+    assert (
+        prompt_postprocessor.remove_self_character_tags(
+            "1girl, azuma seren (vtuber), smile", remove_persona_appearance=True
+        )
+        == "1girl, smile"
+    )
+    assert prompt_postprocessor.sanitize_sfw_prompt("1girl, lingerie (sheer), smile") == "1girl, smile"
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+import pytest
+
+GOOD = '{"prompt": "1girl, solo, smile, outdoors", "aspect": "portrait"}'
+
+
+class FakeLLM:
+    def __init__(self):
+        self.calls = 0
+
+    async def generate(self, **kwargs):
+        self.calls += 1
+        return {"success": True, "response": GOOD}
+
+
+@pytest.fixture
+def generator(plugin_module, monkeypatch):
+    module = plugin_module("danbooru_generator")
+
+    async def _no_candidates(*args, **kwargs):
+        return ""
+
+    monkeypatch.setattr(module, "resolve_tag_candidates", _no_candidates)
+    module.reset_prompt_cache()
+    yield module
+    module.reset_prompt_cache()
+
+
+def _generate(generator, llm, user_request, chat_messages, **overrides):
+    kwargs = dict(
+        config={"llm": {"streaming_enabled": False}},
+        llm=llm,
+        model="test-model",
+        user_request=user_request,
+        chat_messages=chat_messages,
+        persona="",
+        selfie_mode=False,
+        nsfw_allowed=False,
+    )
+    kwargs.update(overrides)
+    return asyncio.run(generator.generate_danbooru_prompt(**kwargs))
+
+
+def test_repeat_request_with_new_chat_lines_hits_cache(generator):
+    llm = FakeLLM()
+    first = _generate(generator, llm, "画一个在户外微笑的女孩", "alice: 今天天气不错\nbob: 是啊")
+    again = _generate(
+        generator,
+        llm,
+        "  画一个在户外微笑的女孩 ",
+        "alice: 今天天气不错\nbob: 是啊\nalice: 画一个在户外微笑的女孩\nbot: [图片]",
+    )
+    assert first.success and again.success
+    assert again.prompt == first.prompt
+    assert llm.calls == 1
+
+
+def test_different_request_or_persona_misses_cache(generator):
+    llm = FakeLLM()
+    _generate(generator, llm, "画一个女孩", "")
+    _generate(generator, llm, "画一只猫", "")
+    _generate(generator, llm, "画一个女孩", "", persona="另一个人设")
+    assert llm.calls == 3
+
+
+def test_variety_request_skips_cache(generator):
+    llm = FakeLLM()
+    _generate(generator, llm, "画一个女孩", "")
+    _generate(generator, llm, "画一个女孩，换一张", "")
+    assert llm.calls == 2
+
+
+def test_chat_driven_request_keys_on_recent_chat(generator):
+    llm = FakeLLM()
+    history = "\n".join(f"user{i}: 第 {i} 句" for i in range(10))
+    _generate(generator, llm, "", history)
+    # 很早的聊天行变化不影响命中，最近几行变化则重新生成
+    _generate(generator, llm, "", "user0: 改过的第 0 句\n" + "\n".join(history.splitlines()[1:]))
+    assert llm.calls == 1
+    _generate(generator, llm, "", history + "\nuser10: 画个海边")
+    assert llm.calls == 2
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+import pytest
+
+from core.utils.prompt_stream_monitor import STREAM_ABORT, STREAM_COMPLETE, STREAM_CONTINUE, PromptStreamMonitor
+
+MARKERS = ("抱歉", "我无法", "i can't", "i cannot")
+
+
+def _feed(text, size):
+    """按 size 个字符一块喂给监视器，返回 (最后的判定, 监视器)。"""
+    monitor = PromptStreamMonitor(MARKERS)
+    verdict = STREAM_CONTINUE
+    for start in range(0, len(text), size):
+        verdict = monitor.feed(text[start : start + size])
+        if verdict != STREAM_CONTINUE:
+            break
+    return verdict, monitor
+
+
+@pytest.mark.parametrize("size", [1, 3, 7, 1000])
+def test_plain_tag_reply_is_read_to_the_end(size):
+    text = "{{masterpiece}}, 1girl, solo, {smile}, [[blurry]], outdoors"
+    verdict, monitor = _feed(text, size)
+    assert verdict == STREAM_CONTINUE
+    assert monitor.completed_text() is None
+    assert monitor.text == text
+
+
+@pytest.mark.parametrize("size", [1, 3, 7, 1000])
+def test_result_json_completes_at_its_closing_brace(size):
+    body = '{"global": ["{{masterpiece}}", "1girl"], "people": [], "aspect": "portrait"}'
+    verdict, monitor = _feed(f"好的，结果如下：\n{body}\n希望你喜欢！", size)
+    assert verdict == STREAM_COMPLETE
+    assert monitor.completed_text().endswith(body)
+
+
+@pytest.mark.parametrize("size", [1, 3, 7, 1000])
+def test_weight_braces_before_result_json_do_not_complete(size):
+    body = '{"prompt": "1girl, smile"}'
+    verdict, monitor = _feed("{{masterpiece}} 草稿，正式输出：" + body + " 闲聊", size)
+    assert verdict == STREAM_COMPLETE
+    assert monitor.completed_text().endswith(body)
+
+
+@pytest.mark.parametrize("size", [1, 3, 7, 1000])
+def test_refusal_words_inside_think_do_not_abort(size):
+    body = '{"prompt": "1girl, smile"}'
+    text = "<think>The user wants a girl. I can't include anything explicit, so {keep it sfw}.</think>\n" + body
+    verdict, monitor = _feed(text, size)
+    assert verdict == STREAM_COMPLETE
+    assert monitor.completed_text().endswith(body)
+
+
+@pytest.mark.parametrize("size", [1, 3, 1000])
+def test_refusal_before_json_aborts(size):
+    verdict, monitor = _feed("抱歉，我无法生成这个内容。", size)
+    assert verdict == STREAM_ABORT
+    assert "抱歉" in monitor.reason
+
+
+@pytest.mark.parametrize("size", [1, 3, 1000])
+def test_refusal_after_think_block_aborts(size):
+    verdict, _ = _feed("<think>考虑一下</think>I can't help with that.", size)
+    assert verdict == STREAM_ABORT
+
+
+def test_streamed_plain_tag_reply_keeps_all_tags(plugin_module):
+    generator = plugin_module("danbooru_generator")
+    text = "{{masterpiece}}, best quality, 1girl, solo, smile, outdoors"
+
+    class StreamingLLM:
+        async def generate_stream(self, **kwargs):
+            for start in range(0, len(text), 4):
+                yield text[start : start + 4]
+
+    result, aborted = asyncio.run(generator._stream_generate(StreamingLLM(), {"prompt": "p"}))
+    assert not aborted
+    assert result["response"] == text
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+
+@pytest.fixture
+def rate_limiter(plugin_module):
+    module = plugin_module("rate_limiter")
+    module.reset_rate_limiters()
+    yield module
+    module.reset_rate_limiters()
+
+
+@pytest.fixture
+def throttling_server():
+    """每个请求都回 429 + Retry-After: 300 的本机服务。"""
+    hits = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", "0")))
+            hits.append(time.monotonic())
+            body = json.dumps({"error": {"message": "rate limited"}}).encode()
+            self.send_response(429)
+            self.send_header("Retry-After", "300")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}", hits
+    server.shutdown()
+
+
+def test_wait_blocking_gives_up_before_deadline(rate_limiter):
+    limiter = rate_limiter.AdaptiveRateLimiter("test")
+    limiter.on_throttled(300.0)
+    queued = limiter.snapshot()["queued_seconds"]
+
+    started = time.monotonic()
+    assert limiter.wait_blocking(deadline=started + 0.2) is None
+    assert time.monotonic() - started < 0.1
+    # 放弃时不预约，队列不会因此再往后推
+    assert limiter.snapshot()["queued_seconds"] <= queued
+
+
+def test_acquire_gives_up_before_deadline(rate_limiter):
+    limiter = rate_limiter.AdaptiveRateLimiter("test")
+    limiter.on_throttled(300.0)
+    started = time.monotonic()
+    assert asyncio.run(limiter.acquire(deadline=started + 0.2)) is None
+    assert time.monotonic() - started < 0.1
+
+
+def test_wait_blocking_without_deadline_still_waits(rate_limiter):
+    limiter = rate_limiter.AdaptiveRateLimiter("test")
+    limiter.on_throttled(0.2)
+    assert limiter.wait_blocking() >= 0.15
+
+
+def test_throttled_retry_respects_hop_deadline(plugin_module, rate_limiter, throttling_server):
+    base = plugin_module("clients.base")
+    newapi_nai = plugin_module("clients.newapi_nai")
+    base_url, hits = throttling_server
+    client = newapi_nai.NewApiNaiClient(base_url, "sk-test")
+    limiter = rate_limiter.get_rate_limiter(base_url, "sk-test")
+    ctx = base.GenerationContext(
+        prompt="1girl", retry_attempts=3, proxy_mode="direct", deadline=time.monotonic() + 1.0
+    )
+
+    started = time.monotonic()
+    result = client._post({"model": ctx.model, "messages": []}, ctx, limiter)
+    assert time.monotonic() - started < 1.0
+    assert len(hits) == 1
+    assert "超过时间预算" in result["error"]["message"]
+
+
+def test_newapi_image_client_retry_respects_hop_deadline(plugin_module, rate_limiter, throttling_server):
+    image_clients = plugin_module("image_clients")
+    base_url, hits = throttling_server
+
+    started = time.monotonic()
+    success, error = image_clients.ImageClientMixin()._make_newapi_nai_request(
+        prompt="1girl",
+        base_url=base_url,
+        api_key="sk-test",
+        model="nai-diffusion-4-5-full",
+        params={"retry_attempts": 3, "proxy_mode": "direct"},
+        deadline=started + 1.0,
+    )
+    assert time.monotonic() - started < 1.0
+    assert not success
+    assert len(hits) == 1
+    assert "超过时间预算" in error
@@ -3,9 +3,10 @@
 """
 
 import base64
+import time
 import urllib.request
 import urllib.parse
-from typing import Any, Tuple
+from typing import Any, Optional, Tuple
 
 from src.common.logger import get_logger
 
@@ -94,6 +95,20 @@ def _looks_like_image_url(url: str) -> bool:
     return False
 
 
+def _timeout_until(deadline: Optional[float], timeout: float) -> float:
+    """单次阻塞请求可用的超时：不超过 deadline（time.monotonic() 时间点）前剩余的时间。
+
+    deadline 为 None 时原样返回 timeout；已过期时返回一个很小的值，让请求立即超时失败。
+    """
+    if deadline is None:
+        return float(timeout)
+    return max(0.1, min(float(timeout), deadline - time.monotonic()))
+
+
+def _deadline_passed(deadline: Optional[float]) -> bool:
+    return deadline is not None and time.monotonic() >= deadline
+
+
 def _probe_url_is_image(url: str, timeout: int = 20) -> bool:
     try:
         req = urllib.request.Request(
@@ -170,30 +185,83 @@ def _compress_image_if_needed(image_base64: str) -> str:
         return image_base64
 
 
-def _resize_image_for_edit(image_base64: str, max_pixels: int = 4_000_000) -> str:
+# 缩图模式：
+# - fast：JPEG 先按 DCT 缩放解码（draft，最多 1/8），再用 reduce() 整数倍缩小，最后 LANCZOS 到目标尺寸
+# - quality：同上，但 draft 留 1.5 倍、reduce 留 3 倍余量，最终 LANCZOS 的信息量接近原图
+# - exact：完整解码后直接 LANCZOS（旧行为）
+RESIZE_FAST = "fast"
+RESIZE_QUALITY = "quality"
+RESIZE_EXACT = "exact"
+RESIZE_MODES = (RESIZE_FAST, RESIZE_QUALITY, RESIZE_EXACT)
+
+# draft 请求尺寸相对目标的倍数、resize 的 reducing_gap（越小越快、越糙）
+_DRAFT_HEADROOM = {RESIZE_FAST: 1.0, RESIZE_QUALITY: 1.5}
+_REDUCING_GAP = {RESIZE_FAST: 2.0, RESIZE_QUALITY: 3.0}
+
+
+def _open_for_downscale(image_bytes: bytes, target_size: Any, mode: str = RESIZE_FAST) -> Any:
+    """打开图片并按目标尺寸决定解码规模，返回已 load() 的 Image。
+
+    target_size 为 (w, h) 或 callable(原始 w, h) -> (w, h)（目标依赖原图尺寸时）。
+    JPEG 在 fast/quality 模式下用 draft() 只解码到不小于目标（含余量）的最小 1/2^n 尺寸，
+    12MP 照片缩到 1024 时解码量和内存都只有原来的几十分之一。img.info["original_size"] 记录原图尺寸。
+    """
+    from io import BytesIO
+
+    from PIL import Image, ImageFile
+
+    ImageFile.LOAD_TRUNCATED_IMAGES = True
+
+    img = Image.open(BytesIO(image_bytes))
+    original_size = img.size
+    target = target_size(*original_size) if callable(target_size) else target_size
+    headroom = _DRAFT_HEADROOM.get(mode)
+    if headroom and target and img.format == "JPEG":
+        tw, th = target
+        draft_size = (int(tw * headroom), int(th * headroom))
+        if draft_size[0] < original_size[0] and draft_size[1] < original_size[1]:
+            img.draft(img.mode, draft_size)
+    img.load()
+    img.info["original_size"] = original_size
+    return img
+
+
+def _downscale(img: Any, size: tuple[int, int], mode: str = RESIZE_FAST) -> Any:
+    """缩放到 size：fast/quality 先 reduce() 整数倍缩小再 LANCZOS，exact 直接 LANCZOS。"""
+    from PIL import Image
+
+    if img.size == size:
+        return img
+    return img.resize(size, Image.LANCZOS, reducing_gap=_REDUCING_GAP.get(mode))
+
+
+def _resize_image_for_edit(image_base64: str, max_pixels: int = 4_000_000, mode: str = RESIZE_QUALITY) -> str:
     """缩放图片使总像素不超过限制，避免 API 拒绝过大图片。
 
     Args:
         image_base64: 原始 base64 图片数据
         max_pixels: 最大像素数（默认 4MP，适合大多数图片编辑 API）
+        mode: 缩图模式（fast / quality / exact）
 
     Returns:
         str: 处理后的 base64 图片数据（JPEG 格式）
     """
+
+    def target(w: int, h: int) -> Optional[tuple[int, int]]:
+        if w * h <= max_pixels:
+            return None
+        scale = (max_pixels / (w * h)) ** 0.5
+        return int(w * scale), int(h * scale)
+
     try:
         from io import BytesIO
-        from PIL import Image, ImageFile
-
-        ImageFile.LOAD_TRUNCATED_IMAGES = True
 
         image_bytes = base64.b64decode(image_base64)
-        img = Image.open(BytesIO(image_bytes))
-        img.load()
+        img = _open_for_downscale(image_bytes, target, mode)
+        w, h = img.info["original_size"]
+        new_size = target(w, h)
 
-        w, h = img.size
-        total_pixels = w * h
-
-        if total_pixels <= max_pixels:
+        if new_size is None:
             # 不需要缩放，但统一转为 JPEG 减小体积
             if img.mode in ("RGBA", "P"):
                 img = img.convert("RGB")
@@ -202,10 +270,8 @@ def _resize_image_for_edit(image_base64: str, max_pixels: int = 4_000_000) -> st
             return base64.b64encode(buf.getvalue()).decode("utf-8")
 
         # 等比缩放
-        scale = (max_pixels / total_pixels) ** 0.5
-        new_w = int(w * scale)
-        new_h = int(h * scale)
-        img = img.resize((new_w, new_h), Image.LANCZOS)
+        new_w, new_h = new_size
+        img = _downscale(img, new_size, mode)
         if img.mode in ("RGBA", "P"):
             img = img.convert("RGB")
         buf = BytesIO()
@@ -221,37 +287,35 @@ def _resize_image_for_edit(image_base64: str, max_pixels: int = 4_000_000) -> st
         return image_base64
 
 
-def _resize_image_for_wd14(image_base64: str, max_edge: int = 1024) -> str:
+def _resize_image_for_wd14(image_base64: str, max_edge: int = 1024, mode: str = RESIZE_FAST) -> str:
     """WD14 反推前缩图：最长边不超过 max_edge，减小 Modal 请求体积与耗时。"""
     try:
         max_edge = max(256, min(int(max_edge or 1024), 4096))
     except (TypeError, ValueError):
         max_edge = 1024
 
+    def target(w: int, h: int) -> Optional[tuple[int, int]]:
+        longest = max(w, h)
+        if longest <= max_edge:
+            return None
+        scale = max_edge / float(longest)
+        return max(1, int(w * scale)), max(1, int(h * scale))
+
     try:
         from io import BytesIO
 
-        from PIL import Image, ImageFile
-
-        ImageFile.LOAD_TRUNCATED_IMAGES = True
-
         image_bytes = base64.b64decode(image_base64)
-        img = Image.open(BytesIO(image_bytes))
-        img.load()
-
-        w, h = img.size
-        longest = max(w, h)
-        if longest > max_edge:
-            scale = max_edge / float(longest)
-            new_w = max(1, int(w * scale))
-            new_h = max(1, int(h * scale))
-            img = img.resize((new_w, new_h), Image.LANCZOS)
+        img = _open_for_downscale(image_bytes, target, mode)
+        w, h = img.info["original_size"]
+        new_size = target(w, h)
+        if new_size is not None:
+            img = _downscale(img, new_size, mode)
             logger.info(
                 "[LLM2pic] WD14 缩图: %sx%s -> %sx%s (max_edge=%s)",
                 w,
                 h,
-                new_w,
-                new_h,
+                new_size[0],
+                new_size[1],
                 max_edge,
             )
         if img.mode in ("RGBA", "P"):
@@ -268,6 +332,137 @@ def _resize_image_for_wd14(image_base64: str, max_edge: int = 1024) -> str:
         return image_base64
 
 
+def _resize_image_for_nai(image_base64: str, target_size: tuple[int, int], mode: str = RESIZE_QUALITY) -> str:
+    """将图片 resize 到 NAI 要求的精确尺寸，返回 data URI。
+
+    Returns:
+        data URI 字符串，或空字符串（图片太小/损坏时）。
+    """
+    from io import BytesIO
+
+    from .image_probe import probe_image
+
+    # 只读文件头判断尺寸，太小的图不必解码；无法识别的格式交给 Pillow 判断
+    probe = probe_image(image_base64)
+    if probe is not None and probe.min_side < 256:
+        return ""
+
+    try:
+        img = _open_for_downscale(base64.b64decode(image_base64), target_size, mode)
+    except Exception:
+        return ""
+
+    min_side = min(img.info["original_size"])
+    if min_side < 256:
+        return ""
+
+    img = _downscale(img, target_size, mode)
+
+    buf = BytesIO()
+    img.save(buf, format="PNG")
+    b64 = base64.b64encode(buf.getvalue()).decode("ascii")
+    return f"data:image/png;base64,{b64}"
+
+
+def _crop_image_bytes(image_bytes: bytes, crop_position: str, crop_pixels: int) -> bytes:
+    """从指定边裁掉 crop_pixels 像素，保持原格式；无需裁切或裁不了时原样返回。"""
+    from io import BytesIO
+
+    from PIL import Image
+
+    img = Image.open(BytesIO(image_bytes))
+    width, height = img.size
+    if crop_position == "bottom":
+        if crop_pixels >= height:
+            return image_bytes
+        crop_box = (0, 0, width, height - crop_pixels)
+    elif crop_position == "top":
+        if crop_pixels >= height:
+            return image_bytes
+        crop_box = (0, crop_pixels, width, height)
+    elif crop_position == "left":
+        if crop_pixels >= width:
+            return image_bytes
+        crop_box = (crop_pixels, 0, width, height)
+    elif crop_position == "right":
+        if crop_pixels >= width:
+            return image_bytes
+        crop_box = (0, 0, width - crop_pixels, height)
+    else:
+        return image_bytes
+
+    cropped_img = img.crop(crop_box)
+    output = BytesIO()
+    cropped_img.save(output, format=img.format or "PNG")
+    return output.getvalue()
+
+
+def _crop_image_base64(image_base64: str, crop_position: str, crop_pixels: int) -> str:
+    """_crop_image_bytes 的 base64 版本，供进程池直接处理 base64 结果。"""
+    image_bytes = base64.b64decode(image_base64)
+    return base64.b64encode(_crop_image_bytes(image_bytes, crop_position, crop_pixels)).decode("utf-8")
+
+
+def _encode_image_for_send(
+    image_base64: str,
+    output_format: str,
+    target_bytes: int = 0,
+    quality: int = 90,
+    min_quality: int = 40,
+) -> tuple[str, int]:
+    """把待发送的图片转成 JPEG/WebP，返回 (base64, 实际使用的 quality)。
+
+    target_bytes > 0 时在 [min_quality, quality] 内二分查找不超过目标体积的最高 quality，
+    最低 quality 仍超标时用最低 quality；原图本身已不超过目标、或转码后反而更大时原样返回（quality 为 0）。
+    """
+    from io import BytesIO
+
+    from PIL import Image, ImageFile
+
+    ImageFile.LOAD_TRUNCATED_IMAGES = True
+
+    fmt = "WEBP" if output_format == "webp" else "JPEG"
+    original_size = len(image_base64) * 3 // 4
+    if target_bytes > 0 and original_size <= target_bytes:
+        return image_base64, 0
+
+    img = Image.open(BytesIO(base64.b64decode(image_base64)))
+    img.load()
+    if fmt == "JPEG" and img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    elif fmt == "WEBP" and img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGBA" if "transparency" in img.info else "RGB")
+
+    def encode(q: int) -> bytes:
+        buf = BytesIO()
+        if fmt == "JPEG":
+            img.save(buf, format="JPEG", quality=q, optimize=True, progressive=True)
+        else:
+            img.save(buf, format="WEBP", quality=q, method=2)
+        return buf.getvalue()
+
+    quality = max(1, min(int(quality), 100))
+    best_quality = quality
+    best = encode(quality)
+    if target_bytes > 0 and len(best) > target_bytes:
+        low, high = max(1, min(int(min_quality), quality)), quality - 1
+        best_quality, best = low, None
+        while low <= high:
+            mid = (low + high) // 2
+            data = encode(mid)
+            if len(data) <= target_bytes:
+                best_quality, best = mid, data
+                low = mid + 1
+            else:
+                high = mid - 1
+        if best is None:
+            best = encode(best_quality)
+
+    if len(best) >= original_size:
+        return image_base64, 0
+    return base64.b64encode(best).decode("utf-8"), best_quality
+
+
 def _peel_envelope(payload: Any) -> Any:
     """剥离 SDK/Runner 常见的 result/data 包装层。"""
     current = payload
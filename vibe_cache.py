@@ -28,8 +28,8 @@ logger = get_logger("MaiBot_LLM2pic")
 _CACHE_TTL_SECONDS = 7 * 24 * 3600
 
 
-def _get_db_path() -> Path:
-    """获取插件 data 目录下的 vibe_cache.db 路径。"""
+def _get_db_dir() -> Path:
+    """获取插件 data 目录（本地 SQLite 缓存共用）。"""
     # MaiBot 插件 data 目录约定
     base = Path(os.environ.get("MAIBOT_DATA_DIR", ""))
     if not base:
@@ -37,7 +37,12 @@ def _get_db_path() -> Path:
         base = Path(__file__).resolve().parent.parent / "data"
     db_dir = base / "plugins" / "chartyr.maibot-llm2pic"
     db_dir.mkdir(parents=True, exist_ok=True)
-    return db_dir / "vibe_cache.db"
+    return db_dir
+
+
+def _get_db_path() -> Path:
+    """获取插件 data 目录下的 vibe_cache.db 路径。"""
+    return _get_db_dir() / "vibe_cache.db"
 
 
 def _quantize_info_extracted(value: float) -> float:
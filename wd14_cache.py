@@ -0,0 +1,265 @@
+"""
+WD14 反推结果的分层缓存。
+
+- 内存层：进程内 LRU，命中时不碰磁盘
+- 磁盘层：SQLite（与 vibe_cache 同目录），重启后仍有效，同机多个 MaiBot 进程共享（WAL 模式）
+- key：(图片摘要, 阈值量化到 0.01, endpoint)。不同 tagger 模型结果不同，endpoint 也算进 key
+- 两层共用一个 TTL；磁盘层按总字节数淘汰，超限时删最久未用的条目直到降到上限的 90%
+
+内存层存 WD14Result 本身（general tag 为数组紧凑形式，命中时也不必重新解析），磁盘层存 JSON。
+只有成功结果进入两层缓存。确定性失败（4xx、反推结果为空）另记一份仅内存的短 TTL 负缓存，
+期间引用同一张坏图的请求直接失败，不再逐个重试。磁盘读写在线程中进行，不阻塞事件循环。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Optional
+
+from src.common.logger import get_logger
+
+from . import metrics
+from .vibe_cache import _get_db_dir
+
+if TYPE_CHECKING:
+    from .wd14_client import WD14Result
+
+logger = get_logger("MaiBot_LLM2pic")
+
+_DB_FILENAME = "wd14_cache.db"
+# 磁盘层淘汰后保留的比例，避免每次写入都触发淘汰
+_EVICT_TARGET_RATIO = 0.9
+
+
+def wd14_cache_key(image_base64: str, threshold: float, endpoint: str) -> str:
+    """缓存 key：图片摘要 + 量化阈值 + endpoint。直接对 base64 文本取摘要，不必先解码。"""
+    digest = hashlib.sha256(image_base64.encode("ascii", "ignore")).hexdigest()
+    return f"{digest}:{round(float(threshold), 2):.2f}:{endpoint.rstrip('/')}"
+
+
+class Wd14Cache:
+    """内存 LRU + SQLite 两层缓存，值为 WD14Result。"""
+
+    def __init__(
+        self,
+        *,
+        memory_entries: int = 64,
+        ttl_seconds: float = 7 * 24 * 3600,
+        disk_enabled: bool = True,
+        disk_max_bytes: int = 32 * 1024 * 1024,
+        negative_ttl_seconds: float = 300.0,
+        db_path: Optional[Path] = None,
+    ) -> None:
+        self.memory_entries = max(1, int(memory_entries))
+        self.ttl_seconds = max(1.0, float(ttl_seconds))
+        self.disk_max_bytes = max(0, int(disk_max_bytes))
+        self.negative_ttl_seconds = max(0.0, float(negative_ttl_seconds))
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, tuple[WD14Result, float]]" = OrderedDict()
+        self._negative: "OrderedDict[str, tuple[str, float]]" = OrderedDict()
+        self._db_path: Optional[Path] = None
+        if disk_enabled and self.disk_max_bytes > 0:
+            try:
+                self._db_path = db_path or _get_db_dir() / _DB_FILENAME
+                self._init_db()
+            except (OSError, sqlite3.Error) as exc:
+                logger.warning(f"[WD14Cache] 磁盘缓存不可用，仅使用内存缓存: {exc}")
+                self._db_path = None
+
+    @property
+    def disk_enabled(self) -> bool:
+        return self._db_path is not None
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(str(self._db_path), timeout=5.0)
+
+    def _init_db(self) -> None:
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS wd14_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    raw TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_wd14_last_used ON wd14_cache(last_used)")
+            conn.commit()
+        finally:
+            conn.close()
+
+    # ── 内存层 ──
+
+    def _memory_get(self, key: str) -> Optional["WD14Result"]:
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            result, created_at = entry
+            if time.time() - created_at > self.ttl_seconds:
+                self._memory.pop(key, None)
+                return None
+            self._memory.move_to_end(key)
+            return result
+
+    def _memory_set(self, key: str, result: "WD14Result", created_at: float) -> None:
+        with self._lock:
+            self._memory[key] = (result, created_at)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    # ── 负缓存（仅内存）──
+
+    def failure_reason(self, key: str) -> Optional[str]:
+        """该 key 在负缓存有效期内记录过的确定性失败原因，没有则返回 None。"""
+        with self._lock:
+            entry = self._negative.get(key)
+            if entry is None:
+                return None
+            reason, created_at = entry
+            if time.monotonic() - created_at > self.negative_ttl_seconds:
+                self._negative.pop(key, None)
+                return None
+            return reason
+
+    def remember_failure(self, key: str, reason: str) -> None:
+        if self.negative_ttl_seconds <= 0:
+            return
+        with self._lock:
+            self._negative[key] = (reason, time.monotonic())
+            self._negative.move_to_end(key)
+            while len(self._negative) > self.memory_entries:
+                self._negative.popitem(last=False)
+
+    # ── 磁盘层（同步，在线程中调用）──
+
+    def _disk_get(self, key: str) -> Optional[tuple[dict[str, Any], float]]:
+        now = time.time()
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT raw, created_at FROM wd14_cache WHERE cache_key=?", (key,)).fetchone()
+            if row is None:
+                return None
+            raw_text, created_at = row
+            if now - created_at > self.ttl_seconds:
+                conn.execute("DELETE FROM wd14_cache WHERE cache_key=?", (key,))
+                conn.commit()
+                return None
+            conn.execute("UPDATE wd14_cache SET last_used=? WHERE cache_key=?", (now, key))
+            conn.commit()
+        finally:
+            conn.close()
+        return json.loads(raw_text), created_at
+
+    def _disk_set(self, key: str, raw: dict[str, Any], created_at: float) -> int:
+        """写入并按总大小淘汰，返回淘汰条数。"""
+        raw_text = json.dumps(raw, ensure_ascii=False, separators=(",", ":"))
+        size = len(raw_text.encode("utf-8"))
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO wd14_cache (cache_key, raw, size, created_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, raw_text, size, created_at, created_at),
+            )
+            evicted = self._evict(conn)
+            conn.commit()
+        finally:
+            conn.close()
+        return evicted
+
+    def _evict(self, conn: sqlite3.Connection) -> int:
+        evicted = conn.execute("DELETE FROM wd14_cache WHERE created_at < ?", (time.time() - self.ttl_seconds,)).rowcount
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM wd14_cache").fetchone()[0]
+        if total <= self.disk_max_bytes:
+            return evicted
+        excess = total - int(self.disk_max_bytes * _EVICT_TARGET_RATIO)
+        freed = 0
+        victims: list[str] = []
+        for cache_key, size in conn.execute("SELECT cache_key, size FROM wd14_cache ORDER BY last_used"):
+            if freed >= excess:
+                break
+            victims.append(cache_key)
+            freed += size
+        conn.executemany("DELETE FROM wd14_cache WHERE cache_key=?", [(cache_key,) for cache_key in victims])
+        return evicted + len(victims)
+
+    # ── 对外接口 ──
+
+    async def get(self, key: str) -> Optional["WD14Result"]:
+        result = self._memory_get(key)
+        if result is not None:
+            metrics.incr("wd14.cache.hit.memory")
+            return result
+        if self.disk_enabled:
+            try:
+                found = await asyncio.to_thread(self._disk_get, key)
+            except (sqlite3.Error, ValueError) as exc:
+                logger.warning(f"[WD14Cache] 读取磁盘缓存失败: {exc}")
+                found = None
+            if found is not None:
+                from .wd14_client import WD14Result
+
+                raw, created_at = found
+                result = WD14Result(raw)
+                self._memory_set(key, result, created_at)
+                metrics.incr("wd14.cache.hit.disk")
+                return result
+        metrics.incr("wd14.cache.miss")
+        return None
+
+    async def set(self, key: str, result: "WD14Result") -> None:
+        created_at = time.time()
+        self._memory_set(key, result, created_at)
+        if not self.disk_enabled:
+            return
+        try:
+            evicted = await asyncio.to_thread(self._disk_set, key, result.to_raw(), created_at)
+        except sqlite3.Error as exc:
+            logger.warning(f"[WD14Cache] 写入磁盘缓存失败: {exc}")
+            return
+        if evicted:
+            metrics.incr("wd14.cache.evicted", evicted)
+            logger.info(f"[WD14Cache] 淘汰 {evicted} 条磁盘缓存")
+
+
+_cache: Optional[Wd14Cache] = None
+_cache_settings: Optional[tuple[Any, ...]] = None
+
+
+def get_wd14_cache(
+    memory_entries: int = 64,
+    ttl_seconds: float = 7 * 24 * 3600,
+    disk_enabled: bool = True,
+    disk_max_bytes: int = 32 * 1024 * 1024,
+    negative_ttl_seconds: float = 300.0,
+) -> Wd14Cache:
+    """取共享缓存；参数变化（配置更新）时按新参数重建，磁盘内容保留。"""
+    global _cache, _cache_settings
+    settings = (memory_entries, ttl_seconds, disk_enabled, disk_max_bytes, negative_ttl_seconds)
+    if _cache is None or settings != _cache_settings:
+        _cache = Wd14Cache(
+            memory_entries=memory_entries,
+            ttl_seconds=ttl_seconds,
+            disk_enabled=disk_enabled,
+            disk_max_bytes=disk_max_bytes,
+            negative_ttl_seconds=negative_ttl_seconds,
+        )
+        _cache_settings = settings
+    return _cache
+
+
+def reset_wd14_cache() -> None:
+    global _cache, _cache_settings
+    _cache = None
+    _cache_settings = None
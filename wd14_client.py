@@ -4,82 +4,155 @@ Calls a Modal-hosted WD14 tagger endpoint to extract Danbooru tags
 from an image (base64). Used to support "引用图片 → 反推 tag → 融合用户文字 → 出图" workflow.
 """
 
+from abc import ABC, abstractmethod
+from bisect import bisect_right
 from typing import Any, Optional
 import asyncio
-import base64
-import hashlib
+import binascii
+import itertools
 import json
+import operator
+import threading
 import time
-import urllib.request
 import urllib.error
-from collections import OrderedDict
+import urllib.parse
+import urllib.request
+import uuid
 
 from src.common.logger import get_logger
 
+from . import metrics
+from .wd14_cache import Wd14Cache, get_wd14_cache, wd14_cache_key
+
 logger = get_logger("MaiBot_LLM2pic")
 
-DEFAULT_ENDPOINT = "https://seckchiho--wd14-tagger-web-tag.modal.run"
+# numpy is optional: with it, general tags are parsed / sorted / bucketed as arrays;
+# without it WD14Result keeps the same data in plain lists (same output, slower on big results).
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - depends on the host environment
+    np = None
 
-# ---- LRU cache for WD14 results ----
-_WD14_CACHE: "OrderedDict[str, tuple[Optional['WD14Result'], float]]" = OrderedDict()
-_WD14_CACHE_MAX = 20
-_WD14_CACHE_TTL = 600.0  # 10 minutes
+DEFAULT_ENDPOINT = "https://seckchiho--wd14-tagger-web-tag.modal.run"
 
+class _TagTable:
+    """Process-wide tag-name table shared by all results; results store int ids into it
+    (an int32 array with numpy, a list without).
 
-def _image_hash(image_base64: str) -> str:
-    try:
-        raw = base64.b64decode(image_base64, validate=False)
-        return hashlib.md5(raw).hexdigest()
-    except Exception:
-        return hashlib.md5(image_base64.encode()).hexdigest()
+    The WD14 vocabulary is fixed per model (~10k tags), so the table stays bounded.
+    """
 
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._ids: dict[str, int] = {}
+        self.names: list[str] = []
 
-def _wd14_cache_get(h: str) -> Optional["WD14Result"]:
-    entry = _WD14_CACHE.get(h)
-    if entry is None:
-        return None
-    result, ts = entry
-    if time.time() - ts > _WD14_CACHE_TTL:
-        _WD14_CACHE.pop(h, None)
-        return None
-    _WD14_CACHE.move_to_end(h)
-    return result
+    def intern(self, names: list[str]) -> Any:
+        ids = self._ids
+        try:
+            # 常见情况：词表早已收录全部 tag，不必加锁
+            if np is None:
+                return list(map(ids.__getitem__, names))
+            return np.fromiter(map(ids.__getitem__, names), dtype=np.int32, count=len(names))
+        except KeyError:
+            pass
+        with self._lock:
+            setdefault = ids.setdefault
+            interned = [setdefault(name, len(ids)) for name in names]
+            if len(ids) > len(self.names):
+                self.names.extend(itertools.islice(ids, len(self.names), None))
+        if np is None:
+            return interned
+        return np.fromiter(interned, dtype=np.int32, count=len(names))
+
+    def lookup(self, ids: Any) -> list[str]:
+        names = self.names
+        return [names[i] for i in (ids.tolist() if np is not None else ids)]
+
+
+_TAGS = _TagTable()
+
+# format_for_llm 的置信度分档（高 / 中 / 低）
+_HIGH_CONFIDENCE = 0.6
+_MID_CONFIDENCE = 0.35
+
+
+def _score_dict(value: Any) -> dict[str, float]:
+    if not isinstance(value, dict):
+        return {}
+    return {k: float(v) for k, v in value.items() if isinstance(v, (int, float))}
+
+
+def _sorted_scores(names: list[str], scores: list[Any]) -> tuple[Any, Any]:
+    """(tag ids, confidences) sorted by confidence descending (stable); non-numeric scores are dropped."""
+    if np is not None:
+        conf = np.asarray(scores)
+        # 只收 int/float（bool 按 int 处理，与 _score_dict 一致）；"0.5" 这类字符串会让 dtype 变成 U/O，走逐个筛选
+        if conf.ndim == 1 and conf.dtype.kind in "biuf":
+            conf = conf.astype(np.float64, copy=False)
+        else:
+            kept = [(n, float(v)) for n, v in zip(names, scores) if isinstance(v, (int, float))]
+            names, conf = [n for n, _ in kept], np.asarray([v for _, v in kept], dtype=np.float64)
+        order = np.argsort(-conf, kind="stable")
+        return _TAGS.intern(names)[order], conf[order]
+
+    kept = sorted(
+        ((n, float(v)) for n, v in zip(names, scores) if isinstance(v, (int, float))),
+        key=operator.itemgetter(1),
+        reverse=True,
+    )
+    return _TAGS.intern([n for n, _ in kept]), [v for _, v in kept]
 
 
-def _wd14_cache_set(h: str, result: Optional["WD14Result"]) -> None:
-    _WD14_CACHE[h] = (result, time.time())
-    _WD14_CACHE.move_to_end(h)
-    while len(_WD14_CACHE) > _WD14_CACHE_MAX:
-        _WD14_CACHE.popitem(last=False)
+class WD14Result:
+    """Parsed WD14 reverse-tag result.
 
+    General tags are held as two parallel sequences (tag ids into the shared _TagTable and
+    float confidences; numpy arrays when numpy is installed, lists otherwise), sorted by
+    confidence descending once at parse time; bucketing and threshold filtering are
+    binary searches + slices over them. character / rating are a handful of entries and
+    stay plain dicts.
+    """
 
-class WD14Result:
-    """Parsed WD14 reverse-tag result."""
+    __slots__ = ("prompt", "_general_ids", "_general_conf", "character", "rating")
 
     def __init__(self, raw: dict[str, Any]):
-        self.raw = raw
         self.prompt: str = str(raw.get("prompt") or "").strip()
-        self.general: dict[str, float] = {}
         general_raw = raw.get("general")
-        if isinstance(general_raw, dict):
-            self.general = {k: float(v) for k, v in general_raw.items() if isinstance(v, (int, float))}
-        elif isinstance(general_raw, list):
-            for item in general_raw:
-                if isinstance(item, (list, tuple)) and len(item) >= 2:
-                    self.general[str(item[0])] = float(item[1])
-        self.character: dict[str, float] = {}
-        char_raw = raw.get("character")
-        if isinstance(char_raw, dict):
-            self.character = {k: float(v) for k, v in char_raw.items() if isinstance(v, (int, float))}
-        self.rating: dict[str, float] = {}
-        rating_raw = raw.get("rating")
-        if isinstance(rating_raw, dict):
-            self.rating = {k: float(v) for k, v in rating_raw.items() if isinstance(v, (int, float))}
+        if isinstance(general_raw, list):
+            general_raw = {str(item[0]): item[1] for item in general_raw if isinstance(item, (list, tuple)) and len(item) >= 2}
+        if not isinstance(general_raw, dict):
+            general_raw = {}
+        self._general_ids, self._general_conf = _sorted_scores(list(general_raw.keys()), list(general_raw.values()))
+        self.character: dict[str, float] = _score_dict(raw.get("character"))
+        self.rating: dict[str, float] = _score_dict(raw.get("rating"))
 
     @property
     def success(self) -> bool:
         return bool(self.prompt)
 
+    @property
+    def general(self) -> dict[str, float]:
+        """General tags as {tag: confidence}, highest confidence first."""
+        return dict(zip(_TAGS.lookup(self._general_ids), self._scores()))
+
+    @property
+    def general_count(self) -> int:
+        return len(self._general_ids)
+
+    def _scores(self) -> list[float]:
+        return self._general_conf.tolist() if np is not None else self._general_conf
+
+    def _count_at_least(self, threshold: float) -> int:
+        """Number of general tags with confidence >= threshold (confidences are sorted descending)."""
+        if np is not None:
+            return int(np.searchsorted(-self._general_conf, -threshold, side="right"))
+        return bisect_right(self._general_conf, -threshold, key=operator.neg)
+
+    def to_raw(self) -> dict[str, Any]:
+        """Endpoint-shaped dict (for the disk cache)."""
+        return {"prompt": self.prompt, "general": self.general, "character": self.character, "rating": self.rating}
+
     def filtered_tags(self, threshold: float = 0.35, exclude_categories: tuple[str, ...] = ("rating",)) -> str:
         """Return a comma-separated tag string filtered by confidence threshold."""
         parts: list[str] = []
@@ -88,11 +161,8 @@ class WD14Result:
                 tag = tag.strip()
                 if tag:
                     parts.append(tag)
-        if not parts and self.general:
-            parts = [
-                tag for tag, conf in sorted(self.general.items(), key=lambda x: -x[1])
-                if conf >= threshold
-            ]
+        if not parts and self.general_count:
+            parts = _TAGS.lookup(self._general_ids[: self._count_at_least(threshold)])
         return ", ".join(parts)
 
     def format_for_llm(self) -> str:
@@ -101,29 +171,31 @@ class WD14Result:
         Groups general tags by confidence bucket, lists known characters and rating.
         Omit sections that have no data. Return empty string when general is empty.
         """
-        if not self.general:
+        if not self.general_count:
             return ""
 
-        sorted_general = sorted(self.general.items(), key=lambda x: -x[1])
+        # confidences are sorted descending, so the buckets are two cut points
+        high_end, mid_end = self._count_at_least(_HIGH_CONFIDENCE), self._count_at_least(_MID_CONFIDENCE)
+        names = _TAGS.lookup(self._general_ids)
+        scores = self._scores()
 
-        high_tags = [(tag, conf) for tag, conf in sorted_general if conf >= 0.6]
-        mid_tags = [(tag, conf) for tag, conf in sorted_general if 0.35 <= conf < 0.6]
-        low_tags = [(tag, conf) for tag, conf in sorted_general if conf < 0.35]
+        def _fmt_range(start: int, end: int) -> str:
+            return ", ".join(f"{names[i]} ({scores[i]:.2f})" for i in range(start, end))
 
         def _fmt(items: list[tuple[str, float]]) -> str:
             return ", ".join(f"{tag} ({conf:.2f})" for tag, conf in items)
 
         lines: list[str] = ["## 参考图 WD14 反推结果"]
 
-        if high_tags:
+        if high_end:
             lines.append("")
             lines.append("### 高置信度 tag（confidence ≥ 0.6）")
-            lines.append(_fmt(high_tags))
+            lines.append(_fmt_range(0, high_end))
 
-        if mid_tags:
+        if mid_end > high_end:
             lines.append("")
             lines.append("### 中置信度 tag（0.35 ≤ confidence < 0.6）")
-            lines.append(_fmt(mid_tags))
+            lines.append(_fmt_range(high_end, mid_end))
 
         if self.character:
             char_items = sorted(self.character.items(), key=lambda x: -x[1])
@@ -137,28 +209,189 @@ class WD14Result:
             lines.append("### 安全等级")
             lines.append(f"{top_rating[0]} ({top_rating[1]:.2f})")
 
-        if low_tags:
+        if len(names) > mid_end:
             lines.append("")
             lines.append("### 低置信度 tag（confidence < 0.35，参考用，不建议直接使用）")
-            lines.append(_fmt(low_tags))
+            lines.append(_fmt_range(mid_end, len(names)))
 
         return "\n".join(lines).strip()
 
 
-def _call_wd14_endpoint(image_base64: str, endpoint: str, threshold: float, timeout: float) -> dict[str, Any]:
-    """Synchronous HTTP POST to the WD14 tagger endpoint."""
-    payload = json.dumps({
-        "image_base64": image_base64,
-        "general_threshold": threshold,
-    }).encode()
-    req = urllib.request.Request(
-        endpoint,
-        data=payload,
-        headers={"Content-Type": "application/json"},
-        method="POST",
-    )
+class Wd14InputError(ValueError):
+    """The backend rejected this particular image (undecodable etc.); retrying will not help."""
+
+
+class Wd14BackendError(RuntimeError):
+    """The backend itself is unusable (model missing, runtime not installed); not image specific."""
+
+
+# 传输方式：json 为 base64-in-JSON（旧行为，所有 endpoint 都支持）；
+# octet-stream / multipart 直接上传 JPEG 字节，体积少 1/3，两端也不必构造/解析整段大 JSON。
+# auto 先试 octet-stream，endpoint 不认（报错或没返回 tag）时退回 json。默认 json。
+TRANSPORT_AUTO = "auto"
+TRANSPORT_JSON = "json"
+TRANSPORT_OCTET_STREAM = "octet-stream"
+TRANSPORT_MULTIPART = "multipart"
+TRANSPORTS = (TRANSPORT_AUTO, TRANSPORT_JSON, TRANSPORT_OCTET_STREAM, TRANSPORT_MULTIPART)
+
+# 协商期间这些状态码更像是“暂时不可用”而不是“不认二进制上传”，不退回 json
+_TRANSIENT_STATUS = (408, 429, 502, 503, 504)
+
+# endpoint -> 已确认可用的传输方式（进程内；二进制被拒后记为 json，不再每次试探）
+_negotiated: dict[str, str] = {}
+_negotiated_lock = threading.Lock()
+
+
+def _decode_image(image_base64: str) -> bytes:
+    start = image_base64.find(",", 0, 256) + 1 if image_base64.startswith("data:") else 0
+    try:
+        return binascii.a2b_base64(image_base64[start:] if start else image_base64)
+    except binascii.Error as exc:
+        raise Wd14InputError(f"invalid base64 image: {exc}") from exc
+
+
+def _build_request(image_base64: str, endpoint: str, threshold: float, transport: str) -> urllib.request.Request:
+    if transport == TRANSPORT_JSON:
+        body = json.dumps({
+            "image_base64": image_base64,
+            "general_threshold": threshold,
+        }).encode()
+        return urllib.request.Request(endpoint, data=body, headers={"Content-Type": "application/json"}, method="POST")
+
+    image = _decode_image(image_base64)
+    if transport == TRANSPORT_MULTIPART:
+        boundary = uuid.uuid4().hex
+        body = b"".join((
+            f'--{boundary}\r\nContent-Disposition: form-data; name="general_threshold"\r\n\r\n{threshold}\r\n'.encode(),
+            f'--{boundary}\r\nContent-Disposition: form-data; name="image"; filename="image"\r\n'
+            f"Content-Type: application/octet-stream\r\n\r\n".encode(),
+            image,
+            f"\r\n--{boundary}--\r\n".encode(),
+        ))
+        content_type = f"multipart/form-data; boundary={boundary}"
+    else:
+        body = image
+        content_type = "application/octet-stream"
+    # octet-stream 没有表单字段，阈值放在 query 与请求头里
+    parts = urllib.parse.urlsplit(endpoint)
+    query = urllib.parse.urlencode([*urllib.parse.parse_qsl(parts.query), ("general_threshold", threshold)])
+    url = urllib.parse.urlunsplit(parts._replace(query=query))
+    headers = {"Content-Type": content_type, "X-General-Threshold": str(threshold)}
+    return urllib.request.Request(url, data=body, headers=headers, method="POST")
+
+
+def _post(image_base64: str, endpoint: str, threshold: float, timeout: float, transport: str) -> dict[str, Any]:
+    req = _build_request(image_base64, endpoint, threshold, transport)
+    metrics.incr(f"wd14.request.bytes.{transport}", len(req.data))
+    started = time.monotonic()
     with urllib.request.urlopen(req, timeout=timeout) as r:
-        return json.loads(r.read().decode())
+        raw = json.loads(r.read().decode())
+    metrics.observe(f"wd14.request.{transport}", time.monotonic() - started)
+    return raw
+
+
+def _call_wd14_endpoint(
+    image_base64: str, endpoint: str, threshold: float, timeout: float, transport: str = TRANSPORT_JSON
+) -> dict[str, Any]:
+    """Synchronous HTTP POST to the WD14 tagger endpoint.
+
+    Binary transports (auto / octet-stream / multipart) upload raw image bytes. Until the
+    endpoint has returned tags for one, a rejection (non-transient HTTP error) or a reply
+    without a prompt is retried once as JSON. The transport that produced a non-empty
+    prompt is remembered for the endpoint for this process; an empty reply is never
+    taken as confirmation, so a JSON-only endpoint answering 200 with an error body is
+    not locked into binary uploads.
+    """
+    if transport == TRANSPORT_JSON:
+        return _post(image_base64, endpoint, threshold, timeout, TRANSPORT_JSON)
+
+    binary = TRANSPORT_MULTIPART if transport == TRANSPORT_MULTIPART else TRANSPORT_OCTET_STREAM
+    with _negotiated_lock:
+        known = _negotiated.get(endpoint)
+    if known == TRANSPORT_JSON:
+        return _post(image_base64, endpoint, threshold, timeout, TRANSPORT_JSON)
+    try:
+        raw = _post(image_base64, endpoint, threshold, timeout, binary)
+    except urllib.error.HTTPError as exc:
+        if known == binary or exc.code in _TRANSIENT_STATUS:
+            raise
+        logger.info("[WD14] endpoint rejected %s upload (HTTP %s), retrying as JSON", binary, exc.code)
+        return _fall_back_to_json(image_base64, endpoint, threshold, timeout)
+    if known == binary:
+        return raw
+    if not _has_prompt(raw):
+        logger.info("[WD14] %s upload returned no tags before negotiation, retrying as JSON", binary)
+        return _fall_back_to_json(image_base64, endpoint, threshold, timeout)
+    _remember_transport(endpoint, binary)
+    return raw
+
+
+def _has_prompt(raw: Any) -> bool:
+    return isinstance(raw, dict) and bool(str(raw.get("prompt") or "").strip())
+
+
+def _remember_transport(endpoint: str, transport: str) -> None:
+    with _negotiated_lock:
+        _negotiated[endpoint] = transport
+    logger.info("[WD14] endpoint transport negotiated: %s", transport)
+
+
+def _fall_back_to_json(image_base64: str, endpoint: str, threshold: float, timeout: float) -> dict[str, Any]:
+    raw = _post(image_base64, endpoint, threshold, timeout, TRANSPORT_JSON)
+    metrics.incr("wd14.transport.fallback")
+    # JSON 也没有结果时说明是这张图本身没 tag（或 endpoint 出错），暂不下结论，下次继续协商
+    if _has_prompt(raw):
+        _remember_transport(endpoint, TRANSPORT_JSON)
+    return raw
+
+
+def reset_transport_negotiation() -> None:
+    with _negotiated_lock:
+        _negotiated.clear()
+
+
+class Wd14Backend(ABC):
+    """反推后端接口：tag() 返回与远程 endpoint 相同格式的原始 dict（prompt / general / character / rating）。
+
+    cache_id 参与缓存 key，不同后端（模型）的结果互不复用。
+    """
+
+    name = "base"
+    cache_id = ""
+
+    @abstractmethod
+    async def tag(self, image_base64: str, threshold: float, timeout: float) -> dict[str, Any]:
+        """反推一张图；后端本身不可用时抛 Wd14BackendError，图片本身有问题时抛 Wd14InputError。"""
+        ...
+
+
+class RemoteWd14Backend(Wd14Backend):
+    """远程 WD14 endpoint（默认 Modal 部署）。"""
+
+    name = "remote"
+
+    def __init__(self, endpoint: str = DEFAULT_ENDPOINT, transport: str = TRANSPORT_JSON) -> None:
+        self.endpoint = endpoint or DEFAULT_ENDPOINT
+        self.transport = transport if transport in TRANSPORTS else TRANSPORT_JSON
+        self.cache_id = self.endpoint
+
+    async def tag(self, image_base64: str, threshold: float, timeout: float) -> dict[str, Any]:
+        return await asyncio.to_thread(
+            _call_wd14_endpoint, image_base64, self.endpoint, threshold, timeout, self.transport
+        )
+
+
+# 单飞：同一 cache key 正在请求中时，后来的调用方等待同一个任务
+_INFLIGHT: dict[str, "asyncio.Future[Optional[WD14Result]]"] = {}
+
+
+def _deterministic_failure(exc: BaseException) -> Optional[str]:
+    """对同一张图重试也不会成功的错误（4xx，408/429 除外）返回原因，否则返回 None。"""
+    if isinstance(exc, urllib.error.HTTPError) and 400 <= exc.code < 500 and exc.code not in (408, 429):
+        return f"HTTP {exc.code}"
+    if isinstance(exc, Wd14InputError):
+        return str(exc) or "invalid image"
+    return None
 
 
 async def reverse_tag_image(
@@ -168,49 +401,115 @@ async def reverse_tag_image(
     threshold: float = 0.35,
     timeout: float = 60.0,
     max_retries: int = 2,
+    cache: Optional[Wd14Cache] = None,
+    backend: Optional[Wd14Backend] = None,
+    fallback: Optional[Wd14Backend] = None,
 ) -> Optional[WD14Result]:
-    """Reverse-tag an image (base64) via the WD14 tagger endpoint.
+    """Reverse-tag an image (base64) via a tagger backend.
 
+    backend defaults to the remote endpoint; see wd14_local for the local ONNX backend.
+    If backend raises Wd14BackendError (e.g. the local model failed to load) and a
+    fallback backend is given, the image is tagged with the fallback instead.
     Returns WD14Result on success, None on failure.
-    Caches results by image hash (LRU, TTL 10min). Retries on transient errors.
+    Successful results are cached by (image digest, threshold, backend) in a
+    memory + SQLite tiered cache (see wd14_cache). Deterministic failures
+    (4xx, empty result) are negatively cached for a short TTL and not retried.
+    Concurrent calls for the same key share one request (single-flight).
+    Retries on transient errors.
     """
     if not image_base64:
         return None
 
-    h = _image_hash(image_base64)
-    cached = _wd14_cache_get(h)
+    backend = backend or RemoteWd14Backend(endpoint)
+    cache = cache or get_wd14_cache()
+    key = wd14_cache_key(image_base64, threshold, backend.cache_id)
+    cached = await cache.get(key)
     if cached is not None:
-        logger.info("[WD14] cache hit (hash=%s...)", h[:12])
+        logger.info("[WD14] cache hit (key=%s...)", key[:12])
         return cached
-    # None cached means "checked but failed" — don't re-hit endpoint repeatedly
-    # However we can't distinguish "never checked" from "checked and failed",
-    # so we only cache successes. Failures always retry.
+    failure = cache.failure_reason(key)
+    if failure is not None:
+        metrics.incr("wd14.cache.negative_hit")
+        logger.info("[WD14] negative cache hit (key=%s...): %s", key[:12], failure)
+        return None
+
+    pending = _INFLIGHT.get(key)
+    if pending is not None and not pending.done():
+        metrics.incr("wd14.singleflight.coalesced")
+        logger.info("[WD14] joining in-flight request (key=%s...)", key[:12])
+        return await asyncio.shield(pending)
 
+    task = asyncio.ensure_future(
+        _reverse_tag_uncached(image_base64, key, backend, threshold, timeout, max_retries, cache, fallback)
+    )
+    _INFLIGHT[key] = task
+
+    def _forget(done: "asyncio.Future[Optional[WD14Result]]") -> None:
+        if _INFLIGHT.get(key) is done:
+            del _INFLIGHT[key]
+
+    task.add_done_callback(_forget)
+    # shield：某个调用方被取消时，共享的请求仍为其他等待者继续
+    return await asyncio.shield(task)
+
+
+async def _reverse_tag_uncached(
+    image_base64: str,
+    key: str,
+    backend: Wd14Backend,
+    threshold: float,
+    timeout: float,
+    max_retries: int,
+    cache: Wd14Cache,
+    fallback: Optional[Wd14Backend] = None,
+) -> Optional[WD14Result]:
     last_error: Optional[str] = None
     for attempt in range(1, max_retries + 1):
+        deterministic: Optional[str] = None
         try:
-            raw = await asyncio.to_thread(_call_wd14_endpoint, image_base64, endpoint, threshold, timeout)
+            raw = await backend.tag(image_base64, threshold, timeout)
             result = WD14Result(raw)
             if result.success:
                 logger.info(
                     "[WD14] reverse-tag OK (attempt %s/%s): %d general tags, prompt len=%d",
-                    attempt, max_retries, len(result.general), len(result.prompt),
+                    attempt, max_retries, result.general_count, len(result.prompt),
                 )
-                _wd14_cache_set(h, result)
+                await cache.set(key, result)
                 return result
             logger.warning("[WD14] reverse-tag returned empty prompt (attempt %s/%s): %s", attempt, max_retries, str(raw)[:200])
-            last_error = "empty prompt"
-        except (urllib.error.URLError, asyncio.TimeoutError, OSError) as exc:
+            last_error = deterministic = "empty prompt"
+        except Wd14BackendError as exc:
+            if fallback is None:
+                logger.error("[WD14] %s backend unavailable: %s", backend.name, exc)
+                return None
+            metrics.incr(f"wd14.backend.fallback.{fallback.name}")
+            logger.warning("[WD14] %s backend unavailable (%s), falling back to %s", backend.name, exc, fallback.name)
+            return await reverse_tag_image(
+                image_base64,
+                threshold=threshold,
+                timeout=timeout,
+                max_retries=max_retries,
+                cache=cache,
+                backend=fallback,
+            )
+        except (urllib.error.URLError, asyncio.TimeoutError, OSError, Wd14InputError) as exc:
             last_error = str(exc)
+            deterministic = _deterministic_failure(exc)
             logger.warning("[WD14] reverse-tag request failed (attempt %s/%s): %s", attempt, max_retries, exc)
         except Exception as exc:
             last_error = str(exc)
             logger.error("[WD14] reverse-tag unexpected error (attempt %s/%s): %s", attempt, max_retries, exc, exc_info=True)
 
+        if deterministic is not None:
+            cache.remember_failure(key, deterministic)
+            metrics.incr("wd14.cache.negative_store")
+            logger.error("[WD14] reverse-tag failed deterministically, not retrying: %s", deterministic)
+            return None
+
         if attempt < max_retries:
             backoff = 2.0 * attempt
             logger.info("[WD14] retrying in %.1fs ...", backoff)
             await asyncio.sleep(backoff)
 
     logger.error("[WD14] reverse-tag exhausted %s retries: %s", max_retries, last_error)
-    return None
\ No newline at end of file
+    return None
@@ -0,0 +1,333 @@
+"""
+本地 WD14 反推（ONNX Runtime，CPU）。
+
+远程 endpoint 有冷启动和网络往返，还依赖外部服务。本地后端直接加载 WD14 tagger 的
+model.onnx + selected_tags.csv（SmilingWolf wd-v1-4 / wd-v3 系列格式）：
+- 模型懒加载：首次反推时才在工作线程里建 InferenceSession，进程内共享一份
+- 预处理：draft 解码到接近模型输入尺寸，透明通道合成白底、补成正方形、RGB→BGR 都用 NumPy 整块完成
+- 推理：短时间窗口内到达的多张图拼成一个 batch，在专用线程池里跑一次 session.run
+  （ONNX Runtime 推理时释放 GIL，线程池即可并行，不必像图片进程池那样每个进程各加载一份模型）
+- 后处理：按类别下标 + 阈值向量化筛选，输出与远程 endpoint 相同格式的 dict，缓存与 WD14Result 无需区分来源
+
+onnxruntime 是可选依赖：未安装或模型文件缺失时 get_local_tagger() 返回 None，调用方退回远程 endpoint。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import base64
+import binascii
+import csv
+import importlib.util
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Optional
+
+from src.common.logger import get_logger
+
+from . import metrics
+from .utils import RESIZE_FAST, _downscale, _open_for_downscale
+from .vibe_cache import _get_db_dir
+from .wd14_client import Wd14Backend, Wd14BackendError, Wd14InputError
+
+logger = get_logger("MaiBot_LLM2pic")
+
+MODEL_FILENAME = "model.onnx"
+TAGS_FILENAME = "selected_tags.csv"
+_DEFAULT_MODEL_DIRNAME = "wd14_model"
+# 模型输入尺寸是符号维度时的默认值（wd-v1-4 / wd-v3 均为 448）
+_DEFAULT_INPUT_SIZE = 448
+
+# selected_tags.csv 的 category 取值
+_CATEGORY_GENERAL = 0
+_CATEGORY_CHARACTER = 4
+_CATEGORY_RATING = 9
+
+# 攒 batch 的等待窗口：首张图预处理完后最多再等这么久
+_BATCH_WINDOW_SECONDS = 0.01
+
+# 颜文字 tag 保留下划线，其余 tag 下划线换成空格（与远程 endpoint 的 prompt 一致）
+_KAOMOJIS = frozenset({
+    "0_0", "(o)_(o)", "+_+", "+_-", "._.", "<o>_<o>", "<|>_<|>", "=_=", ">_<",
+    "3_3", "6_9", ">_o", "@_@", "^_^", "o_o", "u_u", "x_x", "|_|", "||_||",
+})
+
+
+def default_model_dir() -> Path:
+    return _get_db_dir() / _DEFAULT_MODEL_DIRNAME
+
+
+def _fit(width: int, height: int, size: int) -> tuple[int, int]:
+    """长边缩放到 size（保持比例），补边在 NumPy 里做。"""
+    scale = size / float(max(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _preprocess(image_base64: str, size: int) -> Any:
+    """解码并转成模型输入：size x size x 3 的 float32 BGR，0-255，白底居中。"""
+    import numpy as np
+
+    try:
+        img = _open_for_downscale(base64.b64decode(image_base64), lambda w, h: _fit(w, h, size), RESIZE_FAST)
+    except (binascii.Error, OSError, ValueError) as exc:
+        raise Wd14InputError(f"无法解码图片: {exc}") from exc
+
+    has_alpha = img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info
+    img = _downscale(img.convert("RGBA" if has_alpha else "RGB"), _fit(*img.size, size), RESIZE_FAST)
+    pixels = np.asarray(img, dtype=np.float32)
+    if has_alpha:
+        alpha = pixels[..., 3:] * (1.0 / 255.0)
+        pixels = pixels[..., :3] * alpha + 255.0 * (1.0 - alpha)
+
+    canvas = np.full((size, size, 3), 255.0, dtype=np.float32)
+    height, width = pixels.shape[:2]
+    top, left = (size - height) // 2, (size - width) // 2
+    canvas[top : top + height, left : left + width] = pixels
+    return canvas[..., ::-1]
+
+
+class _Model:
+    """已加载的 session 与 tag 表，只读，线程间共享。"""
+
+    def __init__(self, model_dir: Path, threads: int) -> None:
+        try:
+            import numpy as np
+            import onnxruntime as ort
+        except ImportError as exc:
+            raise Wd14BackendError(f"onnxruntime 未安装: {exc}") from exc
+
+        model_path, tags_path = model_dir / MODEL_FILENAME, model_dir / TAGS_FILENAME
+        if not model_path.is_file() or not tags_path.is_file():
+            raise Wd14BackendError(f"模型目录缺少 {MODEL_FILENAME} 或 {TAGS_FILENAME}: {model_dir}")
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        try:
+            self.session = ort.InferenceSession(str(model_path), sess_options=options, providers=["CPUExecutionProvider"])
+        except Exception as exc:
+            raise Wd14BackendError(f"加载模型失败: {exc}") from exc
+
+        model_input = self.session.get_inputs()[0]
+        shape = list(model_input.shape)
+        self.input_name = model_input.name
+        self.output_name = self.session.get_outputs()[0].name
+        self.channels_first = len(shape) == 4 and shape[1] == 3
+        spatial = shape[2] if self.channels_first else shape[1]
+        self.size = spatial if isinstance(spatial, int) and spatial > 0 else _DEFAULT_INPUT_SIZE
+        # 导出时 batch 维写死为 1 的模型只能逐张跑
+        self.fixed_batch = isinstance(shape[0], int) and shape[0] > 0
+
+        names: list[str] = []
+        categories: list[int] = []
+        with open(tags_path, "r", encoding="utf-8", newline="") as f:
+            for row in csv.DictReader(f):
+                name = row.get("name") or ""
+                names.append(name if name in _KAOMOJIS else name.replace("_", " "))
+                categories.append(int(row.get("category") or _CATEGORY_GENERAL))
+        category_array = np.asarray(categories, dtype=np.int16)
+        self.names = np.asarray(names, dtype=object)
+        self.general_idx = np.flatnonzero(category_array == _CATEGORY_GENERAL)
+        self.character_idx = np.flatnonzero(category_array == _CATEGORY_CHARACTER)
+        self.rating_idx = np.flatnonzero(category_array == _CATEGORY_RATING)
+
+    def infer(self, batch: Any) -> Any:
+        import numpy as np
+
+        if self.channels_first:
+            batch = batch.transpose(0, 3, 1, 2)
+        batch = np.ascontiguousarray(batch, dtype=np.float32)
+        if self.fixed_batch and len(batch) > 1:
+            return np.concatenate([self.session.run([self.output_name], {self.input_name: row[None]})[0] for row in batch])
+        return self.session.run([self.output_name], {self.input_name: batch})[0]
+
+    def _select(self, probs: Any, indices: Any, threshold: float) -> dict[str, float]:
+        import numpy as np
+
+        picked = indices[probs[indices] >= threshold]
+        picked = picked[np.argsort(-probs[picked], kind="stable")]
+        return dict(zip(self.names[picked].tolist(), probs[picked].astype(float).tolist()))
+
+    def postprocess(self, probs: Any, threshold: float, character_threshold: float) -> dict[str, Any]:
+        """单张图的输出向量 → 与远程 endpoint 相同格式的 dict。"""
+        general = self._select(probs, self.general_idx, threshold)
+        return {
+            "prompt": ", ".join(general),
+            "general": general,
+            "character": self._select(probs, self.character_idx, character_threshold),
+            "rating": dict(zip(self.names[self.rating_idx].tolist(), probs[self.rating_idx].astype(float).tolist())),
+        }
+
+
+class LocalWd14Tagger(Wd14Backend):
+    """本地 ONNX 反推后端：懒加载共享模型，并发请求攒成 batch 推理。"""
+
+    name = "local"
+
+    def __init__(
+        self,
+        model_dir: Path,
+        *,
+        threads: int = 2,
+        batch_size: int = 4,
+        character_threshold: float = 0.85,
+    ) -> None:
+        self.model_dir = model_dir
+        self.threads = max(1, int(threads))
+        self.batch_size = max(1, int(batch_size))
+        self.character_threshold = float(character_threshold)
+        self.cache_id = f"local:{model_dir}"
+        self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="llm2pic-wd14")
+        self._model_lock = threading.Lock()
+        self._model: Optional[_Model] = None
+        self._load_error: Optional[Wd14BackendError] = None
+        self._pending: list[tuple[Any, "asyncio.Future[Any]"]] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._active = 0
+        self._retired = False
+
+    # ── 工作线程中执行 ──
+
+    def _get_model(self) -> _Model:
+        with self._model_lock:
+            if self._model is None:
+                if self._load_error is not None:
+                    raise self._load_error
+                started = time.monotonic()
+                try:
+                    self._model = _Model(self.model_dir, self.threads)
+                except Wd14BackendError as exc:
+                    self._load_error = exc
+                    raise
+                elapsed = time.monotonic() - started
+                metrics.observe("wd14.local.load", elapsed)
+                logger.info(
+                    f"[WD14Local] 模型已加载: {self.model_dir}（输入 {self._model.size}px，"
+                    f"{len(self._model.names)} 个 tag），耗时 {elapsed * 1000:.0f}ms"
+                )
+            return self._model
+
+    def _prepare(self, image_base64: str) -> Any:
+        started = time.monotonic()
+        pixels = _preprocess(image_base64, self._get_model().size)
+        metrics.observe("wd14.local.preprocess", time.monotonic() - started)
+        return pixels
+
+    def _run_batch(self, batch: Any) -> Any:
+        started = time.monotonic()
+        probs = self._get_model().infer(batch)
+        metrics.observe("wd14.local.inference", time.monotonic() - started)
+        metrics.incr("wd14.local.batches")
+        metrics.incr("wd14.local.images", len(batch))
+        return probs
+
+    # ── 事件循环中执行 ──
+
+    def _flush(self) -> None:
+        import numpy as np
+
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch = [(pixels, future) for pixels, future in self._pending if not future.done()]
+        self._pending = []
+        if not batch:
+            return
+        running = asyncio.get_running_loop().run_in_executor(
+            self._executor, self._run_batch, np.stack([pixels for pixels, _ in batch])
+        )
+
+        def _deliver(done: "asyncio.Future[Any]") -> None:
+            # 线程池被关掉时不能把 CancelledError 塞给等待方，否则会连带取消整个出图流程
+            error = done.exception() if not done.cancelled() else Wd14BackendError("local tagger was shut down")
+            for row, (_, future) in enumerate(batch):
+                if future.done():
+                    continue
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(done.result()[row])
+
+        running.add_done_callback(_deliver)
+
+    async def _tag(self, image_base64: str, threshold: float) -> dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        pixels = await loop.run_in_executor(self._executor, self._prepare, image_base64)
+        future: "asyncio.Future[Any]" = loop.create_future()
+        self._pending.append((pixels, future))
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(_BATCH_WINDOW_SECONDS, self._flush)
+        probs = await future
+        return self._model.postprocess(probs, threshold, self.character_threshold)
+
+    async def tag(self, image_base64: str, threshold: float, timeout: float) -> dict[str, Any]:
+        if self._retired:
+            raise Wd14BackendError("local tagger was replaced")
+        self._active += 1
+        try:
+            return await asyncio.wait_for(self._tag(image_base64, threshold), timeout)
+        finally:
+            self._active -= 1
+            if self._retired and not self._active:
+                self.shutdown()
+
+    def retire(self) -> None:
+        """配置变更、被新实例替换时调用：不再接新请求，在途的请求与 batch 跑完后再关线程池。"""
+        self._retired = True
+        if not self._active:
+            self.shutdown()
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_tagger: Optional[LocalWd14Tagger] = None
+_tagger_settings: Optional[tuple[Any, ...]] = None
+_warned_settings: Optional[tuple[Any, ...]] = None
+
+
+def get_local_tagger(
+    model_dir: str = "",
+    threads: int = 2,
+    batch_size: int = 4,
+    character_threshold: float = 0.85,
+) -> Optional[LocalWd14Tagger]:
+    """取共享的本地反推后端；onnxruntime 未安装或模型文件缺失时返回 None（同一配置只告警一次）。
+
+    这里只检查依赖与文件是否存在，模型在首次反推时才加载。
+    """
+    global _tagger, _tagger_settings, _warned_settings
+    settings = (model_dir, threads, batch_size, character_threshold)
+    if _tagger is not None and settings == _tagger_settings:
+        return _tagger
+
+    path = Path(model_dir).expanduser() if model_dir else default_model_dir()
+    problem = ""
+    if importlib.util.find_spec("onnxruntime") is None:
+        problem = "未安装 onnxruntime"
+    elif not (path / MODEL_FILENAME).is_file() or not (path / TAGS_FILENAME).is_file():
+        problem = f"{path} 下缺少 {MODEL_FILENAME} 或 {TAGS_FILENAME}"
+    if problem:
+        if settings != _warned_settings:
+            _warned_settings = settings
+            logger.warning(f"[WD14Local] 本地反推不可用（{problem}），改用远程 endpoint")
+        return None
+
+    if _tagger is not None:
+        _tagger.retire()
+    _tagger = LocalWd14Tagger(path, threads=threads, batch_size=batch_size, character_threshold=character_threshold)
+    _tagger_settings = settings
+    return _tagger
+
+
+def reset_local_tagger() -> None:
+    global _tagger, _tagger_settings, _warned_settings
+    if _tagger is not None:
+        _tagger.shutdown()
+    _tagger = None
+    _tagger_settings = None
+    _warned_settings = None